@@ -0,0 +1,440 @@
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Asyncio
+
+KCP over asyncio datagram or stream transports, without tornado. It runs on
+any asyncio event loop, uvloop included.
+
+    async def echo(kcpstream):
+        async for message in kcpstream:
+            await kcpstream.send(message)
+            await kcpstream.drain()
+
+    server = await start_udp_server(echo, '0.0.0.0', 8888)
+    kcpstream = await open_udp_connection('127.0.0.1', 8888)
+
+The handshakes are the ones of UDPServer and TCPServer, so asyncio and
+tornado peers can talk to each other.
+'''
+
+import asyncio
+import struct
+from collections import deque
+from pykcp.kcp import KCP, IKCP_OVERHEAD
+from pykcp.batch import packets_length
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD, IKCP_CONV_MAX_SIZE
+
+IKCP_CONV_FORMAT = '<I'
+IKCP_HANDSHAKE_INTERVAL = 1.0
+
+class AsyncKCPStream(KCPStream):
+    '''
+    KCP stream with async recv and send
+
+    Timers run on loop.call_at of the asyncio loop given as ioloop.
+    '''
+
+    def __init__(self, kcp, stream, address, ioloop, close_callback=None, **kwargs):
+        KCPStream.__init__(self, kcp, stream, address, ioloop, **kwargs)
+        self.messages = deque()
+        self.waiter = None
+        self.close_callback = close_callback
+
+    def remove_timeout(self):
+        '''
+        Remove the pending timeout
+        '''
+        if self.timeout_handle:
+            self.timeout_handle.cancel()
+            self.timeout_handle = None
+
+    def handle_messages(self, messages):
+        '''
+        Queue messages for recv
+        '''
+        self.messages.extend(messages)
+        self.wake_waiter()
+
+    def wake_waiter(self):
+        '''
+        Wake the pending recv
+        '''
+        waiter = self.waiter
+        if waiter is not None:
+            self.waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def recv(self):
+        '''
+        Receive a message, None once the stream is closed
+        '''
+        while not self.messages:
+            if self.closed:
+                return None
+            self.waiter = self.ioloop.create_future()
+            await self.waiter
+        return self.messages.popleft()
+
+    async def send(self, data):
+        '''
+        Send
+        '''
+        return KCPStream.send(self, data)
+
+    def create_future(self):
+        '''
+        Future of the asyncio loop
+        '''
+        return self.ioloop.create_future()
+
+    async def drain(self):
+        '''
+        Wait until the stream is not paused, see KCPStream
+        '''
+        await KCPStream.drain(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.recv()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    def close(self):
+        '''
+        Close
+        '''
+        if self.closed:
+            return
+        KCPStream.close(self)
+        self.wake_waiter()
+        if callable(self.close_callback):
+            self.close_callback(self)
+
+def run_callback(loop, callback, kcpstream):
+    '''
+    Run a client connected callback, coroutine functions become tasks
+    '''
+    result = callback(kcpstream)
+    if asyncio.iscoroutine(result):
+        loop.create_task(result)
+
+class KCPDatagramProtocol(asyncio.DatagramProtocol):
+    '''
+    Server side datagram protocol, datagrams are routed by conv
+    '''
+
+    def __init__(self, client_connected_cb, loop, **kwargs):
+        self.client_connected_cb = client_connected_cb
+        self.loop = loop
+        self.kwargs = kwargs
+        self.conv = 0
+        self.kcpstream_dct = {}
+        self.address_dct = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < IKCP_OVERHEAD:
+            if data == IKCP_HANDSHAKE_KEYWORD:
+                self.handle_handshake(addr)
+            return
+        conv = struct.unpack_from(IKCP_CONV_FORMAT, data)[0]
+        kcpstream = self.kcpstream_dct.get(conv)
+        if kcpstream is None:
+            return
+        if kcpstream.address == addr:
+            kcpstream.input(data)
+            return
+        kcp = kcpstream.kcp
+        rcv_nxt, snd_una = kcp.rcv_nxt, kcp.snd_una
+        # convs are easy to guess, only a packet moving the conversation
+        # forward proves the peer moved
+        if kcpstream.input(data) >= 0 and\
+                (kcp.rcv_nxt != rcv_nxt or kcp.snd_una != snd_una):
+            # peer NAT rebinding, follow the conversation
+            self.address_dct.pop(kcpstream.address, None)
+            self.address_dct[addr] = conv
+            kcpstream.address = addr
+
+    def error_received(self, exc):
+        # ICMP errors of a datagram socket, KCP retransmits or times out
+        pass
+
+    def handle_handshake(self, address):
+        '''
+        Handle handshake, a repeated handshake gets the same conv again
+        '''
+        conv = self.address_dct.get(address)
+        if conv is None:
+            conv = self.create_conv()
+            kcpstream = AsyncKCPStream(KCP(conv, self.output), self.transport, address,\
+                    self.loop, close_callback=self.close_stream, **self.kwargs)
+            self.kcpstream_dct[conv] = kcpstream
+            self.address_dct[address] = conv
+            kcpstream.update()
+            run_callback(self.loop, self.client_connected_cb, kcpstream)
+        self.transport.sendto(b'%d\n\n\n' % conv, address)
+
+    def create_conv(self):
+        '''
+        Create conv
+        '''
+        self.conv += 1
+        return self.conv
+
+    def close_stream(self, kcpstream):
+        '''
+        Forget a closed stream
+        '''
+        conv = kcpstream.kcp.conv
+        self.kcpstream_dct.pop(conv, None)
+        if self.address_dct.get(kcpstream.address) == conv:
+            del self.address_dct[kcpstream.address]
+
+    def close(self):
+        '''
+        Close every stream and the transport
+        '''
+        for kcpstream in list(self.kcpstream_dct.values()):
+            kcpstream.close()
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def output(self, kcp, data):
+        '''
+        Output
+        '''
+        kcpstream = self.kcpstream_dct.get(kcp.conv)
+        if kcpstream and self.transport:
+            self.transport.sendto(data, kcpstream.address)
+
+class KCPClientDatagramProtocol(asyncio.DatagramProtocol):
+    '''
+    Client side datagram protocol
+    '''
+
+    def __init__(self, loop, **kwargs):
+        self.loop = loop
+        self.kwargs = kwargs
+        self.kcpstream = None
+        self.transport = None
+        self.handshake_handle = None
+        self.connected = loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send_handshake()
+
+    def send_handshake(self):
+        '''
+        Send handshake until the server tells us our conv
+        '''
+        self.handshake_handle = None
+        if self.kcpstream or not self.transport:
+            return
+        self.transport.sendto(IKCP_HANDSHAKE_KEYWORD)
+        self.handshake_handle = self.loop.call_later(IKCP_HANDSHAKE_INTERVAL,\
+                self.send_handshake)
+
+    def datagram_received(self, data, addr):
+        if len(data) >= IKCP_OVERHEAD:
+            if self.kcpstream:
+                self.kcpstream.input(data)
+            return
+        if self.kcpstream or not data.endswith(b'\n\n\n'):
+            return
+        if self.handshake_handle:
+            self.handshake_handle.cancel()
+            self.handshake_handle = None
+        self.kcpstream = AsyncKCPStream(KCP(int(data.strip()), self.output),\
+                self.transport, addr, self.loop, close_callback=self.close_stream,\
+                **self.kwargs)
+        self.kcpstream.update()
+        if not self.connected.done():
+            self.connected.set_result(self.kcpstream)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        if self.handshake_handle:
+            self.handshake_handle.cancel()
+            self.handshake_handle = None
+        if not self.connected.done():
+            self.connected.set_exception(exc or ConnectionError('Handshake failed'))
+        if self.kcpstream:
+            self.kcpstream.close()
+
+    def close_stream(self, kcpstream):
+        '''
+        Close the transport with the stream
+        '''
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def output(self, kcp, data):
+        '''
+        Output
+        '''
+        if self.transport:
+            self.transport.sendto(data)
+
+class KCPStreamProtocol(asyncio.Protocol):
+    '''
+    KCP over a stream transport, speaking the handshake of TCPServer
+
+    The server side is given its conv, the client side reads it.
+    '''
+
+    def __init__(self, loop, conv=None, client_connected_cb=None, **kwargs):
+        self.loop = loop
+        self.conv = conv
+        self.is_server = conv is not None
+        self.client_connected_cb = client_connected_cb
+        self.kwargs = kwargs
+        self.kcpstream = None
+        self.transport = None
+        self.handshaked = False
+        self.buffer = bytearray()
+        self.connected = loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.is_server:
+            transport.write(b'%d\n\n\n' % self.conv)
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+        if not self.handshaked and not self.handshake():
+            return
+        end = packets_length(self.buffer)
+        if end < 0:
+            # corrupt stream, do not buffer it without end
+            self.transport.close()
+            return
+        if end:
+            with memoryview(self.buffer) as view:
+                self.kcpstream.input(view[:end])
+            del self.buffer[:end]
+
+    def handshake(self):
+        '''
+        Go through the handshake, return True when it is done
+        '''
+        if self.conv is None:
+            # client, read the conv then wait for the server to confirm
+            index = self.buffer.find(b'\n\n\n')
+            if index < 0:
+                if len(self.buffer) > IKCP_CONV_MAX_SIZE:
+                    self.transport.close()
+                return False
+            self.conv = int(self.buffer[:index])
+            del self.buffer[:index+3]
+            self.transport.write(IKCP_HANDSHAKE_KEYWORD)
+        if len(self.buffer) < len(IKCP_HANDSHAKE_KEYWORD):
+            return False
+        if not self.buffer.startswith(IKCP_HANDSHAKE_KEYWORD):
+            self.transport.close()
+            return False
+        del self.buffer[:len(IKCP_HANDSHAKE_KEYWORD)]
+        if self.is_server:
+            self.transport.write(IKCP_HANDSHAKE_KEYWORD)
+        self.handshaked = True
+        self.kcpstream = AsyncKCPStream(KCP(self.conv, self.output), self.transport,\
+                self.transport.get_extra_info('peername'), self.loop,\
+                close_callback=self.close_stream, **self.kwargs)
+        self.kcpstream.update()
+        if self.is_server:
+            run_callback(self.loop, self.client_connected_cb, self.kcpstream)
+        self.connected.set_result(self.kcpstream)
+        return True
+
+    def connection_lost(self, exc):
+        if not self.connected.done():
+            self.connected.set_exception(exc or ConnectionError('Handshake failed'))
+        if self.kcpstream:
+            self.kcpstream.close()
+
+    def close_stream(self, kcpstream):
+        '''
+        Close the transport with the stream
+        '''
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def output(self, kcp, data):
+        '''
+        Output
+        '''
+        if self.transport:
+            self.transport.write(data)
+
+async def start_udp_server(client_connected_cb, host=None, port=None, **kwargs):
+    '''
+    Start a KCP server on a datagram socket, return its protocol
+
+    client_connected_cb is called with an AsyncKCPStream for each session, it
+    can be a coroutine function. Other keyword arguments go to the streams.
+    '''
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(\
+            lambda: KCPDatagramProtocol(client_connected_cb, loop, **kwargs),\
+            local_addr=(host, port))
+    return protocol
+
+async def open_udp_connection(host, port, **kwargs):
+    '''
+    Connect to a KCP datagram server, return an AsyncKCPStream
+    '''
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_datagram_endpoint(\
+            lambda: KCPClientDatagramProtocol(loop, **kwargs),\
+            remote_addr=(host, port))
+    return await protocol.connected
+
+async def start_tcp_server(client_connected_cb, host=None, port=None, **kwargs):
+    '''
+    Start a KCP server on a stream socket, return the asyncio server
+    '''
+    loop = asyncio.get_running_loop()
+    counter = [0]
+
+    def protocol_factory():
+        counter[0] += 1
+        return KCPStreamProtocol(loop, conv=counter[0],\
+                client_connected_cb=client_connected_cb, **kwargs)
+
+    return await loop.create_server(protocol_factory, host, port)
+
+async def open_tcp_connection(host, port, **kwargs):
+    '''
+    Connect to a KCP stream server, return an AsyncKCPStream
+    '''
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(\
+            lambda: KCPStreamProtocol(loop, **kwargs), host, port)
+    return await protocol.connected
@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Batched socket I/O
+
+Every KCP flush hands its packets to the output callback one by one. An
+OutputBatcher collects them for the rest of the IOLoop iteration, so a
+scheduler tick flushing thousands of sessions ends with one batch instead
+of thousands of writes. Datagram batches go out with sendmmsg on linux and
+are read back with recvmmsg into a ring of preallocated buffers, other
+platforms fall back to one sendto / recvfrom_into per datagram.
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+from pykcp.kcp import IKCP_OVERHEAD
+
+IKCP_DATAGRAM_SIZE = 65536
+IKCP_READ_SIZE = 65536
+IKCP_BATCH_SIZE = 64
+IKCP_RECV_BUFFERS = 32
+IKCP_LEN_FORMAT = '<I'
+IKCP_LEN_OFFSET = 20
+IKCP_MAX_LENGTH = 65535      # longest segment data accepted from a stream
+IKCP_SOCKADDR_SIZE = 128
+
+class iovec(ctypes.Structure): # pylint: disable=invalid-name
+    '''
+    struct iovec
+    '''
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+class msghdr(ctypes.Structure): # pylint: disable=invalid-name
+    '''
+    struct msghdr
+    '''
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure): # pylint: disable=invalid-name
+    '''
+    struct mmsghdr
+    '''
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint),
+    ]
+
+def load_libc():
+    '''
+    libc with sendmmsg and recvmmsg, None when they are not there
+    '''
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,\
+                ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+LIBC = load_libc()
+HAS_MMSG = LIBC is not None
+
+def encode_sockaddr(address):
+    '''
+    struct sockaddr_in / sockaddr_in6 of an address tuple
+    '''
+    if len(address) == 2:
+        return struct.pack('=H', socket.AF_INET) + struct.pack('!H', address[1]) +\
+                socket.inet_pton(socket.AF_INET, address[0]) + b'\0' * 8
+    host, port, flowinfo, scope_id = address
+    return struct.pack('=H', socket.AF_INET6) + struct.pack('!HI', port, flowinfo) +\
+            socket.inet_pton(socket.AF_INET6, host) + struct.pack('=I', scope_id)
+
+def decode_sockaddr(data):
+    '''
+    Address tuple of a struct sockaddr_in / sockaddr_in6, as recvfrom returns it
+    '''
+    family = struct.unpack_from('=H', data)[0]
+    if family == socket.AF_INET:
+        return (socket.inet_ntop(socket.AF_INET, data[4:8]),\
+                struct.unpack_from('!H', data, 2)[0])
+    port, flowinfo = struct.unpack_from('!HI', data, 2)
+    return (socket.inet_ntop(socket.AF_INET6, data[8:24]), port, flowinfo,\
+            struct.unpack_from('=I', data, 24)[0])
+
+def send_datagram(sock, data, address=None):
+    '''
+    Send one datagram, dropping it when the socket buffer is full
+
+    A dropped datagram is recovered by KCP retransmission.
+    '''
+    try:
+        if address is None:
+            sock.send(data)
+        else:
+            sock.sendto(data, address)
+    except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+        pass
+    except OSError as e:
+        if e.errno != errno.ENOBUFS:
+            raise
+
+def recv_datagrams(sock, callback):
+    '''
+    Read every pending datagram of a non-blocking socket
+    '''
+    while True:
+        try:
+            data, address = sock.recvfrom(IKCP_DATAGRAM_SIZE)
+        except (BlockingIOError, InterruptedError):
+            break
+        except ConnectionRefusedError:
+            # ICMP port unreachable from a previous send, ignore it
+            continue
+        callback(data, address)
+
+def sendmmsg(sock, datagrams, sockaddr_dct=None):
+    '''
+    Send (data, address) pairs with sendmmsg, return how many were handed to the kernel
+
+    Like send_datagram, the rest of a batch is dropped when the socket buffer
+    is full. sockaddr_dct caches the encoded addresses between calls.
+    '''
+    count = len(datagrams)
+    msgs = (mmsghdr * count)()
+    iovs = (iovec * count)()
+    names = []
+    if sockaddr_dct is None:
+        sockaddr_dct = {}
+    for i, (data, address) in enumerate(datagrams):
+        iov = iovs[i]
+        # c_char_p points into the bytes object, datagrams keeps it alive
+        iov.iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+        iov.iov_len = len(data)
+        hdr = msgs[i].msg_hdr
+        hdr.msg_iov = ctypes.pointer(iov)
+        hdr.msg_iovlen = 1
+        if address is not None:
+            name = sockaddr_dct.get(address)
+            if name is None:
+                try:
+                    raw = encode_sockaddr(address)
+                except OSError:
+                    raise ValueError('not a numeric address %r' % (address,))
+                name = sockaddr_dct[address] = (ctypes.c_char * len(raw)).from_buffer_copy(raw)
+            names.append(name)
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = len(name)
+    fd = sock.fileno()
+    sent = 0
+    while sent < count:
+        ret = LIBC.sendmmsg(fd, ctypes.byref(msgs, sent * ctypes.sizeof(mmsghdr)),\
+                count - sent, 0)
+        if ret >= 0:
+            sent += ret
+            continue
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            continue
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+            break
+        if err in (errno.EBADF, errno.ENOTSOCK):
+            raise OSError(err, os.strerror(err))
+        # only the first datagram failed, skip it like sendto would
+        sent += 1
+    return sent
+
+def send_datagrams(sock, datagrams, sockaddr_dct=None):
+    '''
+    Send a batch of (data, address) pairs
+    '''
+    if HAS_MMSG and sock.family in (socket.AF_INET, socket.AF_INET6):
+        for start in range(0, len(datagrams), IKCP_BATCH_SIZE):
+            try:
+                sendmmsg(sock, datagrams[start:start+IKCP_BATCH_SIZE], sockaddr_dct)
+            except (TypeError, ValueError):
+                # address needs the resolver (scoped ipv6, hostname), go slow
+                for data, address in datagrams[start:start+IKCP_BATCH_SIZE]:
+                    send_datagram(sock, data, address)
+        return
+    for data, address in datagrams:
+        send_datagram(sock, data, address)
+
+def packets_length(buffer, max_length=IKCP_MAX_LENGTH):
+    '''
+    Length of the complete KCP segments at the start of a stream buffer
+
+    -1 when a head claims more than max_length bytes of data, the stream is
+    corrupt and would make the buffer grow without end, close it.
+    '''
+    size = len(buffer)
+    offset = 0
+    while size - offset >= IKCP_OVERHEAD:
+        length = struct.unpack_from(IKCP_LEN_FORMAT, buffer, offset + IKCP_LEN_OFFSET)[0]
+        if length > max_length:
+            return -1
+        end = offset + IKCP_OVERHEAD + length
+        if end > size:
+            break
+        offset = end
+    return offset
+
+class OutputBatcher(object):
+    '''
+    Collect items until the end of the current IOLoop iteration
+
+    callback gets the list of every item appended meanwhile.
+    '''
+
+    __slots__ = ('callback', 'ioloop', 'pending')
+
+    def __init__(self, callback, ioloop):
+        self.callback = callback
+        self.ioloop = ioloop
+        self.pending = []
+
+    def append(self, item):
+        '''
+        Queue an item, the first one of a batch schedules the flush
+        '''
+        if not self.pending:
+            self.ioloop.add_callback(self.flush)
+        self.pending.append(item)
+
+    def flush(self):
+        '''
+        Hand the queued items to the callback
+        '''
+        pending = self.pending
+        if pending:
+            self.pending = []
+            self.callback(pending)
+
+    def __len__(self):
+        return len(self.pending)
+
+class DatagramSender(OutputBatcher):
+    '''
+    Send the datagrams of one IOLoop iteration together
+    '''
+
+    __slots__ = ('socket', 'sockaddr_dct')
+
+    def __init__(self, sock, ioloop):
+        OutputBatcher.__init__(self, self.send_datagrams, ioloop)
+        self.socket = sock
+        self.sockaddr_dct = {}
+
+    def send(self, data, address=None):
+        '''
+        Queue one datagram
+        '''
+        self.append((data, address))
+
+    def send_datagrams(self, datagrams):
+        '''
+        Send a batch
+        '''
+        if self.socket.fileno() < 0:
+            return
+        if len(self.sockaddr_dct) > 4 * IKCP_BATCH_SIZE:
+            self.sockaddr_dct.clear()
+        send_datagrams(self.socket, datagrams, self.sockaddr_dct)
+
+class DatagramReceiver(object):
+    '''
+    Read datagrams into a ring of preallocated buffers
+
+    The data handed to the callback is a memoryview of a ring buffer which is
+    reused by the next read, KCP.input copies what it keeps.
+    '''
+
+    __slots__ = ('socket', 'count', 'size', 'buffers', 'views', 'names', 'msgs',\
+            'address_dct')
+
+    def __init__(self, sock, count=IKCP_RECV_BUFFERS, size=IKCP_DATAGRAM_SIZE):
+        self.socket = sock
+        self.count = count
+        self.size = size
+        self.buffers = [(ctypes.c_char * size)() for _ in range(count)]
+        self.views = [memoryview(buffer).cast('B') for buffer in self.buffers]
+        self.names = None
+        self.msgs = None
+        self.address_dct = {}
+        if HAS_MMSG:
+            self.names = [ctypes.create_string_buffer(IKCP_SOCKADDR_SIZE)\
+                    for _ in range(count)]
+            self.msgs = (mmsghdr * count)()
+            iovs = (iovec * count)()
+            for i in range(count):
+                iovs[i].iov_base = ctypes.addressof(self.buffers[i])
+                iovs[i].iov_len = size
+                hdr = self.msgs[i].msg_hdr
+                hdr.msg_iov = ctypes.pointer(iovs[i])
+                hdr.msg_iovlen = 1
+                hdr.msg_name = ctypes.addressof(self.names[i])
+
+    def recv(self, callback):
+        '''
+        Read every pending datagram
+        '''
+        if self.msgs is not None and self.socket.family in (socket.AF_INET, socket.AF_INET6):
+            self.recvmmsg(callback)
+        else:
+            self.recvfrom(callback)
+
+    def recvmmsg(self, callback):
+        '''
+        recvmmsg until the socket is drained
+        '''
+        fd = self.socket.fileno()
+        msgs = self.msgs
+        views = self.views
+        names = self.names
+        address_dct = self.address_dct
+        while True:
+            for msg in msgs:
+                msg.msg_hdr.msg_namelen = IKCP_SOCKADDR_SIZE
+            ret = LIBC.recvmmsg(fd, msgs, self.count, socket.MSG_DONTWAIT, None)
+            if ret < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EINTR, errno.ECONNREFUSED):
+                    continue
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise OSError(err, os.strerror(err))
+            for i in range(ret):
+                name = names[i].raw[:msgs[i].msg_hdr.msg_namelen]
+                address = address_dct.get(name)
+                if address is None:
+                    if len(address_dct) > 4 * IKCP_BATCH_SIZE:
+                        address_dct.clear()
+                    address = address_dct[name] = decode_sockaddr(name)
+                callback(views[i][:msgs[i].msg_len], address)
+            if ret < self.count:
+                return
+
+    def recvfrom(self, callback):
+        '''
+        recvfrom_into the ring until the socket is drained
+        '''
+        index = 0
+        while True:
+            view = self.views[index]
+            try:
+                size, address = self.socket.recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                continue
+            callback(view[:size], address)
+            index = (index + 1) % self.count
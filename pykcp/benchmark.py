@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Benchmarks
+
+    python -m pykcp.benchmark --json result.json
+    python -m pykcp.benchmark --baseline result.json
+
+core measures KCP.send, flush, input and recv alone. link runs a transfer
+between two KCP objects through pykcp.simulator, no time is spent waiting
+on a clock and every run sends the same packets. e2e runs the tornado UDP
+and TCP transports on loopback.
+
+With --baseline the results are compared to a previous JSON file and the
+exit status is 1 when a rate dropped by more than --threshold.
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+from pykcp.kcp import KCP
+from pykcp.simulator import Simulator, Path, GilbertElliottLoss
+from pykcp.tcpclient import TCPClient
+from pykcp.tcpserver import TCPServer
+from pykcp.udpclient import UDPClient
+from pykcp.udpserver import UDPServer
+
+BENCHMARK_FORMAT = 1
+LINK_PROFILES = {
+    'clean': lambda: Path(),
+    'latency': lambda: Path(delay=100),
+    'loss': lambda: Path(loss=0.05, delay=20, jitter=5),
+    'burst': lambda: Path(loss=GilbertElliottLoss(0.01, 0.25), delay=20, jitter=5),
+    'reorder': lambda: Path(delay=20, jitter=20, reorder=0.05, duplicate=0.01),
+}
+
+def rate(count, size, seconds):
+    '''
+    Result entry of count items of size bytes in seconds
+    '''
+    seconds = max(seconds, 1e-9)
+    return {
+        'count': count,
+        'seconds': round(seconds, 6),
+        'packets_per_sec': round(count / seconds, 1),
+        'mb_per_sec': round(count * size / seconds / 1e6, 3),
+    }
+
+def bench_core(count=20000, size=1024):
+    '''
+    send, flush, input and recv of count messages in one window
+    '''
+    packets = []
+    sender = KCP(1, lambda kcp, data: packets.append(data))
+    receiver = KCP(1, lambda kcp, data: None)
+    for kcp in (sender, receiver):
+        kcp.set_wndsize(count, count)
+        kcp.set_nodelay(True, 10, 2, True)
+    # as if the receiver had told its window already
+    sender.rmt_wnd = count
+    message = b'x' * size
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(count):
+        sender.send(message)
+    results['send'] = rate(count, size, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    sender.update(0)
+    results['flush'] = rate(count, size, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for packet in packets:
+        receiver.input(packet)
+    results['input'] = rate(len(packets), size * count / max(len(packets), 1),\
+            time.perf_counter() - start)
+
+    received = 0
+    start = time.perf_counter()
+    while receiver.recv() is not None:
+        received += 1
+    results['recv'] = rate(received, size, time.perf_counter() - start)
+    assert received == count
+    return results
+
+def bench_link(profile, count=5000, size=1024, seed=1):
+    '''
+    One way transfer of count messages over a simulated link
+    '''
+    sim = Simulator(seed)
+    sender, receiver = sim.connect(LINK_PROFILES[profile](),\
+            nodelay=(True, 10, 2, True), wndsize=(256, 256))
+    flow = sim.transfer(sender, receiver, count, size)
+    start = time.perf_counter()
+    sim.run_until_delivered([flow], 600000)
+    result = rate(len(flow.latencies), size, time.perf_counter() - start)
+    report = flow.report()
+    result['virtual_seconds'] = sim.now / 1000.0
+    result['wire_packets'] = sim.routes[id(sender)][1].packets
+    result['retransmits'] = sender.xmit
+    result['latency_p99'] = round(report['latency_p99'], 3)
+    result['retransmission_overhead'] = round(report['retransmission_overhead'], 4)
+    return result
+
+class SinkUDPServer(UDPServer):
+    '''
+    Count messages
+    '''
+
+    def handle_message(self, kcpstream, message):
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set_result(None)
+
+class SinkTCPServer(TCPServer):
+    '''
+    Count messages
+    '''
+
+    def handle_message(self, kcpstream, message):
+        self.received += 1
+        if self.received == self.expected:
+            self.done.set_result(None)
+
+class SendUDPClient(UDPClient):
+    '''
+    Send messages when connected
+    '''
+
+    def handle_connect(self):
+        pass
+
+    def handle_message(self, kcpstream, message):
+        pass
+
+class SendTCPClient(TCPClient):
+    '''
+    Send messages when connected
+    '''
+
+    def handle_connect(self):
+        self.connected.set_result(self.kcpstream)
+
+    def handle_message(self, kcpstream, message):
+        pass
+
+@gen.coroutine
+def run_e2e(transport, count, size):
+    '''
+    Send count messages to a sink server on loopback, return the seconds
+    '''
+    done = Future()
+    if transport == 'udp':
+        server = SinkUDPServer(precise=True, batch=True)
+        server.listen(0, '127.0.0.1')
+        port = server.socket.getsockname()[1]
+        client = SendUDPClient(precise=True)
+    else:
+        server = SinkTCPServer(precise=True, batch=True)
+        sock, port = bind_unused_port()
+        server.add_sockets([sock])
+        client = SendTCPClient(precise=True, batch=True)
+        client.connected = Future()
+    server.received = 0
+    server.expected = count
+    server.done = done
+    try:
+        if transport == 'udp':
+            kcpstream = yield client.kcp_connect('127.0.0.1', port)
+        else:
+            client.kcp_connect('127.0.0.1', port)
+            kcpstream = yield client.connected
+        kcpstream.kcp.set_wndsize(256, 256)
+        kcpstream.kcp.set_nodelay(True, 10, 2, True)
+        message = b'x' * size
+        start = time.perf_counter()
+        for _ in range(count):
+            yield kcpstream.drain()
+            kcpstream.send(message)
+        yield done
+        raise gen.Return(time.perf_counter() - start)
+    finally:
+        if transport == 'udp':
+            client.close()
+            server.stop()
+        else:
+            kcpstream.stream.close()
+            server.stop()
+
+def bench_e2e(transport, count=5000, size=1024):
+    '''
+    Tornado transport on loopback
+    '''
+    ioloop = IOLoop()
+    try:
+        seconds = ioloop.run_sync(lambda: run_e2e(transport, count, size), timeout=120)
+    finally:
+        ioloop.close(all_fds=True)
+    return rate(count, size, seconds)
+
+def run_benchmarks(scale=1.0, e2e=True):
+    '''
+    Run every benchmark, return the results as a JSON-able dict
+    '''
+    results = {}
+    for name, result in bench_core(int(20000 * scale)).items():
+        results['core.%s' % name] = result
+    for profile in sorted(LINK_PROFILES):
+        results['link.%s' % profile] = bench_link(profile, int(5000 * scale))
+    if e2e:
+        for transport in ('udp', 'tcp'):
+            results['e2e.%s' % transport] = bench_e2e(transport, int(5000 * scale))
+    return {
+        'format': BENCHMARK_FORMAT,
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'results': results,
+    }
+
+def compare(baseline, report, threshold):
+    '''
+    Names of the benchmarks whose packets_per_sec dropped more than threshold
+    '''
+    regressions = []
+    for name, result in sorted(report['results'].items()):
+        base = baseline['results'].get(name)
+        if not base:
+            continue
+        if result['packets_per_sec'] < base['packets_per_sec'] * (1 - threshold):
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    '''
+    Command line
+    '''
+    parser = argparse.ArgumentParser(description='pykcp benchmarks')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--scale', type=float, default=1.0, help='scale the message counts')
+    parser.add_argument('--no-e2e', action='store_true', help='skip the loopback runs')
+    parser.add_argument('--baseline', help='compare with the results in this file')
+    parser.add_argument('--threshold', type=float, default=0.2,\
+            help='allowed drop of packets_per_sec against the baseline')
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.scale, not args.no_e2e)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for name in regressions:
+            sys.stderr.write('regression: %s\n' % name)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
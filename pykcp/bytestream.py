@@ -0,0 +1,180 @@
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Byte stream
+
+A KCP stream in stream mode with future based reads for tornado
+coroutines, the session type of the servers and clients created with
+stream_mode=True.
+'''
+
+from tornado.iostream import StreamClosedError, UnsatisfiableReadError
+from pykcp.stream import KCPStream
+
+IKCP_MAX_BUFFER_SIZE = 1048576 # received bytes a byte stream buffers
+
+class KCPByteStream(KCPStream):
+    '''
+    KCP stream in stream mode
+
+    Writes are coalesced into mss sized segments and message boundaries are
+    not kept. Received bytes are buffered for read, readexactly and
+    readuntil, which return futures, one read at a time. Once
+    max_buffer_size bytes wait to be read the rest stays in the KCP receive
+    queue, whose window closes until the reader catches up. A read pending
+    on close fails with StreamClosedError.
+    '''
+
+    __slot__ = ('read_buffer', 'max_buffer_size', 'read_future', 'read_size',\
+            'read_delimiter', 'read_partial', 'scan_offset')
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, kcp, stream, address, ioloop, max_buffer_size=IKCP_MAX_BUFFER_SIZE,\
+            **kwargs):
+        KCPStream.__init__(self, kcp, stream, address, ioloop, **kwargs)
+        kcp.stream = True
+        self.read_buffer = bytearray()
+        self.max_buffer_size = max_buffer_size
+        self.read_future = None
+        self.read_size = 0
+        self.read_delimiter = None
+        self.read_partial = False
+        self.scan_offset = 0
+
+    def write(self, data):
+        '''
+        Send data, return the future of drain
+        '''
+        self.send(data)
+        return self.drain()
+
+    def read(self, max_bytes):
+        '''
+        Future of at most max_bytes, resolved once any are buffered
+        '''
+        return self.start_read(max_bytes, None, True)
+
+    def readexactly(self, num_bytes):
+        '''
+        Future of exactly num_bytes
+        '''
+        return self.start_read(num_bytes, None, False)
+
+    def readuntil(self, delimiter=b'\n'):
+        '''
+        Future of the bytes up to and including delimiter
+        '''
+        return self.start_read(0, delimiter, False)
+
+    def start_read(self, size, delimiter, partial):
+        '''
+        Start the only pending read
+        '''
+        assert self.read_future is None, 'Already reading'
+        future = self.create_future()
+        if self.closed:
+            future.set_exception(StreamClosedError())
+            return future
+        self.read_future = future
+        self.read_size = size
+        self.read_delimiter = delimiter
+        self.read_partial = partial
+        self.scan_offset = 0
+        self.try_read()
+        return future
+
+    def try_read(self):
+        '''
+        Complete the pending read if the buffer holds enough
+        '''
+        future = self.read_future
+        if future is None:
+            return
+        if future.done():
+            # cancelled, the bytes stay for the next read
+            self.read_future = None
+            return
+        buffer = self.read_buffer
+        if self.read_delimiter is not None:
+            delimiter = self.read_delimiter
+            pos = buffer.find(delimiter, self.scan_offset)
+            if pos < 0:
+                if len(buffer) >= self.max_buffer_size:
+                    self.read_future = None
+                    future.set_exception(UnsatisfiableReadError(\
+                            'delimiter %r not found within %d bytes'\
+                            % (delimiter, self.max_buffer_size)))
+                    return
+                # do not scan the same bytes again
+                self.scan_offset = max(len(buffer) - len(delimiter) + 1, 0)
+                return
+            size = pos + len(delimiter)
+        elif self.read_partial:
+            size = min(len(buffer), self.read_size)
+            if not size:
+                return
+        else:
+            size = self.read_size
+            if len(buffer) < size:
+                return
+        with memoryview(buffer) as view:
+            data = bytes(view[:size])
+        del buffer[:size]
+        self.read_future = None
+        future.set_result(data)
+        if self.kcp.nrcv_que:
+            # the buffer was full, take what waits in the receive queue
+            self.wakeup()
+
+    def recv_messages(self):
+        '''
+        Receive until max_buffer_size bytes are buffered, or enough for the
+        pending read
+        '''
+        chunks = []
+        size = len(self.read_buffer)
+        limit = self.max_buffer_size
+        if self.read_future is not None:
+            limit = max(limit, self.read_size)
+        recv = self.kcp.recv
+        while size < limit:
+            data = recv()
+            if data is None:
+                break
+            chunks.append(data)
+            size += len(data)
+        return chunks
+
+    def handle_messages(self, messages):
+        '''
+        Buffer received bytes
+        '''
+        buffer = self.read_buffer
+        for data in messages:
+            buffer += data
+        self.try_read()
+
+    def close(self):
+        '''
+        Close, fail the pending read
+        '''
+        KCPStream.close(self)
+        future = self.read_future
+        self.read_future = None
+        if future is not None and not future.done():
+            future.set_exception(StreamClosedError())
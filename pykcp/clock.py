@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Clock
+
+KCP timestamps are 32 bits millisecs which wrap around every 49 days, they
+are only compared through their difference.
+'''
+
+def itimediff(later, earlier):
+    '''
+    Difference of two 32 bits millisec timestamps, safe across wraparound
+    '''
+    return ((later - earlier + 0x80000000) & 0xffffffff) - 0x80000000
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Congestion control
+
+A KCP object hands every congestion decision to its controller: on_ack
+after an input acknowledged segments, on_flush after a flush sent them.
+The controller keeps kcp.cwnd (in segments) up to date. A controller with
+pacing set also limits how many new segments each flush moves to snd_buf,
+send_quota and next_send spread them over time instead of sending the
+whole window at once, KCP.check asks for an update when the next one may
+go. Retransmissions beyond the quota wait too.
+
+RenoController is the default and the algorithm of the original KCP:
+slow start, additive increase, ssthresh halving on fast retransmit and
+cwnd = 1 on timeout. BBRController estimates the bottleneck bandwidth and
+the minimum RTT and sends at that rate, losses do not shrink it.
+
+    kcp = KCP(conv, output, congestion=BBRController())
+
+Every KCP needs its own controller object.
+'''
+
+import collections
+import math
+from pykcp.clock import itimediff
+
+IKCP_THRESH_INIT = 2
+IKCP_THRESH_MIN = 2
+
+class CongestionController(object):
+    '''
+    Interface of the congestion controllers, does nothing
+    '''
+
+    pacing = False
+
+    def on_ack(self, kcp, acked, delivered, rtt, current):
+        '''
+        After an input, acked is how far snd_una moved, delivered how many
+        segments left snd_buf and rtt the last RTT sample or -1
+        '''
+
+    def on_flush(self, kcp, cwnd, change, lost):
+        '''
+        After a flush, cwnd is the window it used, change is True when it
+        fast retransmitted and lost when a segment timed out
+        '''
+
+    def send_quota(self, kcp, current):
+        '''
+        New segments flush may send now, only asked when pacing
+        '''
+        return 0x7fffffff
+
+    def sent(self, kcp, count):
+        '''
+        flush sent count new segments of the quota
+        '''
+
+    def next_send(self, kcp, current):
+        '''
+        Millisecs until the next new segment may be sent, only asked when pacing
+        '''
+        return 0
+
+class RenoController(CongestionController):
+    '''
+    Congestion control of the original KCP
+    '''
+
+    def on_ack(self, kcp, acked, delivered, rtt, current):
+        if acked <= 0 or kcp.cwnd >= kcp.rmt_wnd:
+            return
+        mss = kcp.mss
+        if kcp.cwnd < kcp.ssthresh:
+            kcp.cwnd += 1
+            kcp.incr += mss
+        else:
+            if kcp.incr < mss:
+                kcp.incr = mss
+            kcp.incr += int(mss * mss) / kcp.incr + int(mss / 16)
+            if (kcp.cwnd + 1) * mss <= kcp.incr:
+                kcp.cwnd += 1
+        if kcp.cwnd > kcp.rmt_wnd:
+            kcp.cwnd = kcp.rmt_wnd
+            kcp.incr = kcp.rmt_wnd * mss
+
+    def on_flush(self, kcp, cwnd, change, lost):
+        if change:
+            resent = 0xffffffff
+            if kcp.fastresend > 0:
+                resent = kcp.fastresend
+            inflight = kcp.snd_nxt - kcp.snd_una
+            kcp.ssthresh = int(inflight / 2)
+            if kcp.ssthresh < IKCP_THRESH_MIN:
+                kcp.ssthresh = IKCP_THRESH_MIN
+            kcp.cwnd = kcp.ssthresh + resent
+            kcp.incr = kcp.cwnd * kcp.mss
+
+        if lost:
+            kcp.ssthresh = int(cwnd / 2)
+            if kcp.ssthresh < IKCP_THRESH_MIN:
+                kcp.ssthresh = IKCP_THRESH_MIN
+            kcp.cwnd = 1
+            kcp.incr = kcp.mss
+
+        if kcp.cwnd < 1:
+            kcp.cwnd = 1
+            kcp.incr = kcp.mss
+
+class BBRController(CongestionController):
+    '''
+    BBR-like congestion control with pacing
+
+    The delivery rate is sampled once per round (one min RTT), the
+    bottleneck bandwidth is the max of the last window samples and the min
+    RTT the smallest sample of the last min_rtt_window millisecs. Startup
+    doubles the rate every round until it stops growing by 25% for three
+    rounds or more than 2% of a round times out, drain empties the
+    queue it built, then probe_bw cycles the pacing gain around the
+    estimate. cwnd is twice the bandwidth-delay product, rates are in
+    segments per millisec.
+
+    Tokens refill at the pacing rate, up to a small burst. New segments
+    move to snd_buf while tokens are left, the timeout and fast
+    retransmissions of a flush go out from what remains, the ones beyond
+    it stay due and KCP.check waits for the next token. on_flush takes the
+    retransmissions sent out of the budget.
+    '''
+
+    # pylint: disable=too-many-instance-attributes
+
+    pacing = True
+    STARTUP_GAIN = 2.885
+    CYCLE_GAINS = (1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+
+    def __init__(self, window=10, min_rtt_window=10000, min_cwnd=4):
+        self.window = window
+        self.min_rtt_window = min_rtt_window
+        self.min_cwnd = min_cwnd
+        self.mode = 'startup'
+        self.pacing_gain = self.STARTUP_GAIN
+        self.cwnd_gain = self.STARTUP_GAIN
+        self.samples = collections.deque()
+        self.btl_bw = 0.0
+        self.min_rtt = 0
+        self.min_rtt_stamp = 0
+        self.rounds = 0
+        self.round_start = None
+        self.round_delivered = 0
+        self.round_lost = 0
+        self.full_bw = 0.0
+        self.full_bw_rounds = 0
+        self.cycle_index = 0
+        self.cycle_stamp = 0
+        self.tokens = float(min_cwnd)
+        self.last_refill = None
+        self.resent = 0
+        self.timeouts = 0
+
+    def bdp(self):
+        '''
+        Bandwidth-delay product in segments
+        '''
+        return self.btl_bw * self.min_rtt
+
+    def pacing_rate(self, kcp):
+        '''
+        Segments per millisec
+        '''
+        if self.btl_bw > 0:
+            return self.pacing_gain * self.btl_bw
+        # no sample yet, send the window over one RTT
+        rtt = kcp.rx_srtt or kcp.interval
+        return self.pacing_gain * max(kcp.cwnd, self.min_cwnd) / max(rtt, 1)
+
+    def on_ack(self, kcp, acked, delivered, rtt, current):
+        if rtt >= 0 and (not self.min_rtt or rtt <= self.min_rtt or\
+                itimediff(current, self.min_rtt_stamp) > self.min_rtt_window):
+            self.min_rtt = max(rtt, 1)
+            self.min_rtt_stamp = current
+
+        if self.round_start is None:
+            self.round_start = current
+        self.round_delivered += delivered
+        elapsed = itimediff(current, self.round_start)
+        if elapsed >= max(self.min_rtt, 1) and self.round_delivered > 0:
+            self.end_round(kcp, self.round_delivered / float(elapsed),\
+                    self.round_lost > max(8, self.round_delivered * 0.02), current)
+
+        if self.btl_bw > 0:
+            kcp.cwnd = max(int(self.cwnd_gain * self.bdp() + 0.5), self.min_cwnd)
+        else:
+            kcp.cwnd = max(kcp.cwnd, self.min_cwnd) + delivered
+
+    def end_round(self, kcp, rate, lossy, current):
+        '''
+        Record the delivery rate of a round and move through the modes
+        '''
+        self.rounds += 1
+        self.round_start = current
+        self.round_delivered = 0
+        self.round_lost = 0
+        samples = self.samples
+        samples.append((self.rounds, rate))
+        while samples[0][0] <= self.rounds - self.window:
+            samples.popleft()
+        self.btl_bw = max(sample[1] for sample in samples)
+
+        if self.mode == 'startup':
+            if self.btl_bw >= self.full_bw * 1.25:
+                self.full_bw = self.btl_bw
+                self.full_bw_rounds = 0
+            else:
+                self.full_bw_rounds += 1
+            # a queue overflowing shows the pipe is full too
+            if self.full_bw_rounds >= 3 or lossy:
+                self.enter_drain()
+        if self.mode == 'drain' and kcp.nsnd_buf <= self.bdp():
+            self.mode = 'probe_bw'
+            self.cwnd_gain = 2.0
+            self.cycle_index = 0
+            self.cycle_stamp = current
+            self.pacing_gain = self.CYCLE_GAINS[0]
+        elif self.mode == 'probe_bw' and itimediff(current, self.cycle_stamp) >= self.min_rtt:
+            self.cycle_index = (self.cycle_index + 1) % len(self.CYCLE_GAINS)
+            self.cycle_stamp = current
+            self.pacing_gain = self.CYCLE_GAINS[self.cycle_index]
+
+    def enter_drain(self):
+        '''
+        The pipe is full, leave startup
+        '''
+        self.mode = 'drain'
+        self.pacing_gain = 1 / self.STARTUP_GAIN
+
+    def on_flush(self, kcp, cwnd, change, lost):
+        # retransmissions take their share of the budget
+        resent = kcp.xmit + kcp.fast_xmit - self.resent
+        self.resent += resent
+        self.tokens -= resent
+        # fast retransmissions repeat while a segment is missing, only
+        # timeouts tell how much is lost
+        self.round_lost += kcp.xmit - self.timeouts
+        self.timeouts = kcp.xmit
+        if self.mode == 'startup' and self.btl_bw > 0 and\
+                self.round_lost > max(8, (self.round_delivered + cwnd) * 0.02):
+            # do not wait for the end of the round to stop the overflow
+            self.enter_drain()
+        if kcp.cwnd < self.min_cwnd:
+            kcp.cwnd = self.min_cwnd
+        kcp.incr = kcp.cwnd * kcp.mss
+
+    def refill(self, kcp, current):
+        '''
+        Add the tokens earned since the last refill, at most a small burst
+        '''
+        rate = self.pacing_rate(kcp)
+        elapsed = 0 if self.last_refill is None else itimediff(current, self.last_refill)
+        if elapsed > 0:
+            burst = max(2.0, rate * 2)
+            self.tokens = min(self.tokens + rate * elapsed, max(burst, self.tokens))
+        self.last_refill = current
+        return rate
+
+    def send_quota(self, kcp, current):
+        self.refill(kcp, current)
+        return int(self.tokens)
+
+    def sent(self, kcp, count):
+        self.tokens -= count
+
+    def next_send(self, kcp, current):
+        rate = self.refill(kcp, current)
+        if self.tokens >= 1:
+            return 0
+        return int(math.ceil((1 - self.tokens) / rate))
@@ -0,0 +1,80 @@
+#
+# Copyright 2019 leenjewel
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Types of pykcp/kcp.py for the Cython build, see setup.py. Every attribute
+# stays public so the compiled classes behave like the pure Python ones.
+
+cimport cython
+from pykcp.clock cimport itimediff
+
+cdef class KCPSeg:
+    cdef public long long conv, cmd, frg, wnd, ts, sn, una, len
+    cdef public long long resendts, rto, fastack, xmit
+    cdef public object data
+
+cdef class KCPSegRing:
+    cdef public list slots
+    cdef public long long mask
+
+cdef class KCPSegPool:
+    cdef public list free
+    cdef public long long capacity, created
+
+cdef class KCP:
+    cdef public long long conv, mtu, mss, state
+    cdef public long long snd_una, snd_nxt, rcv_nxt
+    cdef public long long ts_recent, ts_lastack, ssthresh
+    cdef public long long rx_rttval, rx_srtt, rx_rto, rx_minrto
+    cdef public long long snd_wnd, rcv_wnd, rmt_wnd, cwnd, probe
+    cdef public long long current, interval, ts_flush, xmit
+    cdef public long long nrcv_buf, nsnd_buf, nrcv_que, nsnd_que
+    cdef public object nodelay, updated
+    cdef public long long ts_probe, probe_wait, dead_link
+    cdef public object incr
+    cdef public object snd_queue, rcv_queue
+    cdef public KCPSegRing snd_buf, rcv_buf
+    cdef public list acklist
+    cdef public long long ackcount, ackblock, fastresend
+    cdef public object nocwnd, stream
+    cdef public bytearray buffer
+    cdef public object pool
+    cdef public long long pkts_in, bytes_in, pkts_out, bytes_out
+    cdef public long long fast_xmit, dead_events
+    cdef public object congestion
+    cdef public object sources
+    cdef public object adaptive
+    cdef public long long flush_interval, idle_interval, ack_delay
+    cdef public long long ack_threshold, send_threshold, ts_ack
+    cdef public object output_func
+
+    @cython.locals(segment=KCPSeg, offset=cython.Py_ssize_t,
+                   cwnd=cython.longlong, resent=cython.longlong,
+                   rtomin=cython.longlong, quota=cython.longlong,
+                   change=cython.bint, lost=cython.bint)
+    cpdef flush(self, current=*)
+
+    @cython.locals(size=cython.Py_ssize_t)
+    cpdef Py_ssize_t flush_segment(self, KCPSeg segment, Py_ssize_t offset,
+                                   long long current, long long wnd) except -1
+
+    @cython.locals(seg=KCPSeg, una=cython.longlong, nsnd_buf=cython.longlong,
+                   maxack=cython.longlong, sample=cython.longlong,
+                   flag=cython.bint, size=cython.Py_ssize_t, offset=cython.Py_ssize_t,
+                   conv=cython.longlong, cmd=cython.longlong, frg=cython.longlong,
+                   wnd=cython.longlong, ts=cython.longlong, sn=cython.longlong,
+                   seg_una=cython.longlong, length=cython.Py_ssize_t,
+                   rtt=cython.longlong)
+    cpdef input(self, data)
@@ -78,8 +78,22 @@ connection can be find out from your map or array.
 - una: un-acknowledged serial number
 '''
 
+import functools
 import struct
 from collections import deque
+from pykcp.clock import itimediff
+# IKCP_THRESH_MIN is still imported from here
+from pykcp.congestion import RenoController, IKCP_THRESH_INIT,\
+        IKCP_THRESH_MIN # pylint: disable=unused-import
+
+# setup.py compiles this module with Cython when it is installed, kcp.pxd
+# types the classes, the source stays plain Python and is the fallback
+try:
+    import cython
+    COMPILED = cython.compiled
+except ImportError:
+    # Cython is not installed, so this module can not be the compiled one
+    COMPILED = False
 
 IKCP_RTO_NDL = 30          # no delay min rto
 IKCP_RTO_MIN = 100         # normal min rto
@@ -98,12 +112,17 @@ IKCP_ACK_FAST = 3
 IKCP_INTERVAL = 100
 IKCP_OVERHEAD = 24
 IKCP_DEADLINK = 20
-IKCP_THRESH_INIT = 2
-IKCP_THRESH_MIN = 2
 IKCP_PROBE_INIT = 7000     # 7 secs to probe window size
 IKCP_PROBE_LIMIT = 120000  # up to 120 secs to probe window
+IKCP_POOL_CAPACITY = 16384 # free segments kept by a KCPSegPool
+IKCP_SOURCE_READ = 65536   # bytes read from a file at once by send_stream
+IKCP_IDLE_INTERVAL = 5000  # longest sleep of an idle adaptive KCP
+IKCP_ACK_DELAY = 10        # millisecs an adaptive KCP may hold an ACK
+IKCP_ACK_THRESHOLD = 32    # pending ACKs flushed at once
+IKCP_SEND_THRESHOLD = 8    # queued segments flushed at once
 
 IKCP_PACKET_HEAD_FORMAT = '<IBBHIIII'
+IKCP_PACKET_HEAD = struct.Struct(IKCP_PACKET_HEAD_FORMAT)
 
 class KCPSeg(object):
     '''
@@ -141,17 +160,25 @@ class KCPSeg(object):
         '''
         Encode KCP packet head
         '''
-        return struct.pack(IKCP_PACKET_HEAD_FORMAT, self.conv, self.cmd, self.frg,\
+        return IKCP_PACKET_HEAD.pack(self.conv, self.cmd, self.frg,\
                 self.wnd, self.ts, self.sn, self.una, self.len)
 
+    def encode_into(self, buffer, offset):
+        '''
+        Encode KCP packet head into buffer at offset, return the new offset
+        '''
+        IKCP_PACKET_HEAD.pack_into(buffer, offset, self.conv, self.cmd, self.frg,\
+                self.wnd, self.ts, self.sn, self.una, self.len)
+        return offset + IKCP_OVERHEAD
+
     @classmethod
-    def decode(cls, data):
+    def decode(cls, data, offset=0):
         '''
-        Decode KCP packet head
+        Decode KCP packet head at offset, data can be any bytes-like object
         '''
-        assert len(data) >= IKCP_OVERHEAD
+        assert len(data) - offset >= IKCP_OVERHEAD
         conv, cmd, frg, wnd, ts, sn, una, length = \
-                struct.unpack(IKCP_PACKET_HEAD_FORMAT, data[:IKCP_OVERHEAD])
+                IKCP_PACKET_HEAD.unpack_from(data, offset)
         seg = cls(conv)
         seg.cmd = cmd
         seg.frg = frg
@@ -164,6 +191,171 @@ class KCPSeg(object):
 
 
 
+class KCPSegRing(object):
+    '''
+    KCP segments indexed by sn
+
+    Slots are addressed by sn modulo a power of two size which must cover
+    the whole window, so lookup, insert and remove of a sn are O(1).
+    '''
+
+    __slots__ = ('slots', 'mask')
+
+
+    def __init__(self, size):
+        capacity = 1
+        while capacity < size:
+            capacity <<= 1
+        self.slots = [None] * capacity
+        self.mask = capacity - 1
+
+
+    def get(self, sn):
+        '''
+        Get the segment of sn or None
+        '''
+        seg = self.slots[sn & self.mask]
+        if seg is not None and seg.sn == sn:
+            return seg
+        return None
+
+
+    def put(self, seg):
+        '''
+        Put a segment into the slot of its sn
+        '''
+        self.slots[seg.sn & self.mask] = seg
+
+
+    def pop(self, sn):
+        '''
+        Remove and return the segment of sn or None
+        '''
+        index = sn & self.mask
+        seg = self.slots[index]
+        if seg is not None and seg.sn == sn:
+            self.slots[index] = None
+            return seg
+        return None
+
+
+    def segments(self, first, last):
+        '''
+        Iterate segments from sn first to sn last (exclusive) in order
+        '''
+        slots = self.slots
+        mask = self.mask
+        for sn in range(first, last):
+            seg = slots[sn & mask]
+            if seg is not None:
+                yield seg
+
+
+    def reserve(self, size, first, last):
+        '''
+        Grow to hold at least size slots, keeping segments first to last
+        '''
+        if size <= len(self.slots):
+            return
+        segs = list(self.segments(first, last))
+        self.__init__(size)
+        for seg in segs:
+            self.put(seg)
+
+
+
+class KCPSegPool(object):
+    '''
+    Freelist of KCP segments
+
+    get hands out a recycled segment whose fields other than conv are
+    stale, the caller sets every field it uses. put keeps at most capacity
+    segments, the rest go to the garbage collector.
+    '''
+
+    __slots__ = ('free', 'capacity', 'created')
+
+
+    def __init__(self, capacity=IKCP_POOL_CAPACITY):
+        self.free = []
+        self.capacity = capacity
+        self.created = 0
+
+
+    def get(self, conv):
+        '''
+        Get a segment
+        '''
+        if self.free:
+            seg = self.free.pop()
+            seg.conv = conv
+            return seg
+        self.created += 1
+        return KCPSeg(conv)
+
+
+    def put(self, seg):
+        '''
+        Give a segment back, it must not be used afterwards
+        '''
+        if len(self.free) < self.capacity:
+            seg.data = None
+            self.free.append(seg)
+
+
+    def __len__(self):
+        return len(self.free)
+
+
+
+IKCP_SEG_POOL = KCPSegPool()
+
+
+
+class KCPSource(object):
+    '''
+    Data given to send_stream and not queued yet
+
+    source is a bytes-like object, a file object opened in binary mode or
+    an iterable of bytes-like chunks. Pieces are memoryview slices of the
+    chunks, copied when a chunk is mutable.
+    '''
+
+    __slots__ = ('chunks', 'view', 'offset', 'callback')
+
+
+    def __init__(self, source, callback=None):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.chunks = iter((source,))
+        elif hasattr(source, 'read'):
+            self.chunks = iter(functools.partial(source.read, IKCP_SOURCE_READ), b'')
+        else:
+            self.chunks = iter(source)
+        self.view = None
+        self.offset = 0
+        self.callback = callback
+
+
+    def read(self, size):
+        '''
+        Next piece of at most size bytes, None at the end
+        '''
+        while self.view is None or self.offset >= len(self.view):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.view = None
+                return None
+            self.view = memoryview(chunk).cast('B')
+            self.offset = 0
+        piece = self.view[self.offset:self.offset+size]
+        self.offset += len(piece)
+        if not piece.readonly:
+            # segments keep it until acknowledged
+            return piece.tobytes()
+        return piece
+
+
+
 class KCP(object):
     '''
     KCP
@@ -194,12 +386,22 @@ class KCP(object):
         'ackblock',
         'fastresend',
         'nocwnd', 'stream',
+        'buffer',
+        'pool',
+        'pkts_in', 'bytes_in', 'pkts_out', 'bytes_out',
+        'fast_xmit', 'dead_events',
+        'congestion',
+        'sources',
+        'adaptive', 'flush_interval', 'idle_interval',
+        'ack_delay', 'ack_threshold', 'send_threshold', 'ts_ack',
         'output_func'
     )
 
 
-    def __init__(self, conv, output):
+    def __init__(self, conv, output, pool=None, congestion=None):
         self.conv = conv
+        self.pool = IKCP_SEG_POOL if pool is None else pool
+        self.congestion = RenoController() if congestion is None else congestion
         self.snd_una = 0
         self.snd_nxt = 0
         self.rcv_nxt = 0
@@ -215,11 +417,13 @@ class KCP(object):
         self.probe = 0
         self.mtu = IKCP_MTU_DEF
         self.mss = self.mtu - IKCP_OVERHEAD
+        self.buffer = bytearray((self.mtu + IKCP_OVERHEAD) * 3)
         self.stream = False
         self.snd_queue = deque()
         self.rcv_queue = deque()
-        self.snd_buf = deque()
-        self.rcv_buf = deque()
+        self.sources = deque()
+        self.snd_buf = KCPSegRing(IKCP_WND_SND)
+        self.rcv_buf = KCPSegRing(IKCP_WND_RCV)
         self.nrcv_buf = 0
         self.nsnd_buf = 0
         self.nrcv_que = 0
@@ -242,6 +446,19 @@ class KCP(object):
         self.nocwnd = False
         self.xmit = 0
         self.dead_link = IKCP_DEADLINK
+        self.pkts_in = 0
+        self.bytes_in = 0
+        self.pkts_out = 0
+        self.bytes_out = 0
+        self.fast_xmit = 0
+        self.dead_events = 0
+        self.adaptive = False
+        self.flush_interval = IKCP_INTERVAL
+        self.idle_interval = IKCP_IDLE_INTERVAL
+        self.ack_delay = IKCP_ACK_DELAY
+        self.ack_threshold = IKCP_ACK_THRESHOLD
+        self.send_threshold = IKCP_SEND_THRESHOLD
+        self.ts_ack = 0
         assert callable(output)
         self.output_func = output
 
@@ -273,7 +490,55 @@ class KCP(object):
         '''
         recv
         '''
-        data = b''
+        segs = self.recv_segments()
+        if segs is None:
+            return None
+
+        if len(segs) == 1:
+            data = segs[0].data
+        else:
+            # join sizes its result once, so merging stays linear
+            data = b''.join([seg.data for seg in segs])
+
+        free = self.pool.free
+        if len(free) + len(segs) <= self.pool.capacity:
+            # inlined pool.put
+            for seg in segs:
+                seg.data = None
+            free.extend(segs)
+        return data
+
+
+    def recv_into(self, buffer):
+        '''
+        recv a message into a writable bytes-like buffer
+
+        Return the message size, -1 if there is no message ready,
+        -3 if the buffer is too small for the message.
+        '''
+        peek_size = self.peeksize()
+        if peek_size < 0:
+            return -1
+
+        view = memoryview(buffer)
+        if len(view) < peek_size:
+            return -3
+
+        offset = 0
+        put = self.pool.put
+        for seg in self.recv_segments():
+            view[offset:offset+seg.len] = seg.data
+            offset += seg.len
+            put(seg)
+        return offset
+
+
+    def recv_segments(self):
+        '''
+        Pop all fragments of the first message in rcv_queue
+
+        The caller owns the segments and should give them back to the pool.
+        '''
         if not self.rcv_queue:
             return None
 
@@ -284,91 +549,152 @@ class KCP(object):
         recover = self.nrcv_que >= self.rcv_wnd
 
         # merge fragment
+        segs = []
         length = 0
-        fragment = 0
         while self.rcv_queue:
             seg = self.rcv_queue.popleft()
             length += seg.len
-            data += seg.data
+            segs.append(seg)
             self.nrcv_que -= 1
-            fragment = seg.frg
-            del seg
-            if fragment == 0:
+            if seg.frg == 0:
                 break
 
         assert length == peek_size
 
-        # move available data from rcv_buf to rcv_queue
-        while self.rcv_buf:
-            seg = self.rcv_buf.popleft()
-            if seg.sn == self.rcv_nxt and self.nrcv_que < self.rcv_wnd:
-                self.nrcv_buf -= 1
-                self.rcv_queue.append(seg)
-                self.nrcv_que += 1
-                self.rcv_nxt += 1
-            else:
-                self.rcv_buf.appendleft(seg)
-                break
+        self.move_rcv_buf()
 
         # fast recover
         if self.nrcv_que < self.rcv_wnd and recover:
             self.probe |= IKCP_ASK_TELL
 
-        return data
+        return segs
 
 
     def send(self, data):
         '''
-        send
+        send, data can be any bytes-like object
+
+        Segments hold their data until acknowledged. Fragments are memoryview
+        slices of bytes and read-only buffers, nothing is copied before flush
+        encodes them, a mutable buffer is copied once so the caller may change
+        or resize it as soon as send returns. A message has less than
+        IKCP_WND_RCV fragments, -2 is returned for a longer one, stream mode
+        takes any length and fills the last queued segment up to mss first,
+        in a bytearray extended in place.
         '''
         assert self.mss > 0
-        assert isinstance(data, bytes), 'Send must be bytes'
+        if not isinstance(data, bytes):
+            data = memoryview(data).cast('B')
+            if not data.readonly:
+                data = data.tobytes()
+
+        if self.flush_interval > self.interval:
+            self.wake()
+
+        if self.sources:
+            # keep the order, the message waits whole behind what send_stream
+            # still holds
+            if not self.stream and len(data) > (IKCP_WND_RCV - 1) * self.mss:
+                return -2
+            self.sources.append(data)
+            return 0
+        return self.send_data(data)
+
 
+    def send_data(self, data):
+        '''
+        Fragment data into snd_queue
+        '''
+        mss = self.mss
         length = len(data)
+        offset = 0
 
         # append to previous segment in streaming mode if possible
-        if self.stream:
-            if self.snd_queue:
-                seg = self.snd_queue[-1]
-                if seg.len < int(self.mss):
-                    capacity = int(self.mss) - seg.len
-                    extend = capacity
-                    if length < capacity:
-                        extend = length
-                    seg.data += data
-                    seg.len += extend
-                    seg.frg = 0
-                    length -= extend
-
-            if length <= 0:
-                return None
-
-        count = 1
-        if length > int(self.mss):
-            count = int((length + int(self.mss) -1) / int(self.mss))
-
-        if count >= IKCP_WND_RCV:
+        if self.stream and self.snd_queue:
+            seg = self.snd_queue[-1]
+            if seg.len < mss:
+                offset = min(mss - seg.len, length)
+                tail = seg.data
+                if not isinstance(tail, bytearray):
+                    # copied once, later writes extend it in place
+                    tail = seg.data = bytearray(tail)
+                tail += data if offset >= length else memoryview(data)[:offset]
+                seg.len += offset
+                seg.frg = 0
+                if offset >= length:
+                    return 0
+
+        count = max((length - offset + mss - 1) // mss, 1)
+        if count >= IKCP_WND_RCV and not self.stream:
             return -2
 
-        if count == 0:
-            count = 1
-
+        view = data
+        if count > 1 or offset:
+            view = memoryview(data)
+        pool = self.pool
+        free = pool.free
         for i in range(count):
-            new_seg = KCPSeg(self.conv)
-            new_seg.len = length
-            if length > int(self.mss):
-                new_seg.len = int(self.mss)
-            new_seg.data = data[:new_seg.len]
+            # inlined pool.get, move_snd_queue sets conv
+            new_seg = free.pop() if free else pool.get(self.conv)
+            size = min(length - offset, mss)
+            new_seg.len = size
+            new_seg.data = view if view is data else view[offset:offset+size]
             new_seg.frg = 0
             if not self.stream:
                 new_seg.frg = count - i - 1
             self.snd_queue.append(new_seg)
             self.nsnd_que += 1
-            length -= new_seg.len
+            offset += size
 
         return 0
 
 
+    def send_stream(self, source, callback=None):
+        '''
+        Send a source too large to hold in memory at once
+
+        source is a bytes-like object, a file object opened in binary mode or
+        an iterable of bytes-like chunks. It is read as the send window
+        opens, about snd_wnd segments wait in snd_queue at a time, and
+        callback() is called once all of it is queued. In message mode the
+        receiver gets it as several messages of less than IKCP_WND_RCV
+        fragments.
+        '''
+        if self.flush_interval > self.interval:
+            self.wake()
+        self.sources.append(KCPSource(source, callback))
+        self.feed_sources()
+
+
+    def feed_sources(self):
+        '''
+        Queue data of send_stream while snd_queue holds less than snd_wnd
+        segments, the messages sent behind it once all their fragments fit
+        '''
+        sources = self.sources
+        while sources:
+            room = self.snd_wnd - self.nsnd_que
+            if room <= 0:
+                return
+            source = sources[0]
+            if not isinstance(source, KCPSource):
+                count = (len(source) + self.mss - 1) // self.mss
+                if count > room and self.nsnd_que:
+                    return
+                sources.popleft()
+                self.send_data(source)
+                continue
+            if not self.stream:
+                room = min(room, IKCP_WND_RCV - 1)
+            piece = source.read(room * self.mss)
+            if piece is None:
+                sources.popleft()
+                if source.callback is not None:
+                    source.callback()
+                continue
+            self.send_data(piece)
+
+
     def update_ack(self, rtt):
         '''
         Parse ack
@@ -392,10 +718,9 @@ class KCP(object):
         '''
         Parse ack
         '''
-        if self.snd_buf:
-            self.snd_una = self.snd_buf[0].sn
-        else:
-            self.snd_una = self.snd_nxt
+        snd_buf = self.snd_buf
+        while self.snd_una - self.snd_nxt < 0 and snd_buf.get(self.snd_una) is None:
+            self.snd_una += 1
 
 
     def parse_ack(self, sn):
@@ -405,30 +730,30 @@ class KCP(object):
         if sn - self.snd_una < 0 or sn - self.snd_nxt >= 0:
             return
 
-        rm_seg = None
-        for seg in self.snd_buf:
-            if sn == seg.sn:
-                rm_seg = seg
-                self.nsnd_buf -= 1
-                break
-            if sn - seg.sn < 0:
-                break
-        if rm_seg:
-            self.snd_buf.remove(rm_seg)
+        seg = self.snd_buf.pop(sn)
+        if seg is not None:
+            self.nsnd_buf -= 1
+            self.pool.put(seg)
 
 
     def parse_una(self, una):
         '''
         Parse UNA
         '''
-        while self.snd_buf:
-            seg = self.snd_buf.popleft()
-            if una - seg.sn > 0:
-                del seg
+        # every segment below snd_una is already gone
+        if una - self.snd_nxt > 0:
+            una = self.snd_nxt
+        pop = self.snd_buf.pop
+        free = self.pool.free
+        capacity = self.pool.capacity
+        for sn in range(self.snd_una, una):
+            seg = pop(sn)
+            if seg is not None:
                 self.nsnd_buf -= 1
-            else:
-                self.snd_buf.appendleft(seg)
-                break
+                # inlined pool.put
+                if len(free) < capacity:
+                    seg.data = None
+                    free.append(seg)
 
 
     def parse_fastack(self, sn):
@@ -438,11 +763,8 @@ class KCP(object):
         if sn - self.snd_una < 0 or sn - self.snd_nxt >= 0:
             return
 
-        for seg in self.snd_buf:
-            if sn - seg.sn < 0:
-                break
-            elif sn != seg.sn:
-                seg.fastack += 1
+        for seg in self.snd_buf.segments(self.snd_una, sn):
+            seg.fastack += 1
 
 
     def parse_data(self, newseg):
@@ -450,39 +772,34 @@ class KCP(object):
         Parse data
         '''
         sn = newseg.sn
-        repeat = False
         if sn - (self.rcv_nxt + self.rcv_wnd) >= 0 or sn - self.rcv_nxt < 0:
-            del newseg
+            self.pool.put(newseg)
             return
 
-        tmp_deque = deque()
-        while self.rcv_buf:
-            seg = self.rcv_buf.pop()
-            tmp_deque.appendleft(seg)
-            if seg.sn == sn:
-                repeat = True
-                break
-            if sn - seg.sn > 0:
-                break
-
-        if repeat:
-            del newseg
-        else:
-            tmp_deque.appendleft(newseg)
+        if self.rcv_buf.get(sn) is None:
+            # payload is still a view of the input packet, copy it only now
+            newseg.data = bytes(newseg.data)
+            self.rcv_buf.put(newseg)
             self.nrcv_buf += 1
+        else:
+            self.pool.put(newseg)
 
-        if tmp_deque:
-            self.rcv_buf.extend(tmp_deque)
+        self.move_rcv_buf()
 
-        while self.rcv_buf:
-            seg = self.rcv_buf.popleft()
-            if seg.sn == self.rcv_nxt and self.nrcv_que < self.rcv_wnd:
-                self.nrcv_buf -= 1
-                self.rcv_queue.append(seg)
-                self.nrcv_que += 1
-                self.rcv_nxt += 1
-            else:
+
+    def move_rcv_buf(self):
+        '''
+        Move available data from rcv_buf to rcv_queue
+        '''
+        pop = self.rcv_buf.pop
+        while self.nrcv_que < self.rcv_wnd:
+            seg = pop(self.rcv_nxt)
+            if seg is None:
                 break
+            self.nrcv_buf -= 1
+            self.rcv_queue.append(seg)
+            self.nrcv_que += 1
+            self.rcv_nxt += 1
 
 
     def output(self, data):
@@ -492,17 +809,46 @@ class KCP(object):
         self.output_func(self, data)
 
 
+    def output_buffer(self, size):
+        '''
+        Output the first size bytes of the packet buffer
+        '''
+        self.pkts_out += 1
+        self.bytes_out += size
+        # one copy per packet, output_func may keep the data after returning
+        self.output(memoryview(self.buffer)[:size].tobytes())
+
+
     def update(self, current):
         '''
         update
         '''
+        if self.flush_due(current):
+            self.flush()
+
+
+    def flush_due(self, current):
+        '''
+        Advance the clock of update, return True when it should flush
+        '''
+        if self.update_timer(current):
+            return True
+        if self.congestion.pacing and self.pacing_delay(self.current) <= 0:
+            return True
+        return self.adaptive and self.adaptive_delay(self.current) <= 0
+
+
+    def update_timer(self, current):
+        '''
+        Advance the clock of update, return True when it is time to flush
+        '''
         current &= 0xffffffff
         self.current = current
         if not self.updated:
             self.updated = True
             self.ts_flush = self.current
 
-        slap = self.current - self.ts_flush
+        slap = itimediff(self.current, self.ts_flush)
 
         if slap >= 10000 or slap < -10000:
             self.ts_flush = self.current
@@ -510,9 +856,10 @@ class KCP(object):
 
         if slap >= 0:
             self.ts_flush += self.interval
-            if self.current - self.ts_flush >= 0:
+            if itimediff(self.current, self.ts_flush) >= 0:
                 self.ts_flush = self.current + self.interval
-            self.flush()
+            return True
+        return False
 
 
     def check(self, now):
@@ -522,116 +869,183 @@ class KCP(object):
         current = now & 0xffffffff
         ts_flush = self.ts_flush
         tm_flush = 0x7fffffff
-        tm_packet = 0x7fffffff
 
         if not self.updated:
             return now
 
-        tm_flush = current - ts_flush
+        tm_flush = itimediff(current, ts_flush)
         if tm_flush >= 10000 or tm_flush < -10000:
             ts_flush = current
 
         if tm_flush >= 0:
             return now
 
-        tm_flush = ts_flush - current
+        tm_flush = itimediff(ts_flush, current)
+
+        tm_packet = self.resend_delay(current)
+        if self.congestion.pacing:
+            if tm_packet <= 0:
+                # due retransmissions wait for the pacing too
+                tm_packet = self.pacing_delay(current)
+            else:
+                tm_packet = min(tm_packet, self.pacing_delay(current))
+        if self.adaptive:
+            tm_packet = min(tm_packet, self.adaptive_delay(current))
+        if tm_packet <= 0:
+            return now
+
+        return now + min(tm_flush, tm_packet, self.flush_interval)
+
+
+    def adaptive_delay(self, current):
+        '''
+        Millisecs until an adaptive KCP has to flush for its ACKs, its send
+        queue or its interval, without the retransmission timers
+        '''
+        if self.probe:
+            return 0
+        delay = itimediff(self.ts_flush, current)
+        if self.acklist:
+            if len(self.acklist) >= self.ack_threshold:
+                return 0
+            delay = min(delay, self.ack_delay - itimediff(current, self.ts_ack))
+        if self.nsnd_que >= self.send_threshold and\
+                self.snd_nxt - (self.snd_una + self.send_window()) < 0:
+            return 0
+        return delay
+
+
+    def wake(self):
+        '''
+        Leave the idle sleep, flush again every interval
+        '''
+        self.flush_interval = self.interval
+        if itimediff(self.ts_flush, self.current + self.interval) > 0:
+            self.ts_flush = self.current + self.interval
+
 
-        for seg in self.snd_buf:
-            diff = seg.resendts - current
+    def adapt_interval(self):
+        '''
+        After a flush, double the sleep of an adaptive KCP with nothing to
+        send up to idle_interval, back to interval once it has
+        '''
+        if self.nsnd_que or self.nsnd_buf or self.sources:
+            self.flush_interval = self.interval
+            return
+        self.flush_interval = min(self.flush_interval * 2, self.idle_interval)
+        self.ts_flush = self.current + self.flush_interval
+
+
+    def resend_delay(self, current):
+        '''
+        Millisecs until the first segment in snd_buf is due, <= 0 when one is
+        '''
+        tm_packet = 0x7fffffff
+        for seg in self.snd_buf.segments(self.snd_una, self.snd_nxt):
+            diff = itimediff(seg.resendts, current)
             if diff <= 0:
-                return now
+                return diff
             if diff < tm_packet:
                 tm_packet = diff
-
-        return now + min(tm_flush, tm_packet, self.interval)
+        return tm_packet
 
 
     def input(self, data):
         '''
-        input
+        input, data can be bytes, bytearray or memoryview
         '''
 
         # pylint: disable=too-many-branches
         # pylint: disable=too-many-statements
+        # pylint: disable=too-many-locals
 
-        assert isinstance(data, bytes), 'Input must be bytes'
+        assert isinstance(data, (bytes, bytearray, memoryview)), 'Input must be bytes-like'
 
         una = self.snd_una
+        nsnd_buf = self.nsnd_buf
         maxack = 0
         flag = False
+        sample = -1
         size = len(data)
 
         if not data or size < IKCP_OVERHEAD:
             return -1
 
+        self.pkts_in += 1
+        self.bytes_in += size
+
+        # walk the packet with an offset, heads are decoded in place
+        view = memoryview(data)
+        unpack_from = IKCP_PACKET_HEAD.unpack_from
+        offset = 0
+
         while True:
-            if size < IKCP_OVERHEAD:
+            if size - offset < IKCP_OVERHEAD:
                 break
 
-            seg = KCPSeg.decode(data)
+            conv, cmd, frg, wnd, ts, sn, seg_una, length = unpack_from(view, offset)
 
-            if seg.conv != self.conv:
+            if conv != self.conv:
                 return -1
 
-            size -= IKCP_OVERHEAD
-            if size < seg.len or seg.len < 0:
+            offset += IKCP_OVERHEAD
+            if size - offset < length:
                 return -2
 
-            if seg.cmd not in (IKCP_CMD_PUSH, IKCP_CMD_ACK, IKCP_CMD_WASK, IKCP_CMD_WINS):
+            if cmd not in (IKCP_CMD_PUSH, IKCP_CMD_ACK, IKCP_CMD_WASK, IKCP_CMD_WINS):
                 return -3
 
-            self.rmt_wnd = seg.wnd
-            self.parse_una(seg.una)
+            self.rmt_wnd = wnd
+            self.parse_una(seg_una)
             self.shrink_buf()
 
-            if seg.cmd == IKCP_CMD_ACK:
-                if self.current - seg.ts >= 0:
-                    self.update_ack(self.current - seg.ts)
-                self.parse_ack(seg.sn)
+            if cmd == IKCP_CMD_ACK:
+                rtt = itimediff(self.current, ts)
+                if rtt >= 0:
+                    self.update_ack(rtt)
+                    sample = rtt
+                self.parse_ack(sn)
                 self.shrink_buf()
                 if not flag:
                     flag = True
-                    maxack = seg.sn
-                elif seg.sn - maxack > 0:
-                    maxack = seg.sn
-
-            elif seg.cmd == IKCP_CMD_PUSH:
-                if seg.sn - (self.rcv_nxt + self.rcv_wnd) < 0:
-                    self.acklist.append((seg.sn, seg.ts))
-                    if seg.sn - self.rcv_nxt >= 0:
-                        seg.data = data[IKCP_OVERHEAD:IKCP_OVERHEAD+seg.len]
+                    maxack = sn
+                elif sn - maxack > 0:
+                    maxack = sn
+
+            elif cmd == IKCP_CMD_PUSH:
+                if sn - (self.rcv_nxt + self.rcv_wnd) < 0:
+                    if not self.acklist:
+                        self.ts_ack = self.current
+                    self.acklist.append((sn, ts))
+                    if sn - self.rcv_nxt >= 0:
+                        seg = self.pool.get(conv)
+                        seg.cmd = cmd
+                        seg.frg = frg
+                        seg.wnd = wnd
+                        seg.ts = ts
+                        seg.sn = sn
+                        seg.una = seg_una
+                        seg.len = length
+                        seg.data = view[offset:offset+length]
                         self.parse_data(seg)
 
-            elif seg.cmd == IKCP_CMD_WASK:
+            elif cmd == IKCP_CMD_WASK:
                 self.probe |= IKCP_ASK_TELL
 
-            elif seg.cmd == IKCP_CMD_WINS:
+            elif cmd == IKCP_CMD_WINS:
                 pass
 
             else:
                 return -3
 
-            data = data[IKCP_OVERHEAD+seg.len:]
-            size -= seg.len
+            offset += length
 
         if flag:
             self.parse_fastack(maxack)
 
-        if self.snd_una - una > 0:
-            if self.cwnd < self.rmt_wnd:
-                mss = self.mss
-                if self.cwnd < self.ssthresh:
-                    self.cwnd += 1
-                    self.incr += mss
-                else:
-                    if self.incr < mss:
-                        self.incr = mss
-                    self.incr += int(mss * mss) / self.incr + int(mss / 16)
-                    if (self.cwnd + 1) * mss <= self.incr:
-                        self.cwnd += 1
-                if self.cwnd > self.rmt_wnd:
-                    self.cwnd = self.rmt_wnd
-                    self.incr = self.rmt_wnd * mss
+        if self.snd_una - una > 0 or self.nsnd_buf < nsnd_buf:
+            self.congestion.on_ack(self, self.snd_una - una, nsnd_buf - self.nsnd_buf,\
+                    sample, self.current)
 
         return 0
 
@@ -643,37 +1057,88 @@ class KCP(object):
         return max(self.rcv_wnd - self.nrcv_que, 0)
 
 
-    def flush(self):
+    def flush(self, current=None):
         '''
-        flush
+        flush, pass current to flush right away without waiting for update
         '''
-
-        # pylint: disable=too-many-branches
-        # pylint: disable=too-many-statements
-
+        if current is not None:
+            self.current = current & 0xffffffff
         current = self.current
         change = False
         lost = False
         if not self.updated:
             return
 
-        seg = KCPSeg(self.conv)
-        seg.cmd = IKCP_CMD_ACK
-        seg.frg = 0
-        seg.wnd = self.wnd_unused()
-        seg.una = self.rcv_nxt
-        seg.len = 0
-        seg.sn = 0
-        seg.ts = 0
+        wnd = self.wnd_unused()
+        offset = self.flush_control(wnd)
+        cwnd = self.move_snd_queue(current, wnd)
+
+        resent = 0xffffffff
+        if self.fastresend > 0:
+            resent = self.fastresend
+
+        rtomin = 0
+        if not self.nodelay:
+            rtomin = self.rx_rto >> 3
+
+        # a paced controller holds back retransmissions beyond its quota too
+        quota = 0x7fffffff
+        if self.congestion.pacing:
+            quota = self.congestion.send_quota(self, current)
+
+        for segment in self.snd_buf.segments(self.snd_una, self.snd_nxt):
+            needsend = False
+            if segment.xmit == 0:
+                needsend = True
+                segment.xmit += 1
+                segment.rto = self.rx_rto
+                segment.resendts = current + segment.rto + rtomin
+            elif itimediff(current, segment.resendts) >= 0 and quota > 0:
+                needsend = True
+                quota -= 1
+                segment.xmit += 1
+                self.xmit += 1
+                if not self.nodelay:
+                    segment.rto += self.rx_rto
+                else:
+                    segment.rto += int(self.rx_rto / 2)
+                segment.resendts = current + segment.rto
+                lost = True
+            elif segment.fastack >= resent and quota > 0:
+                needsend = True
+                quota -= 1
+                segment.xmit += 1
+                segment.fastack = 0
+                segment.resendts = current + segment.rto
+                change = True
+                self.fast_xmit += 1
+
+            if needsend:
+                offset = self.flush_segment(segment, offset, current, wnd)
+                if segment.xmit >= self.dead_link and self.state != -1:
+                    self.state = -1
+                    self.dead_events += 1
+
+        self.flush_done(offset, cwnd, change, lost)
+
 
-        data = b''
+    def flush_control(self, wnd):
+        '''
+        Encode pending ACKs and window probes, return the buffer offset
+        '''
+        # control packets are heads only, packed without a KCPSeg
+        pack_into = IKCP_PACKET_HEAD.pack_into
+        conv = self.conv
+        una = self.rcv_nxt
+        buffer = self.buffer
+        mtu = self.mtu
+        offset = 0
         for sn, ts in self.acklist:
-            seg.sn = sn
-            seg.ts = ts
-            data += seg.encode()
-            if len(data) + IKCP_OVERHEAD > self.mtu:
-                self.output(data)
-                data = b''
+            pack_into(buffer, offset, conv, IKCP_CMD_ACK, 0, wnd, ts, sn, una, 0)
+            offset += IKCP_OVERHEAD
+            if offset + IKCP_OVERHEAD > mtu:
+                self.output_buffer(offset)
+                offset = 0
 
         self.acklist = []
 
@@ -682,7 +1147,7 @@ class KCP(object):
                 self.probe_wait = IKCP_PROBE_INIT
                 self.ts_probe = self.current + self.probe_wait
             else:
-                if self.current - self.ts_probe >= 0:
+                if itimediff(self.current, self.ts_probe) >= 0:
                     self.probe_wait = min(self.probe_wait + int(max(self.probe_wait,\
                             IKCP_PROBE_INIT) / 2), IKCP_PROBE_LIMIT)
                     self.ts_probe = self.current + self.probe_wait
@@ -692,31 +1157,51 @@ class KCP(object):
             self.probe_wait = 0
 
         if self.probe & IKCP_ASK_SEND != 0:
-            seg.cmd = IKCP_CMD_WASK
-            data += seg.encode()
-            if len(data) + IKCP_OVERHEAD > self.mtu:
-                self.output(data)
-                data = b''
+            pack_into(buffer, offset, conv, IKCP_CMD_WASK, 0, wnd, 0, 0, una, 0)
+            offset += IKCP_OVERHEAD
+            if offset + IKCP_OVERHEAD > mtu:
+                self.output_buffer(offset)
+                offset = 0
+
+        if self.probe & IKCP_ASK_TELL != 0:
+            pack_into(buffer, offset, conv, IKCP_CMD_WINS, 0, wnd, 0, 0, una, 0)
+            offset += IKCP_OVERHEAD
+            if offset + IKCP_OVERHEAD > mtu:
+                self.output_buffer(offset)
+                offset = 0
 
         self.probe = 0
+        return offset
 
-        cwnd = min(self.snd_wnd, self.rmt_wnd)
-        if not self.nocwnd:
-            cwnd = min(self.cwnd, cwnd)
 
-        while self.snd_nxt - (self.snd_una + cwnd) < 0:
+    def move_snd_queue(self, current, wnd):
+        '''
+        Move segments the window allows from snd_queue to snd_buf, return cwnd
+        '''
+        if self.sources:
+            self.feed_sources()
+
+        cwnd = self.send_window()
+        congestion = self.congestion
+        quota = 0x7fffffff
+        if congestion.pacing and self.snd_queue:
+            quota = congestion.send_quota(self, current)
+        sent = 0
+
+        while self.snd_nxt - (self.snd_una + cwnd) < 0 and sent < quota:
             if not self.snd_queue:
                 break
+            sent += 1
             newseg = self.snd_queue.popleft()
-            self.snd_buf.append(newseg)
             self.nsnd_que -= 1
             self.nsnd_buf += 1
 
             newseg.conv = self.conv
             newseg.cmd = IKCP_CMD_PUSH
-            newseg.wnd = seg.wnd
+            newseg.wnd = wnd
             newseg.ts = current
             newseg.sn = self.snd_nxt
+            self.snd_buf.put(newseg)
             self.snd_nxt += 1
             newseg.una = self.rcv_nxt
             newseg.resendts = current
@@ -724,73 +1209,92 @@ class KCP(object):
             newseg.fastack = 0
             newseg.xmit = 0
 
-        resent = 0xffffffff
-        if self.fastresend > 0:
-            resent = self.fastresend
+        if congestion.pacing and sent:
+            congestion.sent(self, sent)
+        return cwnd
 
-        rtomin = 0
-        if not self.nodelay:
-            rtomin = self.rx_rto >> 3
 
-        for segment in self.snd_buf:
-            needsend = False
-            if segment.xmit == 0:
-                needsend = True
-                segment.xmit += 1
-                segment.rto = self.rx_rto
-                segment.resendts = current + segment.rto + rtomin
-            elif current - segment.resendts >= 0:
-                needsend = True
-                segment.xmit += 1
-                self.xmit += 1
-                if not self.nodelay:
-                    segment.rto += self.rx_rto
-                else:
-                    segment.rto += int(self.rx_rto / 2)
-                segment.resendts = current + segment.rto
-                lost = True
-            elif segment.fastack >= resent:
-                needsend = True
-                segment.xmit += 1
-                segment.fastack = 0
-                segment.resendts = current + segment.rto
-                change = True
+    def send_window(self):
+        '''
+        Segments snd_buf may hold, the congestion window unless nocwnd
+        '''
+        cwnd = min(self.snd_wnd, self.rmt_wnd)
+        if not self.nocwnd:
+            cwnd = min(self.cwnd, cwnd)
+        return cwnd
 
-            if needsend:
-                segment.ts = current
-                segment.wnd = seg.wnd
-                segment.una = self.rcv_nxt
-                if len(data) + segment.len + IKCP_OVERHEAD > self.mtu:
-                    self.output(data)
-                    data = b''
 
-                data += segment.encode()
-                data += segment.data
+    def pacing_delay(self, current):
+        '''
+        Millisecs until a paced congestion controller lets the next segment
+        go, 0x7fffffff when nothing waits for it
+        '''
+        congestion = self.congestion
+        if not congestion.pacing:
+            return 0x7fffffff
+        if (self.snd_queue and self.snd_nxt - (self.snd_una + self.send_window()) < 0)\
+                or self.resend_delay(current) <= 0:
+            return congestion.next_send(self, current)
+        return 0x7fffffff
 
-                if segment.xmit >= self.dead_link:
-                    self.state = -1
 
-        if data:
-            self.output(data)
+    def flush_segment(self, segment, offset, current, wnd):
+        '''
+        Encode a data segment into the buffer, return the new offset
+        '''
+        segment.ts = current
+        segment.wnd = wnd
+        segment.una = self.rcv_nxt
+        if offset + segment.len + IKCP_OVERHEAD > self.mtu:
+            self.output_buffer(offset)
+            offset = 0
+
+        buffer = self.buffer
+        offset = segment.encode_into(buffer, offset)
+        size = len(segment.data)
+        buffer[offset:offset+size] = segment.data
+        return offset + size
 
-        if change:
-            inflight = self.snd_nxt - self.snd_una
-            self.ssthresh = int(inflight / 2)
-            if self.ssthresh < IKCP_THRESH_MIN:
-                self.ssthresh = IKCP_THRESH_MIN
-            self.cwnd = self.ssthresh + resent
-            self.incr = self.cwnd * self.mss
 
-        if lost:
-            self.ssthresh = int(cwnd / 2)
-            if self.ssthresh < IKCP_THRESH_MIN:
-                self.ssthresh = IKCP_THRESH_MIN
-            self.cwnd = 1
-            self.incr = self.mss
+    def flush_done(self, offset, cwnd, change, lost):
+        '''
+        Output what is left in the buffer and let congestion update the window
+        '''
+        if offset:
+            self.output_buffer(offset)
 
-        if self.cwnd < 1:
-            self.cwnd = 1
-            self.incr = self.mss
+        self.congestion.on_flush(self, cwnd, change, lost)
+        if self.adaptive:
+            self.adapt_interval()
+
+
+    def metrics(self):
+        '''
+        Counters and gauges of this session
+
+        Counters only grow: packets and bytes in and out, retransmissions by
+        timeout (xmit) and fast resend, times the link went dead.
+        '''
+        return {
+            'pkts_in': self.pkts_in,
+            'bytes_in': self.bytes_in,
+            'pkts_out': self.pkts_out,
+            'bytes_out': self.bytes_out,
+            'timeout_xmit': self.xmit,
+            'fast_xmit': self.fast_xmit,
+            'dead_events': self.dead_events,
+            'state': self.state,
+            'srtt': self.rx_srtt,
+            'rttval': self.rx_rttval,
+            'rto': self.rx_rto,
+            'cwnd': self.cwnd,
+            'ssthresh': self.ssthresh,
+            'rmt_wnd': self.rmt_wnd,
+            'nsnd_que': self.nsnd_que,
+            'nsnd_buf': self.nsnd_buf,
+            'nrcv_que': self.nrcv_que,
+            'nrcv_buf': self.nrcv_buf,
+        }
 
 
     def set_mut(self, mtu):
@@ -801,6 +1305,7 @@ class KCP(object):
             raise ValueError
         self.mtu = mtu
         self.mss = self.mtu - IKCP_OVERHEAD
+        self.buffer = bytearray((self.mtu + IKCP_OVERHEAD) * 3)
 
 
     def set_interval(self, interval):
@@ -809,6 +1314,7 @@ class KCP(object):
         '''
         interval = max(10, min(5000, interval))
         self.interval = interval
+        self.flush_interval = interval
 
 
     def set_wndsize(self, sndwnd=32, rcvwnd=32):
@@ -817,10 +1323,35 @@ class KCP(object):
         '''
         if sndwnd > 0:
             self.snd_wnd = sndwnd
+            self.snd_buf.reserve(sndwnd, self.snd_una, self.snd_nxt)
         if rcvwnd > 0:
+            self.rcv_buf.reserve(rcvwnd, self.rcv_nxt, self.rcv_nxt + len(self.rcv_buf.slots))
             self.rcv_wnd = max(rcvwnd, IKCP_WND_RCV)
 
 
+    def release(self):
+        '''
+        Give every segment back to the pool and drop the pending data, the
+        KCP must not be used afterwards
+        '''
+        put = self.pool.put
+        for queue in (self.snd_queue, self.rcv_queue):
+            for seg in queue:
+                put(seg)
+            queue.clear()
+        for ring in (self.snd_buf, self.rcv_buf):
+            for seg in ring.slots:
+                if seg is not None:
+                    put(seg)
+            ring.slots = [None] * len(ring.slots)
+        self.sources.clear()
+        self.acklist = []
+        self.nsnd_que = 0
+        self.nrcv_que = 0
+        self.nsnd_buf = 0
+        self.nrcv_buf = 0
+
+
     def waitsnd(self):
         '''
         get how many packet is waiting to be sent
@@ -851,3 +1382,27 @@ class KCP(object):
 
         if normal_control is not None:
             self.nocwnd = normal_control
+
+
+    def set_adaptive(self, adaptive=True, idle_interval=IKCP_IDLE_INTERVAL,\
+            ack_delay=IKCP_ACK_DELAY, ack_threshold=IKCP_ACK_THRESHOLD,\
+            send_threshold=IKCP_SEND_THRESHOLD):
+        '''
+        adaptive: True=flush on demand instead of every interval; default=False
+        idle_interval: longest sleep in millisec with nothing to send,\
+                the sleep doubles on every idle flush up to it
+        ack_delay: millisecs ACKs may wait to be coalesced
+        ack_threshold: pending ACKs flushed right away
+        send_threshold: queued segments flushed right away, when the window\
+                lets them go
+
+        check() tells when to update, it has to be called after every
+        send and input.
+        '''
+        self.adaptive = adaptive
+        self.idle_interval = max(idle_interval, self.interval)
+        self.ack_delay = max(ack_delay, 0)
+        self.ack_threshold = max(ack_threshold, 1)
+        self.send_threshold = max(send_threshold, 1)
+        if not adaptive:
+            self.wake()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Session lifecycle
+
+A SessionManager closes the sessions whose link is dead (a segment was
+sent dead_link times, KCP.state is -1) or which received nothing for
+idle_timeout millisecs. Sessions are kept in an OrderedDict by their last
+input, oldest first, so a sweep only looks at the ones it closes. The
+clock of the manager only moves on each sweep, an input costs one dict
+lookup unless it is the first of the sweep interval, and idle sessions
+are closed within one sweep_interval of their timeout.
+
+    lifecycle = SessionManager(idle_timeout=60000)
+    server = EchoServer(lifecycle=lifecycle)
+
+Servers and clients register their sessions with a callback closing them,
+KCPStream.close unregisters them.
+'''
+
+from collections import OrderedDict
+from tornado.ioloop import PeriodicCallback
+from pykcp.stream import current_millis
+
+IKCP_IDLE_TIMEOUT = 60000      # millisecs without input closing a session
+IKCP_SWEEP_INTERVAL = 1000     # millisecs between sweeps
+
+class SessionManager(object):
+    '''
+    Session manager
+    '''
+
+    def __init__(self, idle_timeout=IKCP_IDLE_TIMEOUT, sweep_interval=IKCP_SWEEP_INTERVAL):
+        assert sweep_interval > 0
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.sessions = OrderedDict()
+        self.dead_dct = {}
+        self.current = current_millis()
+        self.idle_closed = 0
+        self.dead_closed = 0
+        self.periodic_callback = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self):
+        '''
+        Start sweeping on the current IOLoop
+        '''
+        if self.periodic_callback is None:
+            self.periodic_callback = PeriodicCallback(self.sweep, self.sweep_interval)
+            self.periodic_callback.start()
+
+    def stop(self):
+        '''
+        Stop sweeping
+        '''
+        if self.periodic_callback is not None:
+            self.periodic_callback.stop()
+            self.periodic_callback = None
+
+    def add(self, kcpstream, callback):
+        '''
+        Manage kcpstream, callback(kcpstream) closes it
+        '''
+        self.sessions[kcpstream] = (self.current, callback)
+        self.start()
+
+    def remove(self, kcpstream):
+        '''
+        Forget kcpstream
+        '''
+        self.sessions.pop(kcpstream, None)
+        self.dead_dct.pop(kcpstream, None)
+
+    def touch(self, kcpstream):
+        '''
+        kcpstream received something
+        '''
+        entry = self.sessions.get(kcpstream)
+        if entry is not None and entry[0] != self.current:
+            self.sessions[kcpstream] = (self.current, entry[1])
+            self.sessions.move_to_end(kcpstream)
+
+    def dead(self, kcpstream):
+        '''
+        The link of kcpstream is dead, close it on the next sweep
+        '''
+        if kcpstream in self.sessions:
+            self.dead_dct[kcpstream] = None
+
+    def sweep(self, current=None):
+        '''
+        Close the dead sessions and the idle ones, return how many
+        '''
+        if current is None:
+            current = current_millis()
+        self.current = current
+        sessions = self.sessions
+        expired = []
+        while self.dead_dct:
+            kcpstream, _ = self.dead_dct.popitem()
+            entry = sessions.pop(kcpstream, None)
+            if entry is not None:
+                expired.append((kcpstream, entry[1]))
+                self.dead_closed += 1
+        deadline = current - self.idle_timeout
+        while sessions:
+            kcpstream, entry = next(iter(sessions.items()))
+            if entry[0] > deadline:
+                break
+            del sessions[kcpstream]
+            expired.append((kcpstream, entry[1]))
+            self.idle_closed += 1
+        for kcpstream, callback in expired:
+            callback(kcpstream)
+        return len(expired)
+
+    def metrics(self):
+        '''
+        Managed sessions and sessions closed so far
+        '''
+        return {
+            'sessions': len(self.sessions),
+            'idle_closed': self.idle_closed,
+            'dead_closed': self.dead_closed,
+        }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Metrics
+
+KCP objects count packets, bytes and retransmissions as plain integer
+attributes, KCP.metrics() reads them together with the RTT and window
+gauges. ServerMetrics sums them over the sessions of a server, including
+the ones already closed, so server counters never go back.
+
+Servers expose them with metrics(). MetricsHandler serves them as
+Prometheus text from any tornado Application, MetricsReporter hands a
+snapshot to a callback periodically.
+
+    app = tornado.web.Application([('/metrics', MetricsHandler, {'source': server})])
+    MetricsReporter(server, logging.info, 60).start()
+'''
+
+import time
+import tornado.web
+from tornado.ioloop import PeriodicCallback
+from pykcp.kcp import IKCP_SEG_POOL
+
+KCP_COUNTERS = (
+    'pkts_in', 'bytes_in', 'pkts_out', 'bytes_out',
+    'timeout_xmit', 'fast_xmit', 'dead_events',
+)
+KCP_GAUGES = ('nsnd_que', 'nsnd_buf', 'nrcv_que', 'nrcv_buf')
+
+class ServerMetrics(object):
+    '''
+    Server wide sums of the session metrics
+    '''
+
+    def __init__(self):
+        self.closed = dict.fromkeys(KCP_COUNTERS, 0)
+        self.sessions_closed = 0
+
+    def retire(self, kcp):
+        '''
+        Keep the counters of a session which goes away
+        '''
+        if kcp is None:
+            return
+        closed = self.closed
+        for name, value in kcp.metrics().items():
+            if name in closed:
+                closed[name] += value
+        self.sessions_closed += 1
+
+    def collect(self, kcps):
+        '''
+        Counters and gauges of the server, kcps are the live sessions
+        '''
+        metrics = dict(self.closed)
+        metrics.update(dict.fromkeys(KCP_GAUGES, 0))
+        sessions = 0
+        dead = 0
+        for kcp in kcps:
+            sessions += 1
+            if kcp.state == -1:
+                dead += 1
+            for name, value in kcp.metrics().items():
+                if name in metrics:
+                    metrics[name] += value
+        metrics['sessions'] = sessions
+        metrics['sessions_dead'] = dead
+        metrics['sessions_closed'] = self.sessions_closed
+        metrics['pool_free'] = len(IKCP_SEG_POOL)
+        metrics['pool_created'] = IKCP_SEG_POOL.created
+        return metrics
+
+def prometheus_text(metrics, prefix='pykcp'):
+    '''
+    Prometheus text exposition of a metrics dict
+    '''
+    lines = []
+    for name in sorted(metrics):
+        value = metrics[name]
+        if not isinstance(value, (int, float)):
+            continue
+        if name in KCP_COUNTERS or name in ('sessions_closed', 'pool_created'):
+            full_name = '%s_%s_total' % (prefix, name)
+            lines.append('# TYPE %s counter' % full_name)
+        else:
+            full_name = '%s_%s' % (prefix, name)
+            lines.append('# TYPE %s gauge' % full_name)
+        lines.append('%s %s' % (full_name, value))
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(tornado.web.RequestHandler):
+    '''
+    GET the metrics of source (anything with metrics()) as Prometheus text
+    '''
+
+    # pylint: disable=abstract-method
+    # pylint: disable=arguments-differ
+
+    def initialize(self, source, prefix='pykcp'):
+        self.source = source # pylint: disable=attribute-defined-outside-init
+        self.prefix = prefix # pylint: disable=attribute-defined-outside-init
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(prometheus_text(self.source.metrics(), self.prefix))
+
+class MetricsReporter(object):
+    '''
+    Call callback(snapshot) every interval secs, the snapshot carries its time
+    '''
+
+    def __init__(self, source, callback, interval=60):
+        self.source = source
+        self.callback = callback
+        self.periodic = PeriodicCallback(self.report, interval * 1000)
+
+    def start(self):
+        '''
+        Start reporting
+        '''
+        self.periodic.start()
+
+    def stop(self):
+        '''
+        Stop reporting
+        '''
+        self.periodic.stop()
+
+    def report(self):
+        '''
+        Report one snapshot now
+        '''
+        snapshot = self.source.metrics()
+        snapshot['time'] = time.time()
+        self.callback(snapshot)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Profiling hooks
+
+A Profiler times one call out of every 1 / sample_rate of the hot methods,
+the input, flush and recv of the KCP streams and the transport writes, into
+log-linear histograms. enable() wraps the methods on their classes and
+disable() puts the originals back, so a disabled profiler costs nothing and
+one can be switched on for a few minutes on a live server. The transports look output
+up on every packet, the sessions started before enable() are timed too and
+the ones started meanwhile stop being timed on disable(). KCP is timed
+through KCPStream, whose methods can be wrapped in the compiled build too,
+targets which can not be wrapped are listed as skipped in snapshot().
+
+    profiler = Profiler(sample_rate=0.01)
+    profiler.enable()
+    ...
+    print(profiler.snapshot())
+    profiler.disable()
+
+ProfilingHandler does the same over HTTP from a tornado Application.
+'''
+
+import functools
+import json
+import logging
+import time
+import tornado.web
+from pykcp.batch import DatagramSender
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream
+from pykcp.tcpclient import TCPClient
+from pykcp.tcpserver import TCPServer
+from pykcp.udpserver import UDPServer
+
+IKCP_HISTOGRAM_SUB_BITS = 4
+IKCP_HISTOGRAM_BUCKETS = 64 << IKCP_HISTOGRAM_SUB_BITS
+
+PROFILE_TARGETS = (
+    ('input', KCPStream, 'input'),
+    ('flush', KCPStream, 'update_kcp'),
+    ('recv', KCPStream, 'recv_messages'),
+    ('recv', KCPByteStream, 'recv_messages'),
+    ('udp_output', UDPServer, 'output'),
+    ('udp_write', DatagramSender, 'send_datagrams'),
+    ('tcp_output', TCPServer, 'output'),
+    ('tcp_write', TCPServer, 'write_batch'),
+    ('tcp_client_output', TCPClient, 'output'),
+)
+
+def bucket_index(value):
+    '''
+    Histogram bucket of a non-negative integer
+
+    Values below 2 << IKCP_HISTOGRAM_SUB_BITS have their own bucket, above
+    every power of two is split in 1 << IKCP_HISTOGRAM_SUB_BITS buckets, so
+    the relative error stays under 1/16.
+    '''
+    sub = 1 << IKCP_HISTOGRAM_SUB_BITS
+    if value < sub << 1:
+        return value
+    shift = value.bit_length() - IKCP_HISTOGRAM_SUB_BITS - 1
+    return (shift << IKCP_HISTOGRAM_SUB_BITS) + (value >> shift)
+
+def bucket_value(index):
+    '''
+    Lowest value of a histogram bucket
+    '''
+    sub = 1 << IKCP_HISTOGRAM_SUB_BITS
+    if index < sub << 1:
+        return index
+    shift = (index >> IKCP_HISTOGRAM_SUB_BITS) - 1
+    return ((index & (sub - 1)) + sub) << shift
+
+class Histogram(object):
+    '''
+    Log-linear histogram of nanosecs
+
+    record only touches a list slot and three integers, it takes no lock.
+    '''
+
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.counts = [0] * IKCP_HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def record(self, value):
+        '''
+        Record one value
+        '''
+        self.counts[min(bucket_index(value), IKCP_HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, percent):
+        '''
+        Value under which percent of the recorded values are
+        '''
+        if not self.count:
+            return 0
+        rank = max(int(self.count * percent / 100.0 + 0.5), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_value(index + 1) - 1, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        '''
+        count, mean, percentiles and max in microsecs
+        '''
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count / 1000.0 if self.count else 0.0,
+            'p50_us': self.percentile(50) / 1000.0,
+            'p90_us': self.percentile(90) / 1000.0,
+            'p99_us': self.percentile(99) / 1000.0,
+            'p999_us': self.percentile(99.9) / 1000.0,
+            'max_us': self.maximum / 1000.0,
+        }
+
+def sampled(func, histogram, every):
+    '''
+    Wrap func to time one call out of every
+    '''
+    countdown = [every]
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        countdown[0] -= 1
+        if countdown[0] > 0:
+            return func(*args, **kwargs)
+        countdown[0] = every
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.record(perf_counter_ns() - start)
+
+    wrapper.profiled = func
+    return wrapper
+
+def check_sample_rate(sample_rate):
+    '''
+    Raise ValueError unless 0 < sample_rate <= 1
+    '''
+    if not 0 < sample_rate <= 1:
+        raise ValueError('sample_rate must be in (0, 1], not %r' % (sample_rate,))
+
+class Profiler(object):
+    '''
+    Sampled timing of the hot methods
+    '''
+
+    def __init__(self, sample_rate=0.01, targets=PROFILE_TARGETS):
+        check_sample_rate(sample_rate)
+        self.sample_rate = sample_rate
+        self.targets = targets
+        self.histograms = {}
+        self.originals = []
+        self.skipped = []
+        self.started = None
+
+    @property
+    def enabled(self):
+        '''
+        True while the methods are wrapped
+        '''
+        return bool(self.originals)
+
+    def enable(self, sample_rate=None):
+        '''
+        Wrap the target methods, histograms start over
+        '''
+        if sample_rate is not None:
+            check_sample_rate(sample_rate)
+        if self.enabled:
+            self.disable()
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        every = max(int(round(1.0 / self.sample_rate)), 1)
+        self.histograms = {}
+        self.skipped = []
+        for name, cls, method in self.targets:
+            func = cls.__dict__.get(method)
+            if func is None or hasattr(func, 'profiled'):
+                continue
+            histogram = self.histograms.get(name) or Histogram()
+            try:
+                setattr(cls, method, sampled(func, histogram, every))
+            except TypeError:
+                # extension types, as the classes of the compiled kcp module
+                self.skipped.append('%s.%s' % (cls.__name__, method))
+                continue
+            self.histograms[name] = histogram
+            self.originals.append((cls, method, func))
+        if self.skipped:
+            logging.getLogger(__name__).warning('Profiler can not time %s',\
+                    ', '.join(self.skipped))
+        self.started = time.time()
+
+    def disable(self):
+        '''
+        Put the original methods back, the histograms are kept
+        '''
+        while self.originals:
+            cls, method, func = self.originals.pop()
+            setattr(cls, method, func)
+
+    def snapshot(self):
+        '''
+        Summary of every histogram
+        '''
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'started': self.started,
+            'skipped': self.skipped,
+            'histograms': dict((name, histogram.summary())\
+                    for name, histogram in self.histograms.items()),
+        }
+
+    def metrics(self):
+        '''
+        Flat gauges, for pykcp.metrics exporters
+        '''
+        metrics = {}
+        for name, histogram in self.histograms.items():
+            for key, value in histogram.summary().items():
+                metrics['profile_%s_%s' % (name, key)] = value
+        return metrics
+
+class ProfilingHandler(tornado.web.RequestHandler):
+    '''
+    GET the snapshot as JSON, POST enable=1 or enable=0 to switch
+
+    POST takes an optional sample_rate, 400 unless 0 < sample_rate <= 1.
+    '''
+
+    # pylint: disable=abstract-method
+    # pylint: disable=arguments-differ
+
+    def initialize(self, profiler):
+        self.profiler = profiler # pylint: disable=attribute-defined-outside-init
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(json.dumps(self.profiler.snapshot()))
+
+    def post(self):
+        if self.get_argument('enable', '1') == '1':
+            sample_rate = self.get_argument('sample_rate', None)
+            try:
+                self.profiler.enable(float(sample_rate) if sample_rate else None)
+            except ValueError as e:
+                raise tornado.web.HTTPError(400, '%s', e)
+        else:
+            self.profiler.disable()
+        self.get()
@@ -0,0 +1,108 @@
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Scheduler
+
+One timing wheel drives the update of every KCP stream of a server instead
+of one IOLoop timeout per stream. Deadlines are rounded up to a tick and
+hashed into the wheel slot of that tick, a stream whose deadline is more
+than one wheel turn away simply stays in its slot for the next turn.
+'''
+
+from tornado.ioloop import PeriodicCallback
+from pykcp.stream import current_millis
+
+IKCP_SCHEDULER_TICK = 10       # tick length in millisec
+IKCP_SCHEDULER_SLOTS = 512     # must be a power of two
+
+class KCPScheduler(object):
+    '''
+    KCP scheduler
+    '''
+
+    def __init__(self, tick=IKCP_SCHEDULER_TICK, slots=IKCP_SCHEDULER_SLOTS):
+        assert tick > 0
+        assert slots > 0 and slots & (slots - 1) == 0, 'Slots must be a power of two'
+        self.tick = tick
+        self.mask = slots - 1
+        self.wheel = [{} for _ in range(slots)]
+        self.tick_dct = {}
+        self.current_tick = current_millis() // tick
+        self.periodic_callback = None
+
+    def __len__(self):
+        return len(self.tick_dct)
+
+    def start(self):
+        '''
+        Start ticking on the current IOLoop
+        '''
+        if self.periodic_callback is None:
+            self.periodic_callback = PeriodicCallback(self.run, self.tick)
+            self.periodic_callback.start()
+
+    def stop(self):
+        '''
+        Stop ticking
+        '''
+        if self.periodic_callback is not None:
+            self.periodic_callback.stop()
+            self.periodic_callback = None
+
+    def schedule(self, kcpstream, deadline):
+        '''
+        Update kcpstream at the first tick not before deadline (millisec)
+        '''
+        self.unschedule(kcpstream)
+        tick_no = max(-(-deadline // self.tick), self.current_tick + 1)
+        self.wheel[tick_no & self.mask][kcpstream] = tick_no
+        self.tick_dct[kcpstream] = tick_no
+        self.start()
+
+    def unschedule(self, kcpstream):
+        '''
+        Forget kcpstream
+        '''
+        tick_no = self.tick_dct.pop(kcpstream, None)
+        if tick_no is not None:
+            del self.wheel[tick_no & self.mask][kcpstream]
+
+    def run(self):
+        '''
+        Update every stream whose deadline has passed
+
+        The clock is read once, all streams of this tick share the time.
+        '''
+        current = current_millis()
+        now_tick = current // self.tick
+        first_tick = max(self.current_tick + 1, now_tick - self.mask)
+        self.current_tick = max(self.current_tick, now_tick)
+
+        due = []
+        for tick_no in range(first_tick, now_tick + 1):
+            slot = self.wheel[tick_no & self.mask]
+            if not slot:
+                continue
+            expired = [kcpstream for kcpstream, deadline in slot.items()\
+                    if deadline <= now_tick]
+            for kcpstream in expired:
+                del slot[kcpstream]
+                del self.tick_dct[kcpstream]
+            due.extend(expired)
+
+        for kcpstream in due:
+            kcpstream.update(current)
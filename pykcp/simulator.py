@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Network simulator
+
+KCP objects are connected through their output by Paths modelling loss,
+delay, jitter, reordering, duplication and a bandwidth cap. Everything runs
+on a virtual millisec clock in discrete events: KCP updates at the time
+check() asks for and packets arrive when the path delivers them, so a
+minute of traffic takes a fraction of a second.
+
+    sim = Simulator(seed=1)
+    path = Path(loss=GilbertElliottLoss(0.01, 0.3), delay=40, jitter=10,
+                bandwidth=1000000)
+    sender, receiver = sim.connect(path, nodelay=(True, 10, 2, True))
+    flow = sim.transfer(sender, receiver, count=1000, size=1000)
+    sim.run(60000)
+    print(flow.report())
+
+Every random decision comes from the seed, a run is reproducible.
+'''
+
+import heapq
+import math
+import random
+import struct
+from pykcp.kcp import KCP, IKCP_PACKET_HEAD, IKCP_OVERHEAD, IKCP_CMD_PUSH
+
+IKCP_MESSAGE_HEAD = struct.Struct('<II')     # flow, message index
+
+class BernoulliLoss(object):
+    '''
+    Every packet is lost with the same probability
+    '''
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def lost(self, rnd):
+        '''
+        True when the next packet is lost
+        '''
+        return rnd.random() < self.rate
+
+class GilbertElliottLoss(object):
+    '''
+    Bursty loss, a two state markov chain
+
+    p is the probability to go from the good state to the bad one, r the
+    probability to come back. Packets are lost with loss_good in the good
+    state and with loss_bad in the bad one.
+    '''
+
+    def __init__(self, p, r, loss_good=0.0, loss_bad=1.0):
+        self.p = p
+        self.r = r
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def lost(self, rnd):
+        '''
+        True when the next packet is lost
+        '''
+        if self.bad:
+            if rnd.random() < self.r:
+                self.bad = False
+        elif rnd.random() < self.p:
+            self.bad = True
+        return rnd.random() < (self.loss_bad if self.bad else self.loss_good)
+
+class Path(object):
+    '''
+    One direction of a link
+
+    delay and jitter are millisecs, a packet takes delay plus a uniform
+    jitter in [-jitter, jitter]. reorder is the probability for a packet to
+    be held reorder_delay more millisecs, duplicate the probability to be
+    delivered twice. bandwidth is in bytes per sec, packets wait in a queue
+    of at most queue_size bytes to go through it, the ones which do not fit
+    are dropped.
+    '''
+
+    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, loss=None, delay=0, jitter=0, reorder=0.0, reorder_delay=50,\
+            duplicate=0.0, bandwidth=None, queue_size=65536):
+        if isinstance(loss, float):
+            loss = BernoulliLoss(loss)
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate
+        self.bandwidth = bandwidth
+        self.queue_size = queue_size
+        self.busy_until = 0.0
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def copy(self):
+        '''
+        A path with the same settings and its own state
+        '''
+        loss = self.loss
+        if isinstance(loss, GilbertElliottLoss):
+            loss = GilbertElliottLoss(loss.p, loss.r, loss.loss_good, loss.loss_bad)
+        return Path(loss, self.delay, self.jitter, self.reorder, self.reorder_delay,\
+                self.duplicate, self.bandwidth, self.queue_size)
+
+    def arrivals(self, now, size, rnd):
+        '''
+        Times a packet of size bytes sent now arrives at, empty when lost
+        '''
+        self.packets += 1
+        self.bytes += size
+        if self.bandwidth:
+            start = max(now, self.busy_until)
+            if (start - now) * self.bandwidth / 1000.0 + size > self.queue_size:
+                self.dropped += 1
+                return []
+            self.busy_until = start + size * 1000.0 / self.bandwidth
+            now = self.busy_until
+        if self.loss is not None and self.loss.lost(rnd):
+            self.dropped += 1
+            return []
+        arrival = now + self.delay
+        if self.jitter:
+            arrival += rnd.uniform(-self.jitter, self.jitter)
+        if self.reorder and rnd.random() < self.reorder:
+            arrival += self.reorder_delay
+        arrival = max(arrival, now)
+        if self.duplicate and rnd.random() < self.duplicate:
+            return [arrival, arrival + rnd.uniform(0, max(self.jitter, 1))]
+        return [arrival]
+
+class Flow(object):
+    '''
+    Messages sent from one KCP to another, with their latencies
+    '''
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, simulator, flow_id, sender, receiver, count, size):
+        self.simulator = simulator
+        self.flow_id = flow_id
+        self.sender = sender
+        self.receiver = receiver
+        self.count = count
+        self.size = size
+        self.sent = []
+        self.latencies = []
+        self.first = None
+        self.last = None
+
+    def report(self):
+        '''
+        goodput in bytes per sec, latencies in millisecs and the
+        retransmission overhead of the sender
+        '''
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        duration = (self.last - self.first) if count else 0
+        pushes = self.simulator.pushes.get(id(self.sender), (0, set()))
+        unique = len(pushes[1])
+        return {
+            'messages': self.count,
+            'sent': len(self.sent),
+            'delivered': count,
+            'goodput': count * self.size * 1000.0 / duration if duration > 0 else 0.0,
+            'latency_mean': sum(latencies) / count if count else None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99),
+            'retransmission_overhead': (pushes[0] - unique) / unique if unique else 0.0,
+        }
+
+def percentile(values, percent):
+    '''
+    Nearest rank percentile of sorted values
+    '''
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+class Simulator(object):
+    '''
+    Discrete event simulator driving KCP objects on a virtual clock
+    '''
+
+    def __init__(self, seed=1):
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.events = []
+        self.seq = 0
+        self.routes = {}
+        self.pushes = {}
+        self.flows = []
+        self.conv = 0
+
+    def current(self):
+        '''
+        The virtual clock in whole millisecs, as KCP wants it
+        '''
+        return int(self.now)
+
+    def schedule(self, when, callback, *args):
+        '''
+        Call callback(*args) at virtual time when
+        '''
+        self.seq += 1
+        heapq.heappush(self.events, (when, self.seq, callback, args))
+
+    def connect(self, path, reverse=None, kcps=None, nodelay=None, wndsize=None):
+        '''
+        Connect two KCP objects, return them
+
+        The pair kcps is created when not given. reverse is the path from the
+        second to the first, a copy of path by default. nodelay and wndsize
+        are argument tuples of set_nodelay and set_wndsize for both.
+        '''
+        if kcps is None:
+            self.conv += 1
+            kcps = (KCP(self.conv, self.output), KCP(self.conv, self.output))
+        kcp1, kcp2 = kcps
+        self.routes[id(kcp1)] = (kcp2, path)
+        self.routes[id(kcp2)] = (kcp1, reverse or path.copy())
+        for kcp in (kcp1, kcp2):
+            kcp.output_func = self.output
+            if nodelay:
+                kcp.set_nodelay(*nodelay)
+            if wndsize:
+                kcp.set_wndsize(*wndsize)
+            self.schedule(self.now, self.update, kcp)
+        return kcp1, kcp2
+
+    def transfer(self, sender, receiver, count, size, interval=0, start=0):
+        '''
+        Send count messages of size bytes every interval millisecs
+        '''
+        assert size >= IKCP_MESSAGE_HEAD.size
+        flow = Flow(self, len(self.flows), sender, receiver, count, size)
+        self.flows.append(flow)
+        for i in range(count):
+            self.schedule(start + i * interval, self.send, flow, i)
+        return flow
+
+    def send(self, flow, index):
+        '''
+        Application send of one message
+        '''
+        flow.sent.append(self.now)
+        message = IKCP_MESSAGE_HEAD.pack(flow.flow_id, index) +\
+                b'\0' * (flow.size - IKCP_MESSAGE_HEAD.size)
+        flow.sender.send(message)
+
+    def output(self, kcp, data):
+        '''
+        Output of every KCP, hand the packet to its path
+        '''
+        self.count_pushes(kcp, data)
+        peer, path = self.routes[id(kcp)]
+        for arrival in path.arrivals(self.now, len(data), self.random):
+            self.schedule(arrival, self.arrive, peer, data)
+
+    def count_pushes(self, kcp, data):
+        '''
+        Count the PUSH segments of a packet, all and distinct
+        '''
+        total, sns = self.pushes.setdefault(id(kcp), (0, set()))
+        offset = 0
+        while len(data) - offset >= IKCP_OVERHEAD:
+            _, cmd, _, _, _, sn, _, length = IKCP_PACKET_HEAD.unpack_from(data, offset)
+            if cmd == IKCP_CMD_PUSH:
+                total += 1
+                sns.add(sn)
+            offset += IKCP_OVERHEAD + length
+        self.pushes[id(kcp)] = (total, sns)
+
+    def arrive(self, kcp, data):
+        '''
+        A packet reaches kcp
+        '''
+        kcp.current = self.current()
+        kcp.input(data)
+        self.receive(kcp)
+
+    def update(self, kcp):
+        '''
+        Update kcp and come back when check says so
+        '''
+        current = self.current()
+        kcp.update(current)
+        self.receive(kcp)
+        self.schedule(max(kcp.check(current), current + 1), self.update, kcp)
+
+    def receive(self, kcp):
+        '''
+        Read every message of kcp and record their latency
+        '''
+        message = kcp.recv()
+        while message is not None:
+            flow_id, index = IKCP_MESSAGE_HEAD.unpack_from(message)
+            flow = self.flows[flow_id]
+            flow.latencies.append(self.now - flow.sent[index])
+            if flow.first is None:
+                flow.first = flow.sent[0]
+            flow.last = self.now
+            message = kcp.recv()
+
+    def run(self, until):
+        '''
+        Run events until virtual time until, return the number of events
+        '''
+        events = self.events
+        count = 0
+        while events and events[0][0] <= until:
+            when, _, callback, args = heapq.heappop(events)
+            self.now = when
+            callback(*args)
+            count += 1
+        self.now = max(self.now, until)
+        return count
+
+    def run_until_delivered(self, flows, timeout):
+        '''
+        Run until every message of flows arrived or timeout millisecs passed
+        '''
+        deadline = self.now + timeout
+        step = 100
+        while self.now < deadline:
+            self.run(min(self.now + step, deadline))
+            if all(len(flow.latencies) == flow.count for flow in flows):
+                return True
+        return False
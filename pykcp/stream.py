@@ -19,60 +19,316 @@ Stream
 '''
 
 import time
+from asyncio import Future
+from pykcp.kcp import itimediff, IKCP_ASK_TELL
 
 IKCP_HANDSHAKE_KEYWORD = b'ok\n\n\n'
+IKCP_CONV_MAX_SIZE = 16        # longest conv line of a stream handshake
+IKCP_HIGH_WATERMARK = 1024     # waitsnd segments pausing a stream
+IKCP_LOW_WATERMARK = 256       # waitsnd segments resuming it
+
+def current_millis():
+    '''
+    Current time in millisecond
+    '''
+    return int(time.time() * 1000)
 
 class KCPStream(object):
     '''
     KCP stream
+
+    A precise stream flushes on the next IOLoop iteration (or scheduler
+    tick) when send or input leaves something to send right away, instead
+    of waiting for the next interval. With an adaptive KCP (see
+    KCP.set_adaptive) send and input move the pending update closer
+    instead, when ACKs or queued segments are due before it.
+
+    Every complete message is received on each update. They are handed to
+    batch_callback in one list when it is given, else to callback one by one.
+
+    A send leaving waitsnd() at high_watermark segments or more pauses the
+    stream and calls pause_callback, it resumes and calls writable_callback
+    once waitsnd() is down to low_watermark. Producers wait for drain().
+
+    A stream given a lifecycle (see pykcp.lifecycle) tells it about its
+    input and its dead link. Close gives the segments of the KCP back to
+    the pool and stops the updates, also when a message callback closes the
+    stream.
     '''
 
     __slot__ = ('kcp', 'stream', 'address',\
-            'timeout_handle', 'ioloop', 'timeout', 'message_callback')
+            'timeout_handle', 'ioloop', 'timeout', 'message_callback', 'scheduler',\
+            'precise', 'urgent', 'messages_callback',\
+            'high_watermark', 'low_watermark', 'paused', 'drain_waiters',\
+            'pause_callback', 'writable_callback', 'deadline', 'lifecycle', 'closed')
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, kcp, stream, address, ioloop, callback=None):
+    def __init__(self, kcp, stream, address, ioloop, callback=None, scheduler=None,\
+            precise=False, batch_callback=None, high_watermark=IKCP_HIGH_WATERMARK,\
+            low_watermark=IKCP_LOW_WATERMARK, pause_callback=None, writable_callback=None,\
+            lifecycle=None):
+        assert low_watermark < high_watermark
         self.stream = stream
         self.address = address
         self.kcp = kcp
         self.timeout_handle = None
+        self.deadline = 0
         self.ioloop = ioloop
         self.message_callback = callback
+        self.messages_callback = batch_callback
+        self.scheduler = scheduler
+        self.precise = precise
+        self.urgent = False
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.paused = False
+        self.drain_waiters = []
+        self.pause_callback = pause_callback
+        self.writable_callback = writable_callback
+        self.lifecycle = lifecycle
+        self.closed = False
 
-    def get_timeout(self):
+    def get_delay(self, current):
         '''
-        Get timeout
+        Get millisec until the next update
         '''
         assert self.kcp
-        now = time.time()
-        wait = self.kcp.check(int(now * 1000))
-        return wait / 1000.0
+        # check works on 32 bits timestamps, only trust the difference
+        delay = itimediff(self.kcp.check(current), current)
+        return max(0, min(delay, self.kcp.flush_interval))
 
-    def update(self):
+    def get_timeout(self, current=None):
         '''
-        Update
+        Get the IOLoop deadline of the next update
         '''
         assert self.ioloop
+        if current is None:
+            current = current_millis()
+        return self.ioloop.time() + self.get_delay(current) / 1000.0
+
+    def update(self, current=None):
+        '''
+        Update, a scheduler passes the time it read for the whole tick
+        '''
         assert self.kcp
-        self.kcp.update(int(time.time() * 1000))
-        data = self.kcp.recv()
-        if data:
-            self.handle_message(data)
-        self.timeout_handle = \
-                self.ioloop.add_timeout(self.get_timeout(), self.update)
+        if self.closed:
+            return
+        if current is None:
+            current = current_millis()
+        self.update_kcp(current)
+        if self.kcp.state == -1 and self.lifecycle is not None:
+            self.lifecycle.dead(self)
+        if self.paused:
+            self.check_writable()
+        wnd = self.kcp.wnd_unused()
+        messages = self.recv_messages()
+        if messages:
+            self.handle_messages(messages)
+            if self.closed:
+                return
+            # a large drain reopens the window, tell the peer at once
+            if self.kcp.wnd_unused() - wnd >= self.kcp.rcv_wnd // 2:
+                self.kcp.probe |= IKCP_ASK_TELL
+            if self.kcp.probe & IKCP_ASK_TELL:
+                self.kcp.flush(current)
+        delay = self.get_delay(current)
+        self.deadline = current + delay
+        if self.scheduler is not None:
+            self.scheduler.schedule(self, self.deadline)
+        else:
+            self.set_timeout(self.ioloop.time() + delay / 1000.0)
+
+    def update_kcp(self, current):
+        '''
+        Flush at once when urgent, else when the interval is due
+        '''
+        if self.urgent:
+            self.urgent = False
+            self.kcp.flush(current)
+        self.kcp.update(current)
+
+    def reschedule(self, current=None):
+        '''
+        Update earlier when the adaptive KCP has to flush before the pending
+        update
+        '''
+        if self.closed:
+            return
+        if current is None:
+            current = current_millis()
+        delay = self.kcp.adaptive_delay(current)
+        if delay <= 0:
+            self.wakeup()
+        elif current + delay < self.deadline:
+            self.deadline = current + delay
+            if self.scheduler is not None:
+                self.scheduler.schedule(self, self.deadline)
+            else:
+                self.set_timeout(self.ioloop.time() + delay / 1000.0)
+
+    def set_timeout(self, deadline):
+        '''
+        Update at the IOLoop deadline instead of the pending timeout
+        '''
+        assert self.ioloop
+        self.remove_timeout()
+        self.timeout_handle = self.ioloop.call_at(deadline, self.update)
+
+    def remove_timeout(self):
+        '''
+        Remove the pending timeout
+        '''
+        if self.ioloop and self.timeout_handle:
+            self.ioloop.remove_timeout(self.timeout_handle)
+            self.timeout_handle = None
+
+    def recv_messages(self):
+        '''
+        Receive every complete message
+        '''
+        messages = []
+        recv = self.kcp.recv
+        data = recv()
+        while data is not None:
+            messages.append(data)
+            data = recv()
+        return messages
+
+    def wakeup(self):
+        '''
+        Flush on the next IOLoop iteration or scheduler tick
+        '''
+        if self.urgent or self.closed:
+            return
+        self.urgent = True
+        if self.scheduler is not None:
+            self.scheduler.schedule(self, 0)
+        else:
+            self.set_timeout(self.ioloop.time())
 
     def send(self, data):
         '''
         Send
         '''
         assert self.kcp
-        self.kcp.send(data)
+        ret = self.kcp.send(data)
+        if not self.paused and self.kcp.waitsnd() >= self.high_watermark:
+            self.pause()
+        if self.kcp.adaptive:
+            self.reschedule()
+        elif self.precise:
+            self.wakeup()
+        return ret
+
+    def send_stream(self, source, callback=None):
+        '''
+        Send a file, an iterable of chunks or a large buffer as the window
+        opens, see KCP.send_stream
+        '''
+        assert self.kcp
+        self.kcp.send_stream(source, callback)
+        if not self.paused and self.kcp.waitsnd() >= self.high_watermark:
+            self.pause()
+        if self.kcp.adaptive:
+            self.reschedule()
+        elif self.precise:
+            self.wakeup()
+
+    def pause(self):
+        '''
+        waitsnd() reached the high watermark
+        '''
+        self.paused = True
+        if callable(self.pause_callback):
+            self.pause_callback(self)
+
+    def check_writable(self):
+        '''
+        Resume once waitsnd() is down to the low watermark
+        '''
+        if self.kcp.waitsnd() <= self.low_watermark:
+            self.resume()
+
+    def resume(self):
+        '''
+        Wake the producers waiting in drain
+        '''
+        self.paused = False
+        self.wake_drain_waiters()
+        if callable(self.writable_callback):
+            self.writable_callback(self)
+
+    def wake_drain_waiters(self):
+        '''
+        Resolve the futures of drain
+        '''
+        waiters = self.drain_waiters
+        self.drain_waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def create_future(self):
+        '''
+        Future of the event loop of the stream
+        '''
+        if self.ioloop is not None:
+            return self.ioloop.asyncio_loop.create_future()
+        return Future()
+
+    def drain(self):
+        '''
+        Future resolved once the stream is not paused, at once when it is not
+        '''
+        future = self.create_future()
+        if self.paused:
+            self.drain_waiters.append(future)
+        else:
+            future.set_result(None)
+        return future
+
+    def input(self, data):
+        '''
+        Input a lower layer packet
+        '''
+        assert self.kcp
+        ret = self.kcp.input(data)
+        if ret >= 0 and self.lifecycle is not None:
+            self.lifecycle.touch(self)
+        if self.paused:
+            self.check_writable()
+        if self.kcp.adaptive:
+            self.reschedule()
+        elif self.precise and (self.kcp.acklist or self.kcp.probe or self.kcp.nsnd_que):
+            self.wakeup()
+        return ret
 
     def close(self):
         '''
         Close
         '''
-        if self.ioloop and self.timeout_handle:
-            self.ioloop.remove_timeout(self.timeout_handle)
+        self.closed = True
+        if self.scheduler is not None:
+            self.scheduler.unschedule(self)
+        if self.lifecycle is not None:
+            self.lifecycle.remove(self)
+        self.remove_timeout()
+        if self.kcp:
+            self.kcp.release()
+        # nothing will be sent any more, do not leave producers waiting
+        self.wake_drain_waiters()
+
+    def handle_messages(self, messages):
+        '''
+        Handle messages received in one update
+        '''
+        if callable(self.messages_callback):
+            self.messages_callback(self, messages)
+        else:
+            for message in messages:
+                self.handle_message(message)
 
     def handle_message(self, message):
         '''
@@ -22,17 +22,25 @@ import tornado.tcpclient
 from tornado.iostream import StreamClosedError
 from tornado.ioloop import IOLoop
 from tornado import gen
-from pykcp.kcp import KCP, IKCP_OVERHEAD, KCPSeg
-from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD
+from pykcp.kcp import KCP
+from pykcp.batch import OutputBatcher, packets_length, IKCP_READ_SIZE
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD, IKCP_CONV_MAX_SIZE
 
 class TCPClient(tornado.tcpclient.TCPClient):
     '''
     TCP Client
     '''
 
-    def __init__(self, resolver=None):
+    def __init__(self, resolver=None, precise=False, batch=False, stream_mode=False,\
+            lifecycle=None):
         tornado.tcpclient.TCPClient.__init__(self, resolver=resolver)
         self.kcpstream = None
+        self.precise = precise
+        self.stream_mode = stream_mode
+        self.lifecycle = lifecycle
+        self.batch = batch
+        self.batcher = None
 
     @gen.coroutine
     def kcp_connect(self, host, port):
@@ -41,37 +49,60 @@ class TCPClient(tornado.tcpclient.TCPClient):
         '''
         try:
             stream = yield self.connect(host, port)
-            conv = yield stream.read_until(b'\n\n\n')
-            self.kcpstream = KCPStream(KCP(int(conv.strip()), self.output), stream, None,\
-                    ioloop=IOLoop.current(), callback=self.handle_message)
+            conv = yield stream.read_until(b'\n\n\n', max_bytes=IKCP_CONV_MAX_SIZE)
+            stream_class = KCPByteStream if self.stream_mode else KCPStream
+            output = lambda kcp, data: self.output(kcp, data)
+            self.kcpstream = stream_class(KCP(int(conv.strip()), output), stream, None,\
+                    ioloop=IOLoop.current(), callback=self.handle_message,\
+                    batch_callback=self.handle_messages,\
+                    precise=self.precise, lifecycle=self.lifecycle)
+            if self.lifecycle is not None:
+                self.lifecycle.add(self.kcpstream, self.close_stream)
             yield stream.write(IKCP_HANDSHAKE_KEYWORD)
-            yield stream.read_until(IKCP_HANDSHAKE_KEYWORD)
+            yield stream.read_until(IKCP_HANDSHAKE_KEYWORD,\
+                    max_bytes=len(IKCP_HANDSHAKE_KEYWORD))
             self.handle_connect()
             self.kcpstream.update()
-            seg = None
-            head = None
+            buffer = bytearray()
             while True:
                 try:
-                    if seg is None:
-                        head = yield stream.read_bytes(IKCP_OVERHEAD)
-                        seg = KCPSeg.decode(head)
-                    else:
-                        data = yield stream.read_bytes(seg.len)
-                        self.kcpstream.kcp.input(head+data)
-                        head = None
-                        seg = None
+                    data = yield stream.read_bytes(IKCP_READ_SIZE, partial=True)
                 except StreamClosedError:
                     break
+                # feed every complete packet of a read in one input
+                buffer.extend(data)
+                end = packets_length(buffer)
+                if end < 0:
+                    stream.close()
+                    break
+                if end:
+                    with memoryview(buffer) as view:
+                        self.kcpstream.input(view[:end])
+                    del buffer[:end]
         finally:
             if self.kcpstream:
                 self.kcpstream.close()
 
+    def close_stream(self, kcpstream):
+        '''
+        Close the connection of the dead or idle session of the lifecycle,
+        kcp_connect returns
+        '''
+        kcpstream.stream.close()
+
     def handle_connect(self):
         '''
         Handle connect
         '''
         raise NotImplementedError()
 
+    def handle_messages(self, kcpstream, messages):
+        '''
+        Handle every message received in one update
+        '''
+        for message in messages:
+            self.handle_message(kcpstream, message)
+
     def handle_message(self, kcpstream, message):
         '''
         Handle message
@@ -85,4 +116,16 @@ class TCPClient(tornado.tcpclient.TCPClient):
         '''
         assert self.kcpstream
         assert self.kcpstream.stream
-        yield self.kcpstream.stream.write(data)
+        if self.batch:
+            if self.batcher is None:
+                self.batcher = OutputBatcher(self.write_batch, IOLoop.current())
+            self.batcher.append(data)
+        else:
+            yield self.kcpstream.stream.write(data)
+
+    def write_batch(self, batch):
+        '''
+        Write the packets of one IOLoop iteration at once
+        '''
+        if not self.kcpstream.stream.closed():
+            self.kcpstream.stream.write(b''.join(batch))
@@ -17,27 +17,60 @@
 
 '''
 TCP Server
+
+With batch=True the packets every session flushes in one IOLoop iteration
+are joined into one write per connection.
 '''
 
 import tornado.tcpserver
 from tornado.iostream import StreamClosedError
 from tornado.ioloop import IOLoop
 from tornado import gen
-from pykcp.kcp import KCP, IKCP_OVERHEAD, KCPSeg
-from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD
+from pykcp.kcp import KCP
+from pykcp.batch import OutputBatcher, packets_length, IKCP_READ_SIZE
+from pykcp.metrics import ServerMetrics
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD,\
+        IKCP_HIGH_WATERMARK, IKCP_LOW_WATERMARK
 
 class TCPServer(tornado.tcpserver.TCPServer):
     '''
     TCP Server
     '''
 
-    def __init__(self, ssl_options=None, max_buffer_size=None, read_chunk_size=None):
+    def __init__(self, ssl_options=None, max_buffer_size=None, read_chunk_size=None,\
+            scheduler=None, precise=False, batch=False,\
+            high_watermark=IKCP_HIGH_WATERMARK, low_watermark=IKCP_LOW_WATERMARK,\
+            stream_mode=False, lifecycle=None):
         tornado.tcpserver.TCPServer.__init__(self,\
                 ssl_options=ssl_options,\
                 max_buffer_size=max_buffer_size,\
                 read_chunk_size=read_chunk_size)
         self.conv = 0
         self.kcpstream_dct = {}
+        self.scheduler = scheduler
+        self.precise = precise
+        self.batch = batch
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.stream_mode = stream_mode
+        self.lifecycle = lifecycle
+        self.batcher = None
+        self.server_metrics = ServerMetrics()
+
+    def metrics(self):
+        '''
+        Counters and gauges summed over every session, see pykcp.metrics
+        '''
+        return self.server_metrics.collect(kcpstream.kcp\
+                for kcpstream in self.kcpstream_dct.values())
+
+    def handle_messages(self, kcpstream, messages):
+        '''
+        Handle every message received in one update
+        '''
+        for message in messages:
+            self.handle_message(kcpstream, message)
 
     def handle_message(self, kcpstream, message):
         '''
@@ -45,34 +78,76 @@ class TCPServer(tornado.tcpserver.TCPServer):
         '''
         raise NotImplementedError()
 
+    def handle_byte_stream(self, kcpstream):
+        '''
+        Handle a session of a stream_mode server, a KCPByteStream read and
+        written directly, may be a coroutine
+        '''
+        raise NotImplementedError()
+
+    def close_stream(self, kcpstream):
+        '''
+        Close the connection of a session, handle_stream forgets it
+        '''
+        kcpstream.stream.close()
+
+    def on_pause(self, kcpstream):
+        '''
+        waitsnd() of a session reached the high watermark, stop producing
+        for it until on_writable
+        '''
+
+    def on_writable(self, kcpstream):
+        '''
+        waitsnd() of a paused session is down to the low watermark
+        '''
+
     @gen.coroutine
     def handle_stream(self, stream, address):
         self.conv += 1
-        kcpstream = KCPStream(KCP(self.conv, self.output), stream, address,\
-                ioloop=IOLoop.current(), callback=self.handle_message)
+        stream_class = KCPByteStream if self.stream_mode else KCPStream
+        output = lambda kcp, data: self.output(kcp, data)
+        kcpstream = stream_class(KCP(self.conv, output), stream, address,\
+                ioloop=IOLoop.current(), callback=self.handle_message,\
+                batch_callback=self.handle_messages,\
+                scheduler=self.scheduler, precise=self.precise,\
+                high_watermark=self.high_watermark, low_watermark=self.low_watermark,\
+                pause_callback=self.on_pause, writable_callback=self.on_writable,\
+                lifecycle=self.lifecycle)
         self.kcpstream_dct[self.conv] = kcpstream
+        if self.lifecycle is not None:
+            self.lifecycle.add(kcpstream, self.close_stream)
         try:
             yield stream.write(b'%d\n\n\n' % self.conv)
-            handshake = yield stream.read_until(IKCP_HANDSHAKE_KEYWORD)
+            handshake = yield stream.read_until(IKCP_HANDSHAKE_KEYWORD,\
+                    max_bytes=len(IKCP_HANDSHAKE_KEYWORD))
             assert handshake == IKCP_HANDSHAKE_KEYWORD
             yield stream.write(IKCP_HANDSHAKE_KEYWORD)
             kcpstream.update()
-            seg = None
-            head = None
+            if self.stream_mode:
+                future = self.handle_byte_stream(kcpstream)
+                if future is not None:
+                    IOLoop.current().add_future(gen.convert_yielded(future),\
+                            lambda future: future.result())
+            buffer = bytearray()
             while True:
                 try:
-                    if seg is None:
-                        head = yield stream.read_bytes(IKCP_OVERHEAD)
-                        seg = KCPSeg.decode(head)
-                    else:
-                        data = yield stream.read_bytes(seg.len)
-                        kcpstream.kcp.input(head+data)
-                        seg = None
-                        head = None
+                    data = yield stream.read_bytes(IKCP_READ_SIZE, partial=True)
                 except StreamClosedError:
                     break
+                # feed every complete packet of a read in one input
+                buffer.extend(data)
+                end = packets_length(buffer)
+                if end < 0:
+                    break
+                if end:
+                    with memoryview(buffer) as view:
+                        kcpstream.input(view[:end])
+                    del buffer[:end]
         finally:
+            stream.close()
             kcpstream.close()
+            self.server_metrics.retire(kcpstream.kcp)
             if kcpstream.kcp and kcpstream.kcp.conv:
                 del self.kcpstream_dct[kcpstream.kcp.conv]
 
@@ -84,4 +159,24 @@ class TCPServer(tornado.tcpserver.TCPServer):
         '''
         kcpstream = self.kcpstream_dct.get(kcp.conv)
         if kcpstream:
-            yield kcpstream.stream.write(data)
+            if self.batch:
+                if self.batcher is None:
+                    self.batcher = OutputBatcher(self.write_batch, IOLoop.current())
+                self.batcher.append((kcpstream, data))
+            else:
+                yield kcpstream.stream.write(data)
+
+    def write_batch(self, batch):
+        '''
+        Write the packets of one IOLoop iteration, one write per connection
+        '''
+        chunks_dct = {}
+        for kcpstream, data in batch:
+            chunks = chunks_dct.get(kcpstream)
+            if chunks is None:
+                chunks_dct[kcpstream] = [data]
+            else:
+                chunks.append(data)
+        for kcpstream, chunks in chunks_dct.items():
+            if not kcpstream.stream.closed():
+                kcpstream.stream.write(b''.join(chunks))
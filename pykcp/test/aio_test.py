@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import asyncio
+import os
+import struct
+import subprocess
+import sys
+import unittest
+from pykcp.aio import start_udp_server, open_udp_connection,\
+        start_tcp_server, open_tcp_connection
+from pykcp.kcp import KCP
+from pykcp.stream import IKCP_HANDSHAKE_KEYWORD
+
+async def echo(kcpstream):
+    async for message in kcpstream:
+        await kcpstream.send(b'>>>> %s' % message)
+
+class AsyncKCPTest(unittest.IsolatedAsyncioTestCase):
+
+    async def exchange(self, kcpstream):
+        for i in range(3):
+            await kcpstream.send(b'hello %d' % i)
+        replies = []
+        for _ in range(3):
+            replies.append(await asyncio.wait_for(kcpstream.recv(), 5))
+        self.assertEqual(replies, [b'>>>> hello %d' % i for i in range(3)])
+
+    async def test_udp(self):
+        server = await start_udp_server(echo, '127.0.0.1', 0, precise=True)
+        port = server.transport.get_extra_info('sockname')[1]
+        kcpstream = await open_udp_connection('127.0.0.1', port, precise=True)
+        try:
+            await self.exchange(kcpstream)
+            self.assertEqual(list(server.kcpstream_dct), [kcpstream.kcp.conv])
+        finally:
+            kcpstream.close()
+            server.close()
+        self.assertIsNone(await kcpstream.recv())
+
+    async def test_rebind(self):
+        server = await start_udp_server(echo, '127.0.0.1', 0)
+        try:
+            server.datagram_received(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+            conv = list(server.kcpstream_dct)[0]
+            kcpstream = server.kcpstream_dct[conv]
+            garbage = struct.pack('<I', conv) + b'\xff' * 28
+            server.datagram_received(garbage, ('127.0.0.1', 40666))
+            self.assertEqual(kcpstream.address, ('127.0.0.1', 40001))
+            packets = []
+            client = KCP(conv, lambda kcp, data: packets.append(bytes(data)))
+            client.set_nodelay(normal_control=True)
+            client.send(b'hello kcp')
+            client.update(0)
+            for packet in packets:
+                server.datagram_received(packet, ('127.0.0.1', 40002))
+            self.assertEqual(kcpstream.address, ('127.0.0.1', 40002))
+            self.assertEqual(server.address_dct, {('127.0.0.1', 40002): conv})
+        finally:
+            server.close()
+
+    async def test_tcp(self):
+        server = await start_tcp_server(echo, '127.0.0.1', 0, precise=True)
+        port = server.sockets[0].getsockname()[1]
+        kcpstream = await open_tcp_connection('127.0.0.1', port, precise=True)
+        try:
+            await self.exchange(kcpstream)
+        finally:
+            kcpstream.close()
+            server.close()
+            await server.wait_closed()
+
+    async def test_tcp_bogus_length(self):
+        server = await start_tcp_server(echo, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            conv = int(await reader.readuntil(b'\n\n\n'))
+            writer.write(IKCP_HANDSHAKE_KEYWORD)
+            await reader.readexactly(len(IKCP_HANDSHAKE_KEYWORD))
+            writer.write(struct.pack('<IBBHIIII', conv, 81, 0, 32, 0, 0, 0, 0xFFFFFFFF))
+            self.assertEqual(await asyncio.wait_for(reader.read(), 5), b'')
+        finally:
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+class ImportTest(unittest.TestCase):
+
+    def test_without_tornado(self):
+        code = 'import sys, pykcp.aio; print([name for name in sys.modules'\
+                ' if name.startswith("tornado")])'
+        output = subprocess.check_output([sys.executable, '-c', code],\
+                cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        self.assertEqual(output.strip(), b'[]')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import socket
+import struct
+import unittest
+from unittest import mock
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+from tornado.testing import AsyncTestCase, gen_test, bind_unused_port
+import tornado.tcpclient
+from pykcp import batch
+from pykcp.batch import OutputBatcher, DatagramReceiver, send_datagrams, packets_length
+from pykcp.stream import IKCP_HANDSHAKE_KEYWORD
+from pykcp.tcpserver import TCPServer
+from pykcp.tcpclient import TCPClient
+
+class TestServer(TCPServer):
+
+    def handle_message(self, kcpstream, msg):
+        kcpstream.send(b'>>>> %s' % msg)
+
+class TestClient(TCPClient):
+
+    def handle_connect(self):
+        for i in range(3):
+            self.kcpstream.send(b'hello %d' % i)
+
+    def handle_message(self, kcpstream, msg):
+        self.replies.append(msg)
+        if len(self.replies) == 3:
+            self.done.set_result(self.replies)
+
+class DatagramBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(('127.0.0.1', 0))
+        self.receiver.setblocking(False)
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender.bind(('127.0.0.1', 0))
+        self.sender.setblocking(False)
+        self.addCleanup(self.receiver.close)
+        self.addCleanup(self.sender.close)
+
+    def roundtrip(self):
+        address = self.receiver.getsockname()
+        datagrams = [(b'datagram %d' % i, address) for i in range(100)]
+        send_datagrams(self.sender, datagrams, {})
+        received = []
+        DatagramReceiver(self.receiver, count=8, size=2048).recv(\
+                lambda data, address: received.append((bytes(data), address)))
+        self.assertEqual([data for data, _ in received], [data for data, _ in datagrams])
+        self.assertEqual(set(address for _, address in received),\
+                set([self.sender.getsockname()]))
+
+    @unittest.skipUnless(batch.HAS_MMSG, 'no sendmmsg / recvmmsg')
+    def test_mmsg(self):
+        self.roundtrip()
+
+    def test_fallback(self):
+        with mock.patch.object(batch, 'HAS_MMSG', False):
+            self.roundtrip()
+
+def segment(conv, data):
+    return struct.pack('<IBBHIIII', conv, 81, 0, 32, 0, 0, 0, len(data)) + data
+
+class PacketsLengthTest(unittest.TestCase):
+
+    def test_complete(self):
+        buffer = bytearray(segment(1, b'hello') + segment(1, b'world'))
+        self.assertEqual(packets_length(buffer), len(buffer))
+        self.assertEqual(packets_length(buffer[:-1]), len(segment(1, b'hello')))
+        self.assertEqual(packets_length(buffer[:10]), 0)
+
+    def test_bogus_length(self):
+        head = bytearray(segment(1, b''))
+        struct.pack_into('<I', head, 20, 0xFFFFFFFF)
+        self.assertEqual(packets_length(head), -1)
+        self.assertEqual(packets_length(segment(1, b'hello') + head), -1)
+        self.assertEqual(packets_length(segment(1, b'hello'), max_length=4), -1)
+
+class OutputBatcherTest(AsyncTestCase):
+
+    @gen_test
+    def test_one_batch_per_iteration(self):
+        batches = []
+        batcher = OutputBatcher(batches.append, self.io_loop)
+        for i in range(3):
+            batcher.append(i)
+        self.assertEqual(batches, [])
+        yield gen.moment
+        batcher.append(3)
+        yield gen.moment
+        self.assertEqual(batches, [[0, 1, 2], [3]])
+
+    @gen_test
+    def test_tcp_echo(self):
+        sock, port = bind_unused_port()
+        server = TestServer(batch=True)
+        server.add_sockets([sock])
+        client = TestClient(batch=True)
+        client.replies = []
+        client.done = Future()
+        client.kcp_connect('127.0.0.1', port)
+        try:
+            replies = yield client.done
+        finally:
+            client.kcpstream.stream.close()
+            server.stop()
+        self.assertEqual(replies, [b'>>>> hello %d' % i for i in range(3)])
+
+    @gen_test
+    def test_tcp_bogus_length(self):
+        sock, port = bind_unused_port()
+        server = TestServer()
+        server.add_sockets([sock])
+        stream = yield tornado.tcpclient.TCPClient().connect('127.0.0.1', port)
+        try:
+            conv = yield stream.read_until(b'\n\n\n')
+            yield stream.write(IKCP_HANDSHAKE_KEYWORD)
+            yield stream.read_until(IKCP_HANDSHAKE_KEYWORD)
+            head = bytearray(segment(int(conv), b''))
+            struct.pack_into('<I', head, 20, 0xFFFFFFFF)
+            yield stream.write(bytes(head))
+            with self.assertRaises(StreamClosedError):
+                yield stream.read_bytes(1)
+            self.assertEqual(server.kcpstream_dct, {})
+        finally:
+            stream.close()
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import json
+import unittest
+from pykcp.benchmark import run_benchmarks, bench_link, compare
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_run(self):
+        report = run_benchmarks(scale=0.02)
+        json.dumps(report)
+        for name in ('core.send', 'core.flush', 'core.input', 'core.recv',\
+                'link.clean', 'link.loss', 'e2e.udp', 'e2e.tcp'):
+            self.assertGreater(report['results'][name]['packets_per_sec'], 0)
+        self.assertEqual(report['results']['link.loss']['count'], 100)
+
+    def test_link_is_deterministic(self):
+        result1 = bench_link('loss', 200)
+        result2 = bench_link('loss', 200)
+        for key in ('count', 'virtual_seconds', 'wire_packets', 'retransmits'):
+            self.assertEqual(result1[key], result2[key])
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'packets_per_sec': 100}, 'b': {'packets_per_sec': 100}}}
+        report = {'results': {'a': {'packets_per_sec': 85}, 'b': {'packets_per_sec': 70},\
+                'c': {'packets_per_sec': 1}}}
+        self.assertEqual(compare(baseline, report, 0.2), ['b'])
+
+if __name__ == '__main__':
+    unittest.main()
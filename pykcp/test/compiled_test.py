@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import importlib.util
+import os
+import random
+import unittest
+from pykcp import kcp as compiled
+
+def load_source():
+    '''
+    Load pykcp/kcp.py itself, even when the compiled module is imported
+    '''
+    path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'kcp.py')
+    spec = importlib.util.spec_from_file_location('pykcp.kcp_source', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_pair(module, seed, nodelay=False, resend=0, nocwnd=False, mtu=1400):
+    '''
+    Exchange random messages between two KCP objects of module over a lossy,
+    reordering link, return every packet, message and metric
+    '''
+    rnd = random.Random(seed)
+    clock = [0]
+    link = []
+    wire = []
+
+    def output(kcp, data):
+        wire.append((kcp.conv, kcp.current, bytes(data)))
+        if rnd.random() < 0.1:
+            return
+        link.append((clock[0] + rnd.randint(5, 80), len(wire), peers[id(kcp)], bytes(data)))
+
+    kcp1 = module.KCP(7, output)
+    kcp2 = module.KCP(7, output)
+    peers = {id(kcp1): kcp2, id(kcp2): kcp1}
+    received = []
+    for kcp in (kcp1, kcp2):
+        kcp.set_mut(mtu)
+        kcp.set_wndsize(64, 64)
+        kcp.set_nodelay(nodelay, 10, resend, nocwnd)
+    for step in range(600):
+        clock[0] += 10
+        if step < 300:
+            for kcp in (kcp1, kcp2):
+                if rnd.random() < 0.4:
+                    kcp.send(bytes([step % 256]) * rnd.randint(1, mtu * 3))
+        due = sorted(packet for packet in link if packet[0] <= clock[0])
+        link = [packet for packet in link if packet[0] > clock[0]]
+        for _, _, peer, data in due:
+            peer.input(data)
+        for kcp in (kcp1, kcp2):
+            kcp.update(clock[0])
+            data = kcp.recv()
+            while data is not None:
+                received.append(data)
+                data = kcp.recv()
+            received.append(kcp.check(clock[0]))
+    return wire, received, [kcp.metrics() for kcp in (kcp1, kcp2)]
+
+@unittest.skipUnless(compiled.COMPILED, 'pykcp.kcp is not compiled')
+class CompiledTest(unittest.TestCase):
+
+    def assert_same(self, **kwargs):
+        source = load_source()
+        self.assertFalse(source.COMPILED)
+        for seed in range(3):
+            self.assertEqual(run_pair(compiled, seed, **kwargs),\
+                    run_pair(source, seed, **kwargs))
+
+    def test_same_wire(self):
+        self.assert_same()
+
+    def test_same_wire_nodelay(self):
+        self.assert_same(nodelay=True, resend=2, nocwnd=True)
+
+    def test_same_wire_small_mtu(self):
+        self.assert_same(nodelay=True, resend=1, mtu=200)
+
+    def test_segment(self):
+        source = load_source()
+        for module in (compiled, source):
+            seg = module.KCPSeg(1)
+            seg.cmd = module.IKCP_CMD_PUSH
+            seg.sn = 9
+            seg.len = 3
+            encoded = seg.encode()
+            self.assertEqual(module.KCPSeg.decode(encoded).sn, 9)
+        self.assertEqual(compiled.KCPSeg.decode(encoded).encode(), encoded)
+        self.assertEqual(compiled.itimediff(1, 0xffffffff), source.itimediff(1, 0xffffffff))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import unittest
+from pykcp.congestion import CongestionController, RenoController, BBRController
+from pykcp.kcp import KCP
+from pykcp.simulator import Simulator, Path
+
+class FixedController(CongestionController):
+
+    def on_flush(self, kcp, cwnd, change, lost):
+        kcp.cwnd = 3
+
+def transfer(congestion, path, count=2000):
+    sim = Simulator(5)
+    kcps = None
+    if congestion is not None:
+        kcps = (KCP(1, sim.output, congestion=congestion()),\
+                KCP(1, sim.output, congestion=congestion()))
+    sender, receiver = sim.connect(path, kcps=kcps, nodelay=(True, 10, 2, False),\
+            wndsize=(1024, 1024))
+    flow = sim.transfer(sender, receiver, count, 1000)
+    return sim.run_until_delivered([flow], 600000), flow.report()
+
+class CongestionTest(unittest.TestCase):
+
+    def test_reno_default(self):
+        kcp = KCP(1, lambda kcp, data: None)
+        self.assertIsInstance(kcp.congestion, RenoController)
+        kcp.ssthresh = 4
+        kcp.cwnd = 1
+        reno = kcp.congestion
+        for _ in range(3):
+            reno.on_ack(kcp, 1, 1, 10, 0)
+        self.assertEqual(kcp.cwnd, 4)
+        reno.on_ack(kcp, 1, 1, 10, 0)
+        self.assertEqual(kcp.cwnd, 4)
+        reno.on_ack(kcp, 0, 1, 10, 0)
+        reno.on_flush(kcp, 4, False, True)
+        self.assertEqual((kcp.cwnd, kcp.ssthresh), (1, 2))
+
+    def test_custom_controller(self):
+        packets = []
+        kcp = KCP(1, lambda kcp, data: packets.append(data), congestion=FixedController())
+        for i in range(10):
+            kcp.send(b'%d' % i)
+        kcp.update(0)
+        self.assertEqual(kcp.cwnd, 3)
+        kcp.update(100)
+        self.assertEqual(kcp.nsnd_buf, 3)
+
+    def test_bbr_lossy_high_bdp(self):
+        path = Path(loss=0.01, delay=100, bandwidth=2000000, queue_size=100000)
+        delivered, reno = transfer(None, path)
+        self.assertTrue(delivered)
+        delivered, bbr = transfer(BBRController, path.copy())
+        self.assertTrue(delivered)
+        self.assertGreater(bbr['goodput'], reno['goodput'] * 3)
+        self.assertLess(bbr['retransmission_overhead'], 1.0)
+
+    def test_pacing(self):
+        sent = []
+        controller = BBRController()
+        kcp = KCP(1, lambda kcp, data: sent.append(kcp.current), congestion=controller)
+        kcp.set_wndsize(256, 256)
+        kcp.set_nodelay(True, 100, 0, False)
+        # as if the path had been measured at 1 segment per millisec
+        controller.btl_bw = 1.0
+        controller.min_rtt = 100
+        controller.pacing_gain = 1.0
+        kcp.cwnd = 200
+        for _ in range(100):
+            kcp.send(b'x' * (kcp.mss - 10))
+        current = 0
+        while kcp.nsnd_que and current < 1000:
+            kcp.update(current)
+            current = max(kcp.check(current), current + 1)
+        self.assertEqual(kcp.nsnd_que, 0)
+        # spread over about 100 millisecs instead of one burst
+        self.assertGreater(len(set(sent)), 30)
+        self.assertGreater(max(sent) - min(sent), 80)
+
+    def test_bbr_clock_wraparound(self):
+        controller = BBRController()
+        kcp = KCP(1, lambda kcp, data: None, congestion=controller)
+        start = 0xffffffff - 50
+        controller.on_ack(kcp, 1, 1, 20, start)
+        controller.refill(kcp, start)
+        tokens = controller.tokens
+        controller.sent(kcp, int(tokens))
+        wrapped = (start + 30) & 0xffffffff
+        controller.on_ack(kcp, 1, 10, 20, wrapped)
+        self.assertEqual(controller.rounds, 1)
+        self.assertEqual(controller.round_start, wrapped)
+        controller.refill(kcp, wrapped)
+        self.assertGreater(controller.tokens, tokens - int(tokens))
+        # the min RTT sample expires across the wraparound too
+        controller.on_ack(kcp, 1, 1, 50, (start + 10100) & 0xffffffff)
+        self.assertEqual(controller.min_rtt, 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,35 +16,289 @@
 
 
 from __future__ import absolute_import
+import io
+import random
 import unittest
-import time
-from pykcp.kcp import KCP
+from pykcp.kcp import KCP, KCPSeg, KCPSegPool, IKCP_OVERHEAD, IKCP_CMD_PUSH
 
 class KCPTest(unittest.TestCase):
 
-    def test_kcp(self):
+    def setUp(self):
+        self.current = 0
         self.kcp1 = KCP(123, self.output_1)
         self.kcp2 = KCP(123, self.output_2)
-        i = 0
-        while True:
-            self.assertEquals(self.kcp1.send('hello 1-%d' % i), 0)
-            self.assertEquals(self.kcp2.send('hello 2-%d' % i), 0)
-            time.sleep(1)
-            self.kcp1.update(int(time.time()*1000))
-            self.kcp2.update(int(time.time()*1000))
-            print('kcp1 recv: '+str(self.kcp1.recv()))
-            print('kcp2 recv: '+str(self.kcp2.recv()))
-            i += 1
-            if i > 5:
+
+    def update(self, step=100):
+        self.current += step
+        self.kcp1.update(self.current)
+        self.kcp2.update(self.current)
+
+    def test_kcp(self):
+        for i in range(6):
+            self.assertEqual(self.kcp1.send(b'hello 1-%d' % i), 0)
+            self.assertEqual(self.kcp2.send(b'hello 2-%d' % i), 0)
+        received_1 = []
+        received_2 = []
+        for _ in range(20):
+            self.update()
+            for kcp, received in ((self.kcp1, received_1), (self.kcp2, received_2)):
+                data = kcp.recv()
+                while data is not None:
+                    received.append(data)
+                    data = kcp.recv()
+        self.assertEqual(received_1, [b'hello 2-%d' % i for i in range(6)])
+        self.assertEqual(received_2, [b'hello 1-%d' % i for i in range(6)])
+
+    def test_lossy_link(self):
+        self.run_lossy_link()
+
+    def test_timestamp_wraparound(self):
+        self.current = 0xffffffff - 3000
+        self.run_lossy_link()
+
+    def test_resend_across_wraparound(self):
+        packets = []
+        self.kcp1.output_func = lambda kcp, data: packets.append(bytes(data))
+        self.kcp1.set_nodelay(normal_control=True)
+        self.kcp1.send(b'lost')
+        current = 0xffffffff - 50
+        self.kcp1.update(current)
+        self.assertEqual(len(packets), 1)
+        for _ in range(10):
+            current += 100
+            self.kcp1.update(current)
+        self.assertGreater(len(packets), 1)
+
+    def run_lossy_link(self):
+        rnd = random.Random(1)
+        link = []
+
+        def output(kcp, data):
+            if rnd.random() < 0.2:
+                return
+            peer = self.kcp2 if kcp is self.kcp1 else self.kcp1
+            link.append((self.current + rnd.randint(10, 80), peer, bytes(data)))
+
+        for kcp in (self.kcp1, self.kcp2):
+            kcp.output_func = output
+            kcp.set_wndsize(1024, 1024)
+            kcp.set_nodelay(True, 10, 2, True)
+        messages = [b'message %d' % i for i in range(2000)]
+        for message in messages:
+            self.kcp1.send(message)
+        received = []
+        deadline = self.current + 60000
+        while len(received) < len(messages) and self.current < deadline:
+            self.update(10)
+            rnd.shuffle(link)
+            due = [packet for packet in link if packet[0] <= self.current]
+            link = [packet for packet in link if packet[0] > self.current]
+            for _, peer, data in due:
+                peer.input(data)
+            data = self.kcp2.recv()
+            while data is not None:
+                received.append(data)
+                data = self.kcp2.recv()
+        self.assertEqual(received, messages)
+
+    def test_input_bytes_like(self):
+        packets = []
+        self.kcp1.output_func = lambda kcp, data: packets.append(bytes(data))
+        self.kcp1.set_nodelay(normal_control=True)
+        for i in range(3):
+            self.kcp1.send(b'message %d' % i)
+        self.kcp1.update(0)
+        self.assertEqual(len(packets), 1)
+        packet = packets[0]
+        self.assertEqual(self.kcp2.input(memoryview(bytearray(packet))), 0)
+        self.assertEqual(self.kcp2.recv(), b'message 0')
+        self.assertEqual(self.kcp2.recv(), b'message 1')
+        self.assertEqual(self.kcp2.recv(), b'message 2')
+        self.assertEqual(self.kcp2.input(packet[:IKCP_OVERHEAD + 1]), -2)
+
+    def test_recv_into(self):
+        packet = b''
+        for sn, frg, data in ((0, 2, b'aaaa'), (1, 1, b'bbb'), (2, 0, b'cc'), (3, 0, b'd')):
+            seg = KCPSeg(123)
+            seg.cmd = IKCP_CMD_PUSH
+            seg.sn = sn
+            seg.frg = frg
+            seg.wnd = 128
+            seg.len = len(data)
+            packet += seg.encode() + data
+        self.assertEqual(self.kcp2.input(packet), 0)
+        self.assertEqual(self.kcp2.peeksize(), 9)
+        buffer = bytearray(16)
+        self.assertEqual(self.kcp2.recv_into(memoryview(buffer)[:8]), -3)
+        self.assertEqual(self.kcp2.recv_into(buffer), 9)
+        self.assertEqual(bytes(buffer[:9]), b'aaaabbbcc')
+        self.assertEqual(self.kcp2.recv(), b'd')
+        self.assertEqual(self.kcp2.recv_into(buffer), -1)
+
+    def test_segment_pool(self):
+        pool = KCPSegPool(capacity=64)
+        self.kcp1 = KCP(123, self.output_1, pool)
+        self.kcp2 = KCP(123, self.output_2, pool)
+        for kcp in (self.kcp1, self.kcp2):
+            kcp.set_nodelay(normal_control=True)
+        for _ in range(10):
+            for i in range(8):
+                self.kcp1.send(b'message %d' % i)
+            self.update()
+            self.update()
+            for i in range(8):
+                self.assertEqual(self.kcp2.recv(), b'message %d' % i)
+        # every segment came back acked or received and got reused
+        self.assertEqual(self.kcp1.waitsnd(), 0)
+        self.assertEqual(len(pool), pool.created)
+        self.assertLessEqual(pool.created, 16)
+        self.assertTrue(all(seg.data is None for seg in pool.free))
+
+    def transfer(self, wnd=256):
+        for kcp in (self.kcp1, self.kcp2):
+            kcp.set_wndsize(wnd, wnd)
+            kcp.set_nodelay(True, 10, 2, True)
+        received = []
+        for _ in range(1000):
+            self.update(10)
+            data = self.kcp2.recv()
+            while data is not None:
+                received.append(data)
+                data = self.kcp2.recv()
+            if not self.kcp1.waitsnd() and not self.kcp1.sources:
                 break
+        return received
+
+    def test_fragments(self):
+        data = bytes(random.Random(1).getrandbits(8) for _ in range(10000))
+        self.assertEqual(self.kcp1.send(data), 0)
+        # fragments are views of data, not copies
+        self.assertIs(self.kcp1.snd_queue[1].data.obj, data)
+        self.assertEqual(self.kcp1.send(bytearray(b'x' * 2000)), 0)
+        self.assertEqual(self.kcp1.send(b''), 0)
+        self.assertEqual(self.kcp1.send(b'y' * self.kcp1.mss * 200), -2)
+        self.assertEqual(self.transfer(), [data, b'x' * 2000, b''])
+
+    def test_send_mutable(self):
+        data = bytearray(b'a' * 3000)
+        self.assertEqual(self.kcp1.send(data), 0)
+        small = bytearray(b'hello')
+        self.assertEqual(self.kcp1.send(small), 0)
+        # copied, the caller may change and resize them at once
+        data[:10] = b'b' * 10
+        data.extend(b'c' * 100)
+        del small[:]
+        readonly = memoryview(b'd' * 3000).toreadonly()
+        self.assertEqual(self.kcp1.send(readonly), 0)
+        self.assertIs(self.kcp1.snd_queue[-1].data.obj, readonly.obj)
+        self.assertEqual(self.transfer(), [b'a' * 3000, b'hello', b'd' * 3000])
+
+    def test_stream_mode(self):
+        self.kcp1.stream = True
+        self.kcp2.stream = True
+        data = bytes(range(256)) * 1500
+        self.kcp1.send(b'abc')
+        self.assertEqual(self.kcp1.send(data), 0)
+        self.assertEqual(self.kcp1.nsnd_que, (len(data) + 3 + self.kcp1.mss - 1) // self.kcp1.mss)
+        self.assertEqual(b''.join(self.transfer()), b'abc' + data)
+
+    def test_stream_coalesce(self):
+        self.kcp1.stream = True
+        self.kcp2.stream = True
+        writes = [b'%d;' % i for i in range(2000)]
+        for data in writes:
+            self.kcp1.send(data)
+        total = len(b''.join(writes))
+        self.assertEqual(self.kcp1.nsnd_que, (total + self.kcp1.mss - 1) // self.kcp1.mss)
+        self.assertEqual(self.kcp1.snd_queue[0].len, self.kcp1.mss)
+        self.assertIsInstance(self.kcp1.snd_queue[0].data, bytearray)
+        self.assertEqual(b''.join(self.transfer()), b''.join(writes))
+
+    def test_send_stream(self):
+        done = []
+        chunks = (bytes([i]) * 5000 for i in range(200))
+        self.kcp1.send_stream(chunks, lambda: done.append('chunks'))
+        self.kcp1.send(b'after')
+        large = bytes(range(256)) * 60
+        self.kcp1.send(large)
+        self.kcp1.send(b'')
+        self.kcp1.send_stream(io.BytesIO(b'z' * 300000), lambda: done.append('file'))
+        self.assertLessEqual(self.kcp1.nsnd_que, self.kcp1.snd_wnd)
+        received = self.transfer(wnd=32)
+        self.assertEqual(done, ['chunks', 'file'])
+        self.assertEqual(b''.join(received), b''.join(bytes([i]) * 5000 for i in range(200))\
+                + b'after' + large + b'z' * 300000)
+        # messages sent behind a stream keep their boundaries
+        index = received.index(b'after')
+        self.assertEqual(received[index+1:index+3], [large, b''])
+
+    def test_adaptive_idle(self):
+        flushes = []
+        for kcp in (self.kcp1, self.kcp2):
+            kcp.set_nodelay(True, 10, 2, True)
+            kcp.set_adaptive(idle_interval=2000)
+            kcp.output_func = (lambda output: lambda kcp, data:\
+                    (flushes.append(self.current), output(kcp, data)))(kcp.output_func)
+        self.kcp1.send(b'hello')
+        updates = 0
+        while self.current < 20000:
+            self.kcp1.update(self.current)
+            self.kcp2.update(self.current)
+            updates += 1
+            self.current = min(self.kcp1.check(self.current), self.kcp2.check(self.current))
+        self.assertEqual(self.kcp2.recv(), b'hello')
+        self.assertEqual(self.kcp1.flush_interval, 2000)
+        # a fixed interval would have been 2000 updates
+        self.assertLess(updates, 40)
+        self.assertLess(max(flushes), 100)
+        # back to the interval at the first send
+        self.kcp1.send(b'again')
+        self.assertLessEqual(self.kcp1.check(self.current) - self.current, 10)
+
+    def test_adaptive_ack_delay(self):
+        packets = []
+        self.kcp2.output_func = lambda kcp, data: packets.append(bytes(data))
+        self.kcp2.set_interval(100)
+        self.kcp2.set_adaptive(ack_delay=30, ack_threshold=4)
+        self.kcp1.set_nodelay(True, 10, 0, True)
+        self.kcp1.update(0)
+        self.kcp2.update(0)
+        self.kcp1.send(b'one')
+        self.kcp1.update(10)
+        self.assertEqual(len(self.kcp2.acklist), 1)
+        self.assertEqual(self.kcp2.check(10), 30)
+        self.kcp2.update(20)
+        self.assertEqual(packets, [])
+        self.kcp2.update(30)
+        self.assertEqual(len(packets), 1)
+        for i in range(4):
+            self.kcp1.send(b'%d' % i)
+        self.kcp1.update(40)
+        self.assertEqual(len(self.kcp2.acklist), 4)
+        self.assertEqual(self.kcp2.check(40), 40)
+
+    def test_adaptive_send_threshold(self):
+        self.kcp1.set_nodelay(True, 50, 0, True)
+        self.kcp1.set_adaptive(send_threshold=4)
+        self.kcp1.update(0)
+        for i in range(3):
+            self.kcp1.send(b'%d' % i)
+        self.assertEqual(self.kcp1.check(0), 50)
+        self.kcp1.send(b'3')
+        self.assertEqual(self.kcp1.check(0), 0)
+        self.kcp1.set_wndsize(2, 128)
+        self.kcp1.update(0)
+        self.assertEqual(self.kcp1.nsnd_buf, 2)
+        for i in range(4):
+            self.kcp1.send(b'%d' % i)
+        # the window is full, flushing again would not send anything
+        self.assertGreater(self.kcp1.check(0), 0)
 
     def output_1(self, kcp, data):
-        print('kcp1 output: '+data)
-        print(self.kcp2.input(data))
+        self.kcp2.input(data)
 
     def output_2(self, kcp, data):
-        print('kcp2 output: '+data)
-        print(self.kcp1.input(data))
+        self.kcp1.input(data)
 
 if __name__ == '__main__':
     unittest.main()
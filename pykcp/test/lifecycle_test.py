@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import unittest
+from tornado.testing import AsyncTestCase
+from pykcp.kcp import KCP, KCPSegPool
+from pykcp.lifecycle import SessionManager
+from pykcp.scheduler import KCPScheduler
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD
+from pykcp.udpserver import UDPServer
+from pykcp.vectorized import HAS_NUMPY
+
+if HAS_NUMPY:
+    from pykcp.vectorized import KCPFlushEngine, VectorKCP
+
+class TestScheduler(object):
+
+    def schedule(self, kcpstream, deadline):
+        pass
+
+    def unschedule(self, kcpstream):
+        pass
+
+class TestServer(UDPServer):
+
+    def handle_message(self, kcpstream, msg):
+        pass
+
+class SessionManagerTest(AsyncTestCase):
+
+    def create_stream(self, lifecycle, output=None, kcp=None):
+        if kcp is None:
+            kcp = KCP(1, output or (lambda kcp, data: None), pool=KCPSegPool())
+        kcpstream = KCPStream(kcp, None, None, None, scheduler=TestScheduler(),\
+                lifecycle=lifecycle)
+        lifecycle.add(kcpstream, self.closed.append)
+        return kcpstream
+
+    def setUp(self):
+        super(SessionManagerTest, self).setUp()
+        self.closed = []
+        self.lifecycle = SessionManager(idle_timeout=1000)
+        self.lifecycle.current = 0
+
+    def tearDown(self):
+        self.lifecycle.stop()
+        super(SessionManagerTest, self).tearDown()
+
+    def test_idle(self):
+        streams = [self.create_stream(self.lifecycle) for _ in range(3)]
+        self.lifecycle.sweep(500)
+        # garbage does not keep a session alive
+        streams[1].input(b'x' * 30)
+        peer = KCP(1, lambda kcp, data: streams[0].input(data))
+        peer.set_nodelay(normal_control=True)
+        peer.send(b'ping')
+        peer.update(0)
+        self.assertEqual(list(self.lifecycle.sessions), streams[1:] + streams[:1])
+        self.assertEqual(self.lifecycle.sweep(999), 0)
+        self.assertEqual(self.lifecycle.sweep(1000), 2)
+        self.assertEqual(self.closed, streams[1:])
+        self.assertEqual(self.lifecycle.sweep(1499), 0)
+        self.assertEqual(self.lifecycle.sweep(1500), 1)
+        self.assertEqual(self.lifecycle.metrics(),\
+                {'sessions': 0, 'idle_closed': 3, 'dead_closed': 0})
+
+    def test_dead_link(self):
+        kcpstream = self.create_stream(self.lifecycle)
+        kcp = kcpstream.kcp
+        kcp.dead_link = 3
+        kcp.set_nodelay(True, 10, 0, True)
+        kcp.send(b'lost')
+        current = 0
+        while kcp.state != -1:
+            current += 100
+            kcpstream.update(current)
+        self.assertIn(kcpstream, self.lifecycle.dead_dct)
+        self.assertEqual(self.lifecycle.sweep(100), 1)
+        self.assertEqual(self.closed, [kcpstream])
+        self.assertEqual(self.lifecycle.metrics()['dead_closed'], 1)
+
+    def test_close_releases(self):
+        kcpstream = self.create_stream(self.lifecycle)
+        kcp = kcpstream.kcp
+        for i in range(40):
+            kcp.send(b'%d' % i)
+        kcp.update(0)
+        kcp.update(100)
+        self.assertGreater(kcp.nsnd_buf, 0)
+        kcpstream.close()
+        self.assertEqual(len(self.lifecycle), 0)
+        self.assertEqual(kcp.waitsnd(), 0)
+        self.assertEqual(len(kcp.pool), 40)
+
+    def close_in_callback(self, scheduler):
+        packets = []
+        sender = KCP(1, lambda kcp, data: packets.append(bytes(data)))
+        sender.set_nodelay(normal_control=True)
+        kcp = KCP(1, lambda kcp, data: None)
+        messages = []
+        def callback(kcpstream, message):
+            messages.append(message)
+            kcpstream.close()
+        kcpstream = KCPStream(kcp, None, None, self.io_loop, callback=callback,\
+                scheduler=scheduler, lifecycle=self.lifecycle)
+        self.lifecycle.add(kcpstream, self.closed.append)
+        kcpstream.update()
+        sender.send(b'quit')
+        sender.update(0)
+        for packet in packets:
+            kcpstream.input(packet)
+        kcpstream.update()
+        self.assertEqual(messages, [b'quit'])
+        self.assertTrue(kcpstream.closed)
+        self.assertIsNone(kcpstream.timeout_handle)
+        self.assertEqual(len(self.lifecycle), 0)
+        kcpstream.wakeup()
+        kcpstream.reschedule()
+        kcpstream.update()
+        self.assertIsNone(kcpstream.timeout_handle)
+        return kcpstream
+
+    def test_close_in_callback(self):
+        self.close_in_callback(None)
+
+    def test_close_in_callback_scheduler(self):
+        scheduler = KCPScheduler()
+        try:
+            kcpstream = self.close_in_callback(scheduler)
+            self.assertNotIn(kcpstream, scheduler.tick_dct)
+            self.assertEqual(len(scheduler), 0)
+        finally:
+            scheduler.stop()
+
+    @unittest.skipUnless(HAS_NUMPY, 'numpy is not installed')
+    def test_close_releases_vector(self):
+        engine = KCPFlushEngine(sessions=2)
+        packets = []
+        other = VectorKCP(2, lambda kcp, data: packets.append(kcp.conv), engine)
+        kcp = VectorKCP(1, lambda kcp, data: packets.append(kcp.conv), engine,\
+                pool=KCPSegPool())
+        kcpstream = self.create_stream(self.lifecycle, kcp=kcp)
+        for vkcp in (kcp, other):
+            for i in range(40):
+                vkcp.send(b'%d' % i)
+            vkcp.update(0)
+            vkcp.update(100)
+        self.assertGreater(kcp.nsnd_buf, 0)
+        row = kcp.row
+        kcpstream.close()
+        self.assertEqual(kcp.waitsnd(), 0)
+        self.assertEqual(len(kcp.pool), 40)
+        self.assertIsNone(kcp.row)
+        self.assertFalse(engine.active[row].any())
+        active = engine.active[other.row].copy()
+        # the closed session neither sends nor touches the other rows
+        del packets[:]
+        kcp.update(10000)
+        kcp.flush(10000)
+        self.assertEqual(kcp.input(bytes(24)), -1)
+        self.assertEqual(packets, [])
+        self.assertTrue((engine.active[other.row] == active).all())
+        engine.update(10000)
+        self.assertEqual(set(packets), set([2]))
+
+    def test_server(self):
+        server = TestServer(lifecycle=self.lifecycle)
+        server.listen(0, '127.0.0.1')
+        try:
+            for port in (40001, 40002):
+                server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', port))
+            self.assertEqual(len(self.lifecycle), 2)
+            self.lifecycle.sweep(self.lifecycle.current + 1000)
+            self.assertEqual(server.kcpstream_dct, {})
+            self.assertEqual(server.address_dct, {})
+            self.assertEqual(server.metrics()['sessions_closed'], 2)
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import unittest
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+from pykcp.kcp import KCP
+from pykcp.metrics import ServerMetrics, MetricsHandler, MetricsReporter, prometheus_text
+from pykcp.simulator import Simulator, Path
+
+class MetricsSource(object):
+
+    def __init__(self, kcps):
+        self.kcps = kcps
+        self.server_metrics = ServerMetrics()
+
+    def metrics(self):
+        return self.server_metrics.collect(self.kcps)
+
+class KCPMetricsTest(unittest.TestCase):
+
+    def test_counters(self):
+        sim = Simulator(seed=2)
+        sender, receiver = sim.connect(Path(loss=0.1, delay=20, jitter=5),\
+                nodelay=(True, 10, 2, True), wndsize=(128, 128))
+        flow = sim.transfer(sender, receiver, 500, 200)
+        self.assertTrue(sim.run_until_delivered([flow], 60000))
+        metrics = sender.metrics()
+        path = sim.routes[id(sender)][1]
+        self.assertEqual(metrics['pkts_out'], path.packets)
+        self.assertEqual(metrics['bytes_out'], path.bytes)
+        self.assertEqual(receiver.metrics()['pkts_in'], path.packets - path.dropped)
+        self.assertGreater(metrics['timeout_xmit'] + metrics['fast_xmit'], 0)
+        self.assertGreater(metrics['srtt'], 0)
+        self.assertEqual(metrics['dead_events'], 0)
+
+    def test_dead_link(self):
+        sim = Simulator()
+        sender, _ = sim.connect(Path(loss=1.0), nodelay=(True, 10, 0, True))
+        sender.send(b'lost')
+        sim.run(60000)
+        self.assertEqual(sender.metrics()['state'], -1)
+        self.assertEqual(sender.metrics()['dead_events'], 1)
+
+    def test_server_metrics(self):
+        kcps = [KCP(conv, lambda kcp, data: None) for conv in range(3)]
+        kcps[0].pkts_in = 5
+        kcps[1].pkts_in = 7
+        kcps[2].state = -1
+        source = MetricsSource(kcps)
+        metrics = source.metrics()
+        self.assertEqual(metrics['pkts_in'], 12)
+        self.assertEqual(metrics['sessions'], 3)
+        self.assertEqual(metrics['sessions_dead'], 1)
+        source.server_metrics.retire(kcps.pop(1))
+        metrics = source.metrics()
+        self.assertEqual(metrics['pkts_in'], 12)
+        self.assertEqual(metrics['sessions'], 2)
+        self.assertEqual(metrics['sessions_closed'], 1)
+        snapshots = []
+        MetricsReporter(source, snapshots.append).report()
+        self.assertEqual(snapshots[0]['pkts_in'], 12)
+        self.assertIn('time', snapshots[0])
+
+    def test_prometheus_text(self):
+        text = prometheus_text({'pkts_in': 3, 'sessions': 2})
+        self.assertEqual(text, '# TYPE pykcp_pkts_in_total counter\n'\
+                'pykcp_pkts_in_total 3\n'\
+                '# TYPE pykcp_sessions gauge\n'\
+                'pykcp_sessions 2\n')
+
+class MetricsHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        source = MetricsSource([KCP(1, lambda kcp, data: None)])
+        return tornado.web.Application([('/metrics', MetricsHandler, {'source': source})])
+
+    def test_get(self):
+        response = self.fetch('/metrics')
+        self.assertEqual(response.code, 200)
+        self.assertIn(b'pykcp_sessions 1\n', response.body)
+
+if __name__ == '__main__':
+    unittest.main()
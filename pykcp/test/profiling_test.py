@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import json
+import unittest
+import tornado.web
+from tornado.testing import AsyncTestCase, AsyncHTTPTestCase
+from pykcp.kcp import KCP
+from pykcp.profiling import Histogram, Profiler, ProfilingHandler,\
+        bucket_index, bucket_value
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD
+from pykcp.udpserver import UDPServer
+
+class TestServer(UDPServer):
+
+    def handle_message(self, kcpstream, msg):
+        pass
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_buckets(self):
+        previous = -1
+        for value in list(range(200)) + [1000, 12345, 10 ** 6, 10 ** 9]:
+            index = bucket_index(value)
+            self.assertGreaterEqual(index, previous)
+            self.assertLessEqual(bucket_value(index), value)
+            self.assertGreater(bucket_value(index + 1), value)
+            self.assertLessEqual(bucket_value(index + 1) - bucket_value(index), value / 16.0 + 1)
+            previous = index
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.record(value * 1000)
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.maximum, 10 ** 6)
+        self.assertAlmostEqual(histogram.percentile(50), 500000, delta=500000 / 16)
+        self.assertAlmostEqual(histogram.percentile(99), 990000, delta=990000 / 16)
+        self.assertEqual(histogram.percentile(100), 10 ** 6)
+        summary = histogram.summary()
+        self.assertAlmostEqual(summary['mean_us'], 500.5)
+        self.assertEqual(summary['max_us'], 1000.0)
+
+    def test_sample_rate(self):
+        for sample_rate in (0, -0.5, 1.5, float('nan')):
+            with self.assertRaises(ValueError):
+                Profiler(sample_rate=sample_rate)
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            profiler.enable(0)
+        self.assertFalse(profiler.enabled)
+        self.assertEqual(profiler.sample_rate, 0.01)
+
+class ProfilingStreamTest(AsyncTestCase):
+
+    def test_enable_disable(self):
+        input_func, update_func = KCPStream.input, KCPStream.update_kcp
+        profiler = Profiler(sample_rate=0.5)
+        profiler.enable()
+        try:
+            self.assertTrue(profiler.enabled)
+            self.assertEqual(profiler.snapshot()['skipped'], [])
+            self.assertIsNot(KCPStream.input, input_func)
+            received = []
+            stream1 = KCPStream(KCP(1, lambda kcp, data: stream2.input(data)), None, None,\
+                    self.io_loop)
+            stream2 = KCPStream(KCP(1, lambda kcp, data: stream1.input(data)), None, None,\
+                    self.io_loop, callback=lambda kcpstream, msg: received.append(msg))
+            for kcpstream in (stream1, stream2):
+                kcpstream.kcp.set_nodelay(True, 10, 2, True)
+            for i in range(10):
+                stream1.send(b'%d' % i)
+                stream1.update(i * 10)
+                stream2.update(i * 10)
+            stream1.close()
+            stream2.close()
+            self.assertEqual(received, [b'%d' % i for i in range(10)])
+        finally:
+            profiler.disable()
+        self.assertFalse(profiler.enabled)
+        self.assertIs(KCPStream.input, input_func)
+        self.assertIs(KCPStream.update_kcp, update_func)
+        histograms = profiler.snapshot()['histograms']
+        self.assertEqual(histograms['flush']['count'], 10)
+        self.assertEqual(histograms['recv']['count'], 10)
+        self.assertGreater(histograms['input']['count'], 0)
+        self.assertIn('profile_flush_p99_us', profiler.metrics())
+
+    def test_skipped(self):
+        # like the classes of the compiled kcp module
+        profiler = Profiler(targets=(('join', bytes, 'join'), ('input', KCPStream, 'input')))
+        with self.assertLogs('pykcp.profiling', 'WARNING'):
+            profiler.enable()
+        try:
+            self.assertEqual(profiler.snapshot()['skipped'], ['bytes.join'])
+            self.assertEqual(list(profiler.histograms), ['input'])
+        finally:
+            profiler.disable()
+
+    def test_live_sessions(self):
+        server = TestServer()
+        server.listen(0, '127.0.0.1')
+        profiler = Profiler(sample_rate=1.0)
+        try:
+            server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+            before = list(server.kcpstream_dct.values())[0]
+            profiler.enable()
+            server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40002))
+            during = server.kcpstream_dct[server.address_dct[('127.0.0.1', 40002)]]
+            histogram = profiler.histograms['udp_output']
+            for i, kcpstream in enumerate((before, during)):
+                kcpstream.kcp.probe = 1
+                kcpstream.kcp.flush()
+                # the session started before enable is timed too
+                self.assertEqual(histogram.count, i + 1)
+            profiler.disable()
+            during.kcp.probe = 1
+            during.kcp.flush()
+            self.assertEqual(histogram.count, 2)
+        finally:
+            profiler.disable()
+            server.stop()
+
+class ProfilingHandlerTest(AsyncHTTPTestCase):
+
+    def get_app(self):
+        self.profiler = Profiler() # pylint: disable=attribute-defined-outside-init
+        return tornado.web.Application([('/profile', ProfilingHandler,\
+                {'profiler': self.profiler})])
+
+    def tearDown(self):
+        self.profiler.disable()
+        super(ProfilingHandlerTest, self).tearDown()
+
+    def test_bad_sample_rate(self):
+        for sample_rate in ('0', '2', 'abc'):
+            response = self.fetch('/profile', method='POST',\
+                    body='enable=1&sample_rate=%s' % sample_rate)
+            self.assertEqual(response.code, 400)
+        self.assertFalse(self.profiler.enabled)
+        response = self.fetch('/profile', method='POST', body='enable=1&sample_rate=0.5')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['sample_rate'], 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
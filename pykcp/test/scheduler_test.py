@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import unittest
+from unittest import mock
+from tornado.testing import AsyncTestCase
+from pykcp import scheduler
+from pykcp.kcp import KCP
+from pykcp.scheduler import KCPScheduler
+from pykcp.stream import KCPStream, current_millis
+
+class Clock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestStream(object):
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, current=None):
+        self.updates.append(current)
+
+class KCPSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock(100000)
+        patcher = mock.patch.object(scheduler, 'current_millis', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = KCPScheduler(tick=10, slots=64)
+        self.scheduler.start = lambda: None
+
+    def test_deadline(self):
+        stream1 = TestStream()
+        stream2 = TestStream()
+        self.scheduler.schedule(stream1, 100025)
+        self.scheduler.schedule(stream2, 100100)
+        self.clock.now = 100020
+        self.scheduler.run()
+        self.assertEqual(stream1.updates, [])
+        self.clock.now = 100031
+        self.scheduler.run()
+        self.assertEqual(stream1.updates, [100031])
+        self.assertEqual(stream2.updates, [])
+        self.assertEqual(len(self.scheduler), 1)
+
+    def test_reschedule_and_unschedule(self):
+        stream = TestStream()
+        self.scheduler.schedule(stream, 100020)
+        self.scheduler.schedule(stream, 100500)
+        self.clock.now = 100100
+        self.scheduler.run()
+        self.assertEqual(stream.updates, [])
+        self.scheduler.unschedule(stream)
+        self.clock.now = 101000
+        self.scheduler.run()
+        self.assertEqual(stream.updates, [])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_past_deadline_runs_next_tick(self):
+        stream = TestStream()
+        self.scheduler.schedule(stream, 0)
+        self.clock.now = 100010
+        self.scheduler.run()
+        self.assertEqual(stream.updates, [100010])
+
+    def test_beyond_one_turn(self):
+        stream = TestStream()
+        self.scheduler.schedule(stream, 100000 + 64 * 10 + 50)
+        self.clock.now = 100060
+        self.scheduler.run()
+        self.assertEqual(stream.updates, [])
+        self.clock.now = 100000 + 64 * 10 + 50
+        self.scheduler.run()
+        self.assertEqual(stream.updates, [self.clock.now])
+
+    def test_clock_jump(self):
+        streams = [TestStream() for _ in range(100)]
+        for i, stream in enumerate(streams):
+            self.scheduler.schedule(stream, 100000 + i * 37)
+        self.clock.now = 200000
+        self.scheduler.run()
+        for stream in streams:
+            self.assertEqual(stream.updates, [200000])
+
+class SchedulerStreamTest(AsyncTestCase):
+
+    def test_single_stream(self):
+        kcp_scheduler = KCPScheduler()
+        self.addCleanup(kcp_scheduler.stop)
+        kcpstream = KCPStream(KCP(1, lambda kcp, data: None), None, None, self.io_loop,\
+                scheduler=kcp_scheduler, precise=True)
+        # an empty wheel still drives the stream, no IOLoop timeout
+        kcpstream.update()
+        self.assertEqual(len(kcp_scheduler), 1)
+        self.assertIsNone(kcpstream.timeout_handle)
+        with mock.patch.object(scheduler, 'current_millis',\
+                lambda: current_millis() + 1000):
+            kcp_scheduler.run()
+        self.assertEqual(len(kcp_scheduler), 1)
+        self.assertIsNone(kcpstream.timeout_handle)
+        kcpstream.send(b'hello')
+        self.assertEqual(kcp_scheduler.tick_dct[kcpstream], kcp_scheduler.current_tick + 1)
+        self.assertIsNone(kcpstream.timeout_handle)
+        kcpstream.close()
+        self.assertEqual(len(kcp_scheduler), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import random
+import unittest
+from pykcp.kcp import KCP
+from pykcp.simulator import Simulator, Path, GilbertElliottLoss, percentile
+
+class SimulatorTest(unittest.TestCase):
+
+    def transfer(self, path, seed=1, count=300, wnd=128):
+        sim = Simulator(seed)
+        sender, receiver = sim.connect(path, nodelay=(True, 10, 2, True),\
+                wndsize=(wnd, wnd))
+        flow = sim.transfer(sender, receiver, count, 500)
+        self.assertTrue(sim.run_until_delivered([flow], 120000))
+        return sim, flow.report()
+
+    def test_clean_path(self):
+        sim, report = self.transfer(Path(delay=50))
+        self.assertEqual(report['delivered'], 300)
+        self.assertEqual(report['retransmission_overhead'], 0.0)
+        self.assertGreaterEqual(min(sim.flows[0].latencies), 50)
+
+    def test_lossy_path(self):
+        path = Path(loss=GilbertElliottLoss(0.05, 0.3), delay=20, jitter=10,\
+                reorder=0.05, duplicate=0.02)
+        _, report = self.transfer(path)
+        self.assertEqual(report['delivered'], 300)
+        self.assertGreater(report['retransmission_overhead'], 0)
+        self.assertGreaterEqual(report['latency_p99'], report['latency_p50'])
+
+    def test_deterministic(self):
+        path = dict(loss=0.1, delay=30, jitter=20, bandwidth=200000)
+        self.assertEqual(self.transfer(Path(**path), seed=3)[1],\
+                self.transfer(Path(**path), seed=3)[1])
+
+    def test_bandwidth(self):
+        path = Path(bandwidth=100000, queue_size=1 << 20)
+        sim, report = self.transfer(path, wnd=16)
+        flow = sim.flows[0]
+        # the link is busy all along and never faster than its bandwidth
+        wire_rate = path.bytes * 1000.0 / (flow.last - flow.first)
+        self.assertLessEqual(wire_rate, 100000)
+        self.assertGreater(wire_rate, 90000)
+        self.assertLess(report['goodput'], wire_rate)
+
+    def test_existing_kcps(self):
+        sim = Simulator()
+        kcps = (KCP(7, lambda kcp, data: None), KCP(7, lambda kcp, data: None))
+        self.assertEqual(sim.connect(Path(delay=10), kcps=kcps), kcps)
+        flow = sim.transfer(kcps[1], kcps[0], 10, 100, interval=5)
+        self.assertTrue(sim.run_until_delivered([flow], 10000))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        random.Random(1).shuffle(values)
+        self.assertEqual(percentile(sorted(values), 99), 99)
+        self.assertEqual(percentile([5], 99), 5)
+        self.assertIsNone(percentile([], 50))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import unittest
+from tornado.ioloop import IOLoop
+from pykcp.kcp import KCP, KCPSeg, IKCP_OVERHEAD, IKCP_CMD_WINS
+from tornado.iostream import StreamClosedError, UnsatisfiableReadError
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream
+
+class TestScheduler(object):
+
+    def schedule(self, kcpstream, deadline):
+        pass
+
+    def unschedule(self, kcpstream):
+        pass
+
+class KCPStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.packets = []
+        self.batches = []
+        self.sender = KCP(1, lambda kcp, data: self.receiver.input(data))
+        self.sender.set_wndsize(256, 256)
+        self.sender.set_nodelay(normal_control=True)
+        self.receiver = KCP(1, lambda kcp, data: self.packets.append(data))
+        self.kcpstream = KCPStream(self.receiver, None, None, None,\
+                scheduler=TestScheduler(),\
+                batch_callback=lambda kcpstream, messages: self.batches.append(messages))
+        self.ioloop = IOLoop(make_current=False)
+
+    def tearDown(self):
+        self.ioloop.close()
+
+    def commands(self):
+        cmds = []
+        for packet in self.packets:
+            offset = 0
+            while offset < len(packet):
+                seg = KCPSeg.decode(packet, offset)
+                cmds.append(seg.cmd)
+                offset += IKCP_OVERHEAD + seg.len
+        return cmds
+
+    def test_drain_all_messages(self):
+        messages = [b'message %d' % i for i in range(100)]
+        for message in messages:
+            self.sender.send(message)
+        self.sender.update(0)
+        self.kcpstream.update(0)
+        self.assertEqual(self.batches, [messages])
+        self.assertEqual(self.receiver.nrcv_que, 0)
+
+    def test_window_update_after_drain(self):
+        for i in range(200):
+            self.sender.send(b'message %d' % i)
+        self.sender.update(0)
+        self.assertEqual(self.receiver.nrcv_que, self.receiver.rcv_wnd)
+        self.kcpstream.update(0)
+        self.assertEqual(len(self.batches[0]), self.receiver.rcv_wnd)
+        self.assertIn(IKCP_CMD_WINS, self.commands())
+
+    def test_backpressure(self):
+        events = []
+        link = []
+        sender = KCP(1, lambda kcp, data: link.append(data))
+        sender.set_wndsize(32, 32)
+        kcpstream = KCPStream(sender, None, None, self.ioloop, scheduler=TestScheduler(),\
+                high_watermark=64, low_watermark=16,\
+                pause_callback=lambda kcpstream: events.append('pause'),\
+                writable_callback=lambda kcpstream: events.append('writable'))
+        self.assertTrue(kcpstream.drain().done())
+        for i in range(63):
+            kcpstream.send(b'message %d' % i)
+        self.assertFalse(kcpstream.paused)
+        kcpstream.send(b'message 63')
+        self.assertTrue(kcpstream.paused)
+        self.assertEqual(events, ['pause'])
+        waiter = kcpstream.drain()
+        self.assertFalse(waiter.done())
+        receiver = KCP(1, lambda kcp, data: kcpstream.input(data))
+        receiver.set_wndsize(256, 256)
+        current = 0
+        while not waiter.done() and current < 10000:
+            kcpstream.update(current)
+            for data in link:
+                receiver.input(data)
+            del link[:]
+            receiver.update(current)
+            while receiver.recv() is not None:
+                pass
+            current += 10
+        self.assertTrue(waiter.done())
+        self.assertFalse(kcpstream.paused)
+        self.assertLessEqual(sender.waitsnd(), 16)
+        self.assertEqual(events, ['pause', 'writable'])
+
+    def test_close_wakes_drain(self):
+        kcpstream = KCPStream(KCP(1, lambda kcp, data: None), None, None, self.ioloop,\
+                scheduler=TestScheduler(), high_watermark=2, low_watermark=1)
+        for i in range(3):
+            kcpstream.send(b'message %d' % i)
+        waiter = kcpstream.drain()
+        self.assertFalse(waiter.done())
+        kcpstream.close()
+        self.assertTrue(waiter.done())
+
+    def test_adaptive_reschedule(self):
+        deadlines = []
+        scheduler = TestScheduler()
+        scheduler.schedule = lambda kcpstream, deadline: deadlines.append(deadline)
+        kcp = KCP(1, lambda kcp, data: None)
+        kcp.set_nodelay(True, 10, 0, True)
+        kcp.set_adaptive(idle_interval=1000)
+        kcpstream = KCPStream(kcp, None, None, None, scheduler=scheduler, precise=True)
+        current = 0
+        for _ in range(10):
+            kcpstream.update(current)
+            current = deadlines[-1]
+        self.assertEqual(deadlines[-1] - deadlines[-2], 1000)
+        kcp.send(b'hello')
+        self.assertEqual(kcp.flush_interval, 10)
+        # due since the last update, wake up at once
+        kcpstream.reschedule(current + 100)
+        self.assertEqual(deadlines[-1], 0)
+        kcpstream.update(current + 100)
+        self.assertEqual(kcp.nsnd_buf, 1)
+        self.assertEqual(deadlines[-1], current + 110)
+
+class KCPByteStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ioloop = IOLoop(make_current=False)
+        self.sender = KCP(1, lambda kcp, data: self.kcpstream.input(data))
+        self.sender.stream = True
+        self.sender.set_wndsize(64, 64)
+        self.sender.set_nodelay(True, 10, 0, True)
+        receiver = KCP(1, lambda kcp, data: None)
+        receiver.set_wndsize(64, 64)
+        self.kcpstream = KCPByteStream(receiver, None, None, self.ioloop,\
+                scheduler=TestScheduler(), max_buffer_size=4096)
+        self.current = 0
+
+    def tearDown(self):
+        self.ioloop.close()
+
+    def deliver(self, data=b''):
+        if data:
+            self.sender.send(data)
+        self.current += 10
+        self.sender.update(self.current)
+        self.kcpstream.update(self.current)
+
+    def test_reads(self):
+        self.assertTrue(self.kcpstream.kcp.stream)
+        line = self.kcpstream.readuntil(b'\r\n')
+        self.deliver(b'GET / HTTP/1.1')
+        self.assertFalse(line.done())
+        self.deliver(b'\r\nbody: 12345')
+        self.assertEqual(line.result(), b'GET / HTTP/1.1\r\n')
+        exact = self.kcpstream.readexactly(14)
+        self.assertFalse(exact.done())
+        self.deliver(b'67890')
+        self.assertEqual(exact.result(), b'body: 12345678')
+        self.assertEqual(self.kcpstream.read(100).result(), b'90')
+        self.assertFalse(self.kcpstream.read(100).done())
+
+    def test_buffer_limit(self):
+        data = bytes(range(256)) * 64
+        self.sender.send(data)
+        for _ in range(10):
+            self.deliver()
+        self.assertLess(len(self.kcpstream.read_buffer), 4096 + self.sender.mss)
+        self.assertGreater(self.kcpstream.kcp.nrcv_que, 0)
+        received = []
+        while len(b''.join(received)) < len(data):
+            received.append(self.kcpstream.readexactly(1024).result())
+            self.deliver()
+        self.assertEqual(b''.join(received), data)
+        overrun = self.kcpstream.readuntil(b'never')
+        for _ in range(10):
+            self.deliver(b'x' * 500)
+        with self.assertRaises(UnsatisfiableReadError):
+            overrun.result()
+
+    def test_close(self):
+        pending = self.kcpstream.read(10)
+        self.kcpstream.close()
+        with self.assertRaises(StreamClosedError):
+            pending.result()
+        with self.assertRaises(StreamClosedError):
+            self.kcpstream.read(10).result()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import os
+import struct
+import unittest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import StreamClosedError
+from tornado.testing import AsyncTestCase, gen_test
+from pykcp.kcp import KCP
+from pykcp.stream import IKCP_HANDSHAKE_KEYWORD
+from pykcp.udpserver import UDPServer, IKCP_WORKER_SHIFT
+from pykcp.udpclient import UDPClient
+
+class TestServer(UDPServer):
+
+    def handle_message(self, kcpstream, msg):
+        self.messages.append((kcpstream.kcp.conv, msg))
+        kcpstream.send(b'>>>> %s' % msg)
+
+class TestClient(UDPClient):
+
+    def handle_connect(self):
+        self.kcpstream.send(b'hello kcp')
+
+    def handle_message(self, kcpstream, msg):
+        self.reply.set_result(msg)
+
+class LineServer(UDPServer):
+
+    @gen.coroutine
+    def handle_byte_stream(self, kcpstream):
+        try:
+            while True:
+                line = yield kcpstream.readuntil(b'\n')
+                yield kcpstream.write(b'>>>> ' + line)
+        except StreamClosedError:
+            pass
+
+class StreamClient(UDPClient):
+
+    def handle_connect(self):
+        pass
+
+class UDPServerTest(AsyncTestCase):
+
+    def setUp(self):
+        super(UDPServerTest, self).setUp()
+        self.server = TestServer()
+        self.server.messages = []
+        self.server.listen(0, '127.0.0.1')
+
+    def tearDown(self):
+        self.server.stop()
+        super(UDPServerTest, self).tearDown()
+
+    @gen.coroutine
+    def echo(self, precise):
+        client = TestClient(precise=precise)
+        client.reply = Future()
+        port = self.server.socket.getsockname()[1]
+        try:
+            kcpstream = yield client.kcp_connect('127.0.0.1', port)
+            reply = yield client.reply
+        finally:
+            client.close()
+        self.assertEqual(reply, b'>>>> hello kcp')
+        self.assertEqual(self.server.messages, [(kcpstream.kcp.conv, b'hello kcp')])
+        metrics = self.server.metrics()
+        self.assertEqual(metrics['sessions'], 1)
+        self.assertGreater(metrics['pkts_in'], 0)
+        self.assertGreater(metrics['bytes_out'], 0)
+
+    @gen_test
+    def test_echo(self):
+        yield self.echo(False)
+
+    @gen_test
+    def test_echo_precise(self):
+        self.server.precise = True
+        yield self.echo(True)
+
+    @gen_test
+    def test_echo_batch(self):
+        self.server.stop()
+        self.server = TestServer(precise=True, batch=True)
+        self.server.messages = []
+        self.server.listen(0, '127.0.0.1')
+        yield self.echo(True)
+
+    @gen_test
+    def test_stream_mode(self):
+        self.server.stop()
+        self.server = LineServer(precise=True, stream_mode=True)
+        self.server.listen(0, '127.0.0.1')
+        client = StreamClient(precise=True, stream_mode=True)
+        port = self.server.socket.getsockname()[1]
+        try:
+            kcpstream = yield client.kcp_connect('127.0.0.1', port)
+            for i in range(50):
+                kcpstream.write(b'line ')
+                kcpstream.write(b'%d\n' % i)
+            replies = []
+            for i in range(50):
+                reply = yield kcpstream.readuntil(b'\n')
+                replies.append(reply)
+        finally:
+            client.close()
+            # let the handler see its stream closed
+            self.server.stop()
+            yield gen.moment
+        self.assertEqual(replies, [b'>>>> line %d\n' % i for i in range(50)])
+
+    def test_handshake(self):
+        self.server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+        self.server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40002))
+        self.server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+        self.assertEqual(sorted(self.server.kcpstream_dct.keys()), [1, 2])
+        self.assertEqual(self.server.address_dct[('127.0.0.1', 40001)], 1)
+
+    def test_route_by_conv(self):
+        for port in (40001, 40002):
+            self.server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', port))
+        packets = []
+        client = KCP(2, lambda kcp, data: packets.append(bytes(data)))
+        client.send(b'hello kcp')
+        client.update(0)
+        client.update(100)
+        for packet in packets:
+            self.server.handle_datagram(packet, ('127.0.0.1', 40002))
+        self.assertEqual(self.server.kcpstream_dct[1].kcp.rcv_nxt, 0)
+        self.assertEqual(self.server.kcpstream_dct[2].kcp.rcv_nxt, 1)
+        self.assertEqual(self.server.kcpstream_dct[2].kcp.recv(), b'hello kcp')
+
+    def test_rebind(self):
+        self.server.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+        kcpstream = self.server.kcpstream_dct[1]
+        # a spoofed packet with a live conv does not move the session
+        garbage = struct.pack('<I', 1) + b'\xff' * 28
+        self.server.handle_datagram(garbage, ('127.0.0.1', 40666))
+        self.assertEqual(kcpstream.address, ('127.0.0.1', 40001))
+        self.assertEqual(self.server.address_dct, {('127.0.0.1', 40001): 1})
+        packets = []
+        client = KCP(1, lambda kcp, data: packets.append(bytes(data)))
+        client.set_nodelay(normal_control=True)
+        client.send(b'hello kcp')
+        client.update(0)
+        for packet in packets:
+            self.server.handle_datagram(packet, ('127.0.0.1', 40002))
+        self.assertEqual(kcpstream.address, ('127.0.0.1', 40002))
+        self.assertEqual(self.server.address_dct, {('127.0.0.1', 40002): 1})
+
+    def test_unknown_conv(self):
+        packets = []
+        client = KCP(7, lambda kcp, data: packets.append(bytes(data)))
+        client.send(b'hello kcp')
+        client.update(0)
+        client.update(100)
+        for packet in packets:
+            self.server.handle_datagram(packet, ('127.0.0.1', 40001))
+        self.assertEqual(self.server.kcpstream_dct, {})
+
+class ShardingTest(AsyncTestCase):
+
+    def setUp(self):
+        super(ShardingTest, self).setUp()
+        self.servers = []
+        for worker_id in range(2):
+            server = TestServer()
+            server.messages = []
+            server.bind(0, '127.0.0.1', forward_prefix='\0pykcp-test-%d' % os.getpid())
+            server.start_worker(worker_id, 2)
+            self.servers.append(server)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        super(ShardingTest, self).tearDown()
+
+    def test_conv_partition(self):
+        for worker_id, server in enumerate(self.servers):
+            for _ in range(3):
+                self.assertEqual(server.create_conv() >> IKCP_WORKER_SHIFT, worker_id)
+
+    @gen_test
+    def test_forward_to_owner(self):
+        server0, server1 = self.servers
+        server0.handle_datagram(IKCP_HANDSHAKE_KEYWORD, ('127.0.0.1', 40001))
+        conv = list(server0.kcpstream_dct)[0]
+        packets = []
+        client = KCP(conv, lambda kcp, data: packets.append(bytes(data)))
+        client.send(b'hello kcp')
+        client.update(0)
+        client.update(100)
+        for packet in packets:
+            server1.handle_datagram(packet, ('127.0.0.1', 40002))
+        kcpstream = server0.kcpstream_dct[conv]
+        for _ in range(100):
+            if kcpstream.kcp.rcv_nxt:
+                break
+            yield gen.sleep(0.01)
+        self.assertEqual(kcpstream.kcp.rcv_nxt, 1)
+        self.assertEqual(kcpstream.address, ('127.0.0.1', 40002))
+        self.assertEqual(server1.kcpstream_dct, {})
+
+if __name__ == '__main__':
+    unittest.main()
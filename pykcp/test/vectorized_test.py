@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from __future__ import absolute_import
+import random
+import unittest
+from pykcp.congestion import BBRController
+from pykcp.kcp import KCP
+from pykcp.vectorized import HAS_NUMPY
+
+if HAS_NUMPY:
+    from pykcp.vectorized import KCPFlushEngine, VectorKCP
+
+def run_sessions(create, update, seed, pairs=4, nodelay=False, resend=0, wnd=32):
+    '''
+    Drive pairs of sessions over a lossy, reordering link, return every
+    packet sent per conv and the messages received per conv
+    '''
+    rnd = random.Random(seed)
+    wire = {}
+    link = []
+    clock = [0]
+    peers = {}
+    links = {}
+
+    def output(kcp, data):
+        # every sender has its own loss and delay, so the order sessions
+        # flush in does not matter
+        packets = wire.setdefault(id(kcp), [])
+        packets.append((kcp.current, bytes(data)))
+        index, loss = links[id(kcp)]
+        if loss.random() < 0.15:
+            return
+        link.append((clock[0] + loss.randint(5, 60), index, len(packets),\
+                peers[id(kcp)], bytes(data)))
+
+    kcps = []
+    for conv in range(pairs):
+        kcp1 = create(conv, output)
+        kcp2 = create(conv, output)
+        peers[id(kcp1)] = kcp2
+        peers[id(kcp2)] = kcp1
+        for kcp in (kcp1, kcp2):
+            links[id(kcp)] = (len(kcps), random.Random(seed * 1000 + len(kcps)))
+            kcp.set_wndsize(wnd, wnd)
+            kcp.set_nodelay(nodelay, 20, resend, False)
+            kcps.append(kcp)
+    received = [[] for _ in kcps]
+    for step in range(500):
+        clock[0] += 10
+        if step < 250:
+            for kcp in kcps:
+                if rnd.random() < 0.3:
+                    kcp.send(b'%d' % step * rnd.randint(1, 200))
+        due = sorted(packet for packet in link if packet[0] <= clock[0])
+        link = [packet for packet in link if packet[0] > clock[0]]
+        rnd.shuffle(due)
+        for _, _, _, peer, data in due:
+            peer.input(data)
+        update(kcps, clock[0])
+        for i, kcp in enumerate(kcps):
+            data = kcp.recv()
+            while data is not None:
+                received[i].append(data)
+                data = kcp.recv()
+    return [wire.get(id(kcp)) for kcp in kcps], received, [kcp.metrics() for kcp in kcps]
+
+def update_each(kcps, current):
+    for kcp in kcps:
+        kcp.update(current)
+
+@unittest.skipUnless(HAS_NUMPY, 'numpy is not installed')
+class KCPFlushEngineTest(unittest.TestCase):
+
+    def assert_same_wire(self, congestion=None, **kwargs):
+        def create(cls, *args):
+            def create_kcp(conv, output):
+                kcp = cls(conv, output, *args)
+                if congestion is not None:
+                    kcp.congestion = congestion()
+                return kcp
+            return create_kcp
+        for seed in range(3):
+            expected = run_sessions(create(KCP), update_each, seed, **kwargs)
+            engine = KCPFlushEngine(window=kwargs.get('wnd', 32))
+            result = run_sessions(create(VectorKCP, engine),\
+                    lambda kcps, current: engine.update(current), seed, **kwargs)
+            self.assertEqual(result, expected)
+
+    def test_same_wire_output(self):
+        self.assert_same_wire()
+
+    def test_same_wire_output_nodelay(self):
+        self.assert_same_wire(nodelay=True, resend=2, wnd=128)
+
+    def test_same_wire_output_paced(self):
+        self.assert_same_wire(congestion=BBRController, nodelay=True, resend=2, wnd=128)
+
+    def test_session_update(self):
+        engine = KCPFlushEngine()
+        result = run_sessions(lambda conv, output: VectorKCP(conv, output, engine),\
+                update_each, 7, pairs=2)
+        self.assertEqual(result, run_sessions(KCP, update_each, 7, pairs=2))
+
+    def test_rows(self):
+        engine = KCPFlushEngine(sessions=2)
+        kcps = [VectorKCP(conv, lambda kcp, data: None, engine) for conv in range(5)]
+        self.assertEqual([kcp.row for kcp in kcps], list(range(5)))
+        self.assertEqual(len(engine.active), 8)
+        kcps[1].release()
+        self.assertEqual(VectorKCP(9, lambda kcp, data: None, engine).row, 1)
+        with self.assertRaises(ValueError):
+            kcps[0].set_wndsize(1024, 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+UDP Client
+'''
+
+import socket
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from pykcp.kcp import KCP, IKCP_OVERHEAD
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD
+from pykcp.batch import recv_datagrams, send_datagram
+
+IKCP_HANDSHAKE_INTERVAL = 1.0
+
+class UDPClient(object):
+    '''
+    UDP Client
+    '''
+
+    def __init__(self, precise=False, stream_mode=False, lifecycle=None):
+        self.kcpstream = None
+        self.precise = precise
+        self.stream_mode = stream_mode
+        self.lifecycle = lifecycle
+        self.socket = None
+        self.ioloop = None
+        self.connect_future = None
+        self.handshake_handle = None
+
+    def kcp_connect(self, host, port):
+        '''
+        Connect, the returned future resolves to the KCP stream
+        '''
+        assert self.socket is None
+        family, socktype, proto, _, sockaddr = socket.getaddrinfo(host, port,\
+                socket.AF_UNSPEC, socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        sock.connect(sockaddr)
+        self.socket = sock
+        self.ioloop = IOLoop.current()
+        self.ioloop.add_handler(sock.fileno(), self.handle_events, IOLoop.READ)
+        self.connect_future = Future()
+        self.send_handshake()
+        return self.connect_future
+
+    def send_handshake(self):
+        '''
+        Send handshake until the server tells us our conv
+        '''
+        self.handshake_handle = None
+        if self.kcpstream or not self.socket:
+            return
+        send_datagram(self.socket, IKCP_HANDSHAKE_KEYWORD)
+        self.handshake_handle = self.ioloop.call_later(IKCP_HANDSHAKE_INTERVAL,\
+                self.send_handshake)
+
+    def handle_events(self, fd, events):
+        '''
+        Handle socket events
+        '''
+        recv_datagrams(self.socket, self.handle_datagram)
+
+    def handle_datagram(self, data, address):
+        '''
+        Handle datagram
+        '''
+        if len(data) >= IKCP_OVERHEAD:
+            if self.kcpstream:
+                self.kcpstream.input(data)
+            return
+        if self.kcpstream or not data.endswith(b'\n\n\n'):
+            return
+        if self.handshake_handle:
+            self.ioloop.remove_timeout(self.handshake_handle)
+            self.handshake_handle = None
+        stream_class = KCPByteStream if self.stream_mode else KCPStream
+        self.kcpstream = stream_class(KCP(int(data.strip()), self.output), None, address,\
+                ioloop=self.ioloop, callback=self.handle_message,\
+                batch_callback=self.handle_messages, precise=self.precise,\
+                lifecycle=self.lifecycle)
+        if self.lifecycle is not None:
+            self.lifecycle.add(self.kcpstream, self.close_stream)
+        self.handle_connect()
+        self.kcpstream.update()
+        self.connect_future.set_result(self.kcpstream)
+
+    def close_stream(self, kcpstream):
+        '''
+        Close the dead or idle session of the lifecycle
+        '''
+        self.close()
+
+    def close(self):
+        '''
+        Close
+        '''
+        if self.handshake_handle:
+            self.ioloop.remove_timeout(self.handshake_handle)
+            self.handshake_handle = None
+        if self.kcpstream:
+            self.kcpstream.close()
+        if self.socket:
+            self.ioloop.remove_handler(self.socket.fileno())
+            self.socket.close()
+            self.socket = None
+
+    def handle_connect(self):
+        '''
+        Handle connect
+        '''
+        raise NotImplementedError()
+
+    def handle_messages(self, kcpstream, messages):
+        '''
+        Handle every message received in one update
+        '''
+        for message in messages:
+            self.handle_message(kcpstream, message)
+
+    def handle_message(self, kcpstream, message):
+        '''
+        Handle message
+        '''
+        raise NotImplementedError()
+
+    def output(self, kcp, data):
+        '''
+        Output
+        '''
+        if self.socket:
+            send_datagram(self.socket, data)
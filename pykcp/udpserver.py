@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+UDP Server
+
+All sessions share one non-blocking datagram socket. A client asks for a
+conversation id by sending IKCP_HANDSHAKE_KEYWORD, every datagram after that
+is routed to its KCP object by the conv field of the KCP packet head.
+
+With start(num_processes) the server forks workers which share the port with
+SO_REUSEPORT. The high IKCP_WORKER_BITS bits of a conv are the id of the
+worker owning it, a datagram the kernel hands to another worker is forwarded
+to the owner over a unix datagram socket.
+
+With batch=True the datagrams of every session flushed in one IOLoop
+iteration are sent together and reads go through recvmmsg, see pykcp.batch.
+
+A lifecycle (see pykcp.lifecycle) closes the dead and idle sessions.
+
+With stream_mode=True every session is a KCPByteStream handed to
+handle_byte_stream instead of messages to handle_message.
+'''
+
+import os
+import socket
+import struct
+import sys
+import tempfile
+import tornado.process
+from tornado.ioloop import IOLoop
+from tornado import gen
+from pykcp.kcp import KCP, IKCP_OVERHEAD
+from pykcp.batch import DatagramReceiver, DatagramSender, recv_datagrams, send_datagram
+from pykcp.metrics import ServerMetrics
+from pykcp.bytestream import KCPByteStream
+from pykcp.stream import KCPStream, IKCP_HANDSHAKE_KEYWORD,\
+        IKCP_HIGH_WATERMARK, IKCP_LOW_WATERMARK
+
+IKCP_CONV_FORMAT = '<I'
+IKCP_WORKER_BITS = 8
+IKCP_WORKER_SHIFT = 32 - IKCP_WORKER_BITS
+IKCP_CONV_MASK = (1 << IKCP_WORKER_SHIFT) - 1
+IKCP_FORWARD_HEAD = struct.Struct('!BH')
+
+def bind_udp_socket(port, address=None, family=socket.AF_UNSPEC, reuse_port=False):
+    '''
+    Create a non-blocking datagram socket bound to the given port
+    '''
+    if not address:
+        address = None
+    family, socktype, proto, _, sockaddr = socket.getaddrinfo(address, port, family,\
+            socket.SOCK_DGRAM, 0, socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setblocking(False)
+    sock.bind(sockaddr)
+    return sock
+
+def forward_path(prefix, worker_id):
+    '''
+    Unix socket address of a worker
+    '''
+    return '%s.%d' % (prefix, worker_id)
+
+def default_forward_prefix(port):
+    '''
+    Abstract unix socket namespace on linux, temp directory elsewhere
+    '''
+    if sys.platform.startswith('linux'):
+        return '\0pykcp.%d' % port
+    return os.path.join(tempfile.gettempdir(), 'pykcp.%d' % port)
+
+class UDPServer(object):
+    '''
+    UDP Server
+    '''
+
+    def __init__(self, scheduler=None, precise=False, batch=False,\
+            high_watermark=IKCP_HIGH_WATERMARK, low_watermark=IKCP_LOW_WATERMARK,\
+            stream_mode=False, lifecycle=None):
+        self.conv = 0
+        self.kcpstream_dct = {}
+        self.address_dct = {}
+        self.socket = None
+        self.ioloop = None
+        self.scheduler = scheduler
+        self.precise = precise
+        self.batch = batch
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.stream_mode = stream_mode
+        self.lifecycle = lifecycle
+        self.sender = None
+        self.receiver = None
+        self.server_metrics = ServerMetrics()
+        self.worker_id = 0
+        self.workers = 1
+        self.forward_socket = None
+        self.forward_prefix = None
+        self.bind_args = None
+
+    def listen(self, port, address=None):
+        '''
+        Listen
+        '''
+        self.add_socket(bind_udp_socket(port, address))
+
+    def bind(self, port, address=None, forward_prefix=None):
+        '''
+        Bind when the server starts, see start
+        '''
+        self.bind_args = (port, address, forward_prefix)
+
+    def start(self, num_processes=1, max_restarts=None):
+        '''
+        Start num_processes workers sharing the bound port
+
+        None or a value <= 0 starts one worker per CPU. Workers are forked by
+        tornado.process.fork_processes, so no IOLoop may exist before.
+        '''
+        assert self.bind_args, 'Call bind first'
+        if num_processes is None or num_processes <= 0:
+            num_processes = tornado.process.cpu_count()
+        assert num_processes <= 1 << IKCP_WORKER_BITS
+        worker_id = 0
+        if num_processes > 1:
+            worker_id = tornado.process.fork_processes(num_processes, max_restarts)
+        self.start_worker(worker_id, num_processes)
+
+    def start_worker(self, worker_id, workers):
+        '''
+        Serve as worker worker_id of workers
+        '''
+        port, address, forward_prefix = self.bind_args
+        self.worker_id = worker_id
+        self.workers = workers
+        self.add_socket(bind_udp_socket(port, address, reuse_port=workers > 1))
+        if workers > 1:
+            if forward_prefix is None:
+                forward_prefix = default_forward_prefix(self.socket.getsockname()[1])
+            self.forward_prefix = forward_prefix
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            path = forward_path(forward_prefix, worker_id)
+            if not path.startswith('\0') and os.path.exists(path):
+                os.unlink(path)
+            sock.bind(path)
+            self.forward_socket = sock
+            self.ioloop.add_handler(sock.fileno(), self.handle_forward_events, IOLoop.READ)
+
+    def add_socket(self, sock):
+        '''
+        Serve on an already bound datagram socket
+        '''
+        assert self.socket is None
+        sock.setblocking(False)
+        self.socket = sock
+        self.ioloop = IOLoop.current()
+        if self.batch:
+            self.sender = DatagramSender(sock, self.ioloop)
+            self.receiver = DatagramReceiver(sock)
+        self.ioloop.add_handler(sock.fileno(), self.handle_events, IOLoop.READ)
+
+    def stop(self):
+        '''
+        Stop
+        '''
+        for kcpstream in list(self.kcpstream_dct.values()):
+            kcpstream.close()
+            self.server_metrics.retire(kcpstream.kcp)
+        self.kcpstream_dct.clear()
+        self.address_dct.clear()
+        if self.socket:
+            if self.sender:
+                self.sender.flush()
+            self.ioloop.remove_handler(self.socket.fileno())
+            self.socket.close()
+            self.socket = None
+            self.sender = None
+            self.receiver = None
+        if self.forward_socket:
+            path = self.forward_socket.getsockname()
+            self.ioloop.remove_handler(self.forward_socket.fileno())
+            self.forward_socket.close()
+            self.forward_socket = None
+            # abstract namespace addresses come back as bytes
+            if isinstance(path, str) and path:
+                os.unlink(path)
+
+    def handle_events(self, fd, events):
+        '''
+        Handle socket events
+        '''
+        if self.receiver:
+            self.receiver.recv(self.handle_datagram)
+        else:
+            recv_datagrams(self.socket, self.handle_datagram)
+
+    def handle_datagram(self, data, address):
+        '''
+        Route a datagram to its KCP object by conv
+        '''
+        if len(data) < IKCP_OVERHEAD:
+            if data == IKCP_HANDSHAKE_KEYWORD:
+                self.handle_handshake(address)
+            return
+        conv = struct.unpack_from(IKCP_CONV_FORMAT, data)[0]
+        kcpstream = self.kcpstream_dct.get(conv)
+        if kcpstream is None:
+            worker_id = conv >> IKCP_WORKER_SHIFT
+            if self.forward_socket and worker_id != self.worker_id\
+                    and worker_id < self.workers:
+                self.forward(worker_id, data, address)
+            return
+        if kcpstream.address == address:
+            kcpstream.input(data)
+            return
+        kcp = kcpstream.kcp
+        rcv_nxt, snd_una = kcp.rcv_nxt, kcp.snd_una
+        # convs are easy to guess, only a packet moving the conversation
+        # forward proves the peer moved
+        if kcpstream.input(data) >= 0 and\
+                (kcp.rcv_nxt != rcv_nxt or kcp.snd_una != snd_una):
+            # peer NAT rebinding, follow the conversation
+            self.address_dct.pop(kcpstream.address, None)
+            self.address_dct[address] = conv
+            kcpstream.address = address
+
+    def handle_handshake(self, address):
+        '''
+        Handle handshake, a repeated handshake gets the same conv again
+        '''
+        conv = self.address_dct.get(address)
+        if conv is None:
+            conv = self.create_conv()
+            stream_class = KCPByteStream if self.stream_mode else KCPStream
+            # output is looked up on every packet, not bound once, so a
+            # profiler wrapping it times the sessions it did not see start
+            output = lambda kcp, data: self.output(kcp, data)
+            kcpstream = stream_class(KCP(conv, output), None, address,\
+                    ioloop=self.ioloop, callback=self.handle_message,\
+                    batch_callback=self.handle_messages,\
+                    scheduler=self.scheduler, precise=self.precise,\
+                    high_watermark=self.high_watermark, low_watermark=self.low_watermark,\
+                    pause_callback=self.on_pause, writable_callback=self.on_writable,\
+                    lifecycle=self.lifecycle)
+            self.kcpstream_dct[conv] = kcpstream
+            self.address_dct[address] = conv
+            if self.lifecycle is not None:
+                self.lifecycle.add(kcpstream, self.close_stream)
+            kcpstream.update()
+            if self.stream_mode:
+                future = self.handle_byte_stream(kcpstream)
+                if future is not None:
+                    self.ioloop.add_future(gen.convert_yielded(future),\
+                            lambda future: future.result())
+        send_datagram(self.socket, b'%d\n\n\n' % conv, address)
+
+    def handle_forward_events(self, fd, events):
+        '''
+        Handle datagrams forwarded by other workers
+        '''
+        recv_datagrams(self.forward_socket, self.handle_forward)
+
+    def handle_forward(self, data, address):
+        '''
+        Handle a forwarded datagram as if it came from its peer
+        '''
+        if len(data) < IKCP_FORWARD_HEAD.size:
+            return
+        host_len, port = IKCP_FORWARD_HEAD.unpack_from(data)
+        offset = IKCP_FORWARD_HEAD.size + host_len
+        host = data[IKCP_FORWARD_HEAD.size:offset].decode()
+        data = data[offset:]
+        if len(data) < IKCP_OVERHEAD:
+            return
+        # never forward twice
+        if struct.unpack_from(IKCP_CONV_FORMAT, data)[0] in self.kcpstream_dct:
+            self.handle_datagram(data, (host, port))
+
+    def forward(self, worker_id, data, address):
+        '''
+        Forward a datagram to the worker owning its conv
+        '''
+        host = address[0].encode()
+        head = IKCP_FORWARD_HEAD.pack(len(host), address[1])
+        try:
+            self.forward_socket.sendto(head + host + bytes(data),\
+                    forward_path(self.forward_prefix, worker_id))
+        except OSError:
+            # worker is restarting, KCP retransmits
+            pass
+
+    def create_conv(self):
+        '''
+        Create conv, the high bits are the worker id
+        '''
+        while True:
+            self.conv = (self.conv + 1) & IKCP_CONV_MASK
+            conv = (self.worker_id << IKCP_WORKER_SHIFT) | self.conv
+            if self.conv and conv not in self.kcpstream_dct:
+                return conv
+
+    def close_stream(self, kcpstream):
+        '''
+        Close a session and forget its conv
+        '''
+        kcpstream.close()
+        conv = kcpstream.kcp.conv
+        if self.kcpstream_dct.pop(conv, None) is kcpstream:
+            self.server_metrics.retire(kcpstream.kcp)
+        if self.address_dct.get(kcpstream.address) == conv:
+            del self.address_dct[kcpstream.address]
+
+    def metrics(self):
+        '''
+        Counters and gauges summed over every session, see pykcp.metrics
+        '''
+        return self.server_metrics.collect(kcpstream.kcp\
+                for kcpstream in self.kcpstream_dct.values())
+
+    def handle_messages(self, kcpstream, messages):
+        '''
+        Handle every message received in one update
+        '''
+        for message in messages:
+            self.handle_message(kcpstream, message)
+
+    def handle_message(self, kcpstream, message):
+        '''
+        Handle message
+        '''
+        raise NotImplementedError()
+
+    def handle_byte_stream(self, kcpstream):
+        '''
+        Handle a session of a stream_mode server, a KCPByteStream read and
+        written directly, may be a coroutine
+        '''
+        raise NotImplementedError()
+
+    def on_pause(self, kcpstream):
+        '''
+        waitsnd() of a session reached the high watermark, stop producing
+        for it until on_writable
+        '''
+
+    def on_writable(self, kcpstream):
+        '''
+        waitsnd() of a paused session is down to the low watermark
+        '''
+
+    def output(self, kcp, data):
+        '''
+        Output
+        '''
+        kcpstream = self.kcpstream_dct.get(kcp.conv)
+        if kcpstream and self.socket:
+            if self.sender:
+                self.sender.send(data, kcpstream.address)
+            else:
+                send_datagram(self.socket, data, kcpstream.address)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 leenjewel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''
+Vectorized flush engine, needs numpy
+
+A KCPFlushEngine keeps the retransmission state of the segments in flight
+(resendts, rto, fastack, xmit) of many VectorKCP sessions in numpy arrays,
+one row per session and one column per sn modulo the window. One flush of
+the engine finds the first transmissions, timeouts and fast retransmissions
+of every session with a few array operations, only the segments to send are
+touched by Python.
+
+    engine = KCPFlushEngine()
+    kcp = VectorKCP(conv, output, engine)
+    ...
+    engine.update(current)  # instead of kcp.update(current) for each session
+
+The wire output of every session is the same as the one of KCP, a pacing
+controller holds back the retransmissions beyond its quota here too.
+'''
+
+from pykcp.kcp import KCP, IKCP_WND_RCV
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HAS_NUMPY = numpy is not None
+
+class KCPFlushEngine(object):
+    '''
+    Struct of arrays of the segments in flight of many sessions
+    '''
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, window=IKCP_WND_RCV, sessions=64):
+        if numpy is None:
+            raise RuntimeError('KCPFlushEngine needs numpy')
+        width = 1
+        while width < window:
+            width <<= 1
+        self.width = width
+        self.mask = width - 1
+        self.kcps = []
+        self.free_rows = []
+        self.active = numpy.zeros((sessions, width), dtype=bool)
+        self.xmit = numpy.zeros((sessions, width), dtype=numpy.int64)
+        self.resendts = numpy.zeros((sessions, width), dtype=numpy.int64)
+        self.rto = numpy.zeros((sessions, width), dtype=numpy.int64)
+        self.fastack = numpy.zeros((sessions, width), dtype=numpy.int64)
+
+    def register(self, kcp):
+        '''
+        Give a session a row, return the row
+        '''
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.kcps[row] = kcp
+            return row
+        row = len(self.kcps)
+        if row == len(self.active):
+            for name in ('active', 'xmit', 'resendts', 'rto', 'fastack'):
+                array = getattr(self, name)
+                setattr(self, name, numpy.concatenate((array, numpy.zeros_like(array))))
+        self.kcps.append(kcp)
+        return row
+
+    def unregister(self, kcp):
+        '''
+        Free the row of a session
+        '''
+        row = kcp.row
+        if row is not None and self.kcps[row] is kcp:
+            self.kcps[row] = None
+            self.active[row] = False
+            self.free_rows.append(row)
+            kcp.row = None
+
+    def columns(self, first, last):
+        '''
+        Columns of sn first to last (exclusive) as a slice or an index array
+        '''
+        count = last - first
+        if count >= self.width:
+            return slice(None)
+        start = first & self.mask
+        if start + count <= self.width:
+            return slice(start, start + count)
+        return numpy.arange(first, last) & self.mask
+
+    def update(self, current):
+        '''
+        Update every session, the ones due to flush are flushed together
+        '''
+        kcps = []
+        for kcp in self.kcps:
+            if kcp is not None and kcp.flush_due(current):
+                kcps.append(kcp)
+        if kcps:
+            self.flush(kcps)
+
+    def flush(self, kcps):
+        '''
+        Flush sessions at their current time
+        '''
+
+        # pylint: disable=too-many-locals
+
+        pending = []
+        for kcp in kcps:
+            if not kcp.updated:
+                continue
+            wnd = kcp.wnd_unused()
+            offset = kcp.flush_control(wnd)
+            cwnd = kcp.move_snd_queue(kcp.current, wnd)
+            quota = None
+            if kcp.congestion.pacing:
+                quota = kcp.congestion.send_quota(kcp, kcp.current)
+            pending.append((kcp, wnd, offset, cwnd, quota))
+        if not pending:
+            return
+
+        rows = numpy.array([item[0].row for item in pending])
+        current = numpy.array([[item[0].current] for item in pending])
+        rx_rto = numpy.array([[item[0].rx_rto] for item in pending])
+        nodelay = numpy.array([[bool(item[0].nodelay)] for item in pending])
+        resent = numpy.array([[item[0].fastresend if item[0].fastresend > 0 else 0xffffffff]\
+                for item in pending])
+        dead_link = numpy.array([[item[0].dead_link] for item in pending])
+
+        active = self.active[rows]
+        xmit = self.xmit[rows]
+        resendts = self.resendts[rows]
+        rto = self.rto[rows]
+        fastack = self.fastack[rows]
+
+        first = active & (xmit == 0)
+        later = active & ~first
+        expired = (((current - resendts + 0x80000000) & 0xffffffff) - 0x80000000) >= 0
+        timeout = later & expired
+        fast = later & ~expired & (fastack >= resent)
+        for i, item in enumerate(pending):
+            if item[4] is not None:
+                self.hold_back(item[0], timeout[i], fast[i], item[4])
+        send = first | timeout | fast
+
+        rtomin = numpy.where(nodelay, 0, rx_rto >> 3)
+        rto = numpy.where(first, rx_rto, rto)
+        rto = numpy.where(timeout, rto + numpy.where(nodelay, rx_rto // 2, rx_rto), rto)
+        resendts = numpy.where(first, current + rto + rtomin,\
+                numpy.where(timeout | fast, current + rto, resendts)) & 0xffffffff
+        xmit = xmit + send
+
+        self.xmit[rows] = xmit
+        self.rto[rows] = rto
+        self.resendts[rows] = resendts
+        self.fastack[rows] = numpy.where(fast, 0, fastack)
+
+        lost = timeout.any(axis=1).tolist()
+        change = fast.any(axis=1).tolist()
+        timeouts = timeout.sum(axis=1).tolist()
+        fasts = fast.sum(axis=1).tolist()
+        dead = (send & (xmit >= dead_link)).any(axis=1).tolist()
+        sending = send.any(axis=1).tolist()
+
+        mask = self.mask
+        for i, (kcp, wnd, offset, cwnd, _) in enumerate(pending):
+            if sending[i]:
+                kcp.xmit += timeouts[i]
+                kcp.fast_xmit += fasts[i]
+                una = kcp.snd_una
+                base = una & mask
+                get = kcp.snd_buf.get
+                sns = [una + ((column - base) & mask) for column in send[i].nonzero()[0].tolist()]
+                sns.sort()
+                for sn in sns:
+                    offset = kcp.flush_segment(get(sn), offset, kcp.current, wnd)
+                if dead[i] and kcp.state != -1:
+                    kcp.state = -1
+                    kcp.dead_events += 1
+            kcp.flush_done(offset, cwnd, change[i], lost[i])
+
+    def hold_back(self, kcp, timeout, fast, quota):
+        '''
+        Clear the retransmissions of a session beyond quota, in place, the
+        first ones in sn order go as in KCP.flush
+        '''
+        order = (numpy.arange(self.width) + kcp.snd_una) & self.mask
+        resend = (timeout | fast)[order]
+        held = numpy.zeros_like(resend)
+        held[order] = resend & (numpy.cumsum(resend) > quota)
+        timeout &= ~held
+        fast &= ~held
+
+class VectorKCP(KCP):
+    '''
+    KCP whose segments in flight live in a KCPFlushEngine
+    '''
+
+    __slots__ = ('engine', 'row')
+
+    def __init__(self, conv, output, engine, pool=None):
+        KCP.__init__(self, conv, output, pool)
+        self.engine = engine
+        self.row = engine.register(self)
+
+    def release(self):
+        '''
+        Give the segments back to the pool and the row back to the engine
+        '''
+        KCP.release(self)
+        self.engine.unregister(self)
+
+    def input(self, data):
+        if self.row is None:
+            # released, a row index of None would hit every session
+            return -1
+        return KCP.input(self, data)
+
+    def flush(self, current=None):
+        '''
+        flush this session alone, nothing once released
+        '''
+        if self.row is None:
+            return
+        if current is not None:
+            self.current = current & 0xffffffff
+        self.engine.flush([self])
+
+    def move_snd_queue(self, current, wnd):
+        snd_nxt = self.snd_nxt
+        cwnd = KCP.move_snd_queue(self, current, wnd)
+        if self.snd_nxt != snd_nxt:
+            engine = self.engine
+            columns = engine.columns(snd_nxt, self.snd_nxt)
+            engine.active[self.row, columns] = True
+            engine.xmit[self.row, columns] = 0
+            engine.fastack[self.row, columns] = 0
+            engine.rto[self.row, columns] = self.rx_rto
+            engine.resendts[self.row, columns] = current
+        return cwnd
+
+    def parse_ack(self, sn):
+        if sn - self.snd_una < 0 or sn - self.snd_nxt >= 0:
+            return
+
+        seg = self.snd_buf.pop(sn)
+        if seg is not None:
+            self.nsnd_buf -= 1
+            self.pool.put(seg)
+            self.engine.active[self.row, sn & self.engine.mask] = False
+
+    def parse_una(self, una):
+        if una - self.snd_nxt > 0:
+            una = self.snd_nxt
+        snd_una = self.snd_una
+        KCP.parse_una(self, una)
+        if una - snd_una > 0:
+            self.engine.active[self.row, self.engine.columns(snd_una, una)] = False
+
+    def parse_fastack(self, sn):
+        if sn - self.snd_una < 0 or sn - self.snd_nxt >= 0:
+            return
+
+        # slots not in flight are reset when a segment moves in
+        self.engine.fastack[self.row, self.engine.columns(self.snd_una, sn)] += 1
+
+    def resend_delay(self, current):
+        engine = self.engine
+        active = engine.active[self.row]
+        if not active.any():
+            return 0x7fffffff
+        diff = ((engine.resendts[self.row][active] - current + 0x80000000) & 0xffffffff)\
+                - 0x80000000
+        return int(diff.min())
+
+    def set_wndsize(self, sndwnd=32, rcvwnd=32):
+        if sndwnd > self.engine.width:
+            raise ValueError('sndwnd is wider than the engine window')
+        KCP.set_wndsize(self, sndwnd, rcvwnd)
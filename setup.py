@@ -21,21 +21,63 @@ except ImportError :
     setuptools = None
     from distutils.core import setup
 
+import os
+import platform
+import sys
+
 kwargs = {}
 
+# pykcp/kcp.py and pykcp/clock.py are compiled with Cython when it is
+# installed, their .pxd files declare the types. Any failure falls back to the pure Python module,
+# PYKCP_EXTENSION=0 skips the build.
+try :
+    from Cython.Build import cythonize
+except ImportError :
+    cythonize = None
+
+if setuptools is not None and cythonize is not None and \
+        platform.python_implementation() == "CPython" and \
+        os.environ.get("PYKCP_EXTENSION") != "0" :
+    from setuptools.command.build_ext import build_ext
+
+    class optional_build_ext(build_ext) :
+
+        def run(self) :
+            try :
+                build_ext.run(self)
+            except Exception as e :
+                self.warn_pure(e)
+
+        def build_extension(self, ext) :
+            try :
+                build_ext.build_extension(self, ext)
+            except Exception as e :
+                self.warn_pure(e)
+
+        def warn_pure(self, e) :
+            sys.stderr.write("pykcp: building the compiled kcp module failed (%s), "
+                    "using the pure Python one\n" % e)
+
+    try :
+        kwargs["ext_modules"] = cythonize(["pykcp/clock.py", "pykcp/kcp.py"],
+                compiler_directives = {"language_level" : 3}, quiet = True)
+        kwargs["cmdclass"] = {"build_ext" : optional_build_ext}
+    except Exception as e :
+        sys.stderr.write("pykcp: cythonize failed (%s), using the pure Python kcp\n" % e)
+
 version = "1.0.0"
 
 setup(
     name = "pykcp",
     version = version,
     packages = ["pykcp"],
-    package_data = {},
+    package_data = {"pykcp" : ["clock.pxd", "kcp.pxd"]},
     author = "leenjewel",
     author_email = "leenjewel@gmail.com",
     url="https://github.com/leenjewel/pykcp",
     license="http://www.apache.org/licenses/LICENSE-2.0",
     description="PyKCP is a KCP protocol by python",
-    install_requires=["tornado"]
+    install_requires=["tornado"],
     **kwargs
 )
 